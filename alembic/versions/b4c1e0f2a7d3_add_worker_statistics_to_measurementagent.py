@@ -0,0 +1,29 @@
+"""add worker_statistics to MeasurementAgent
+
+Revision ID: b4c1e0f2a7d3
+Revises: 8a9c14d43b43
+Create Date: 2026-10-17 09:12:44.518302
+
+"""
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b4c1e0f2a7d3"
+down_revision = "8a9c14d43b43"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "measurement_agent",
+        sa.Column("worker_statistics", JSONB(), nullable=False, server_default="{}"),
+    )
+
+
+def downgrade():
+    op.drop_column("measurement_agent", "worker_statistics")
@@ -0,0 +1,28 @@
+"""add priority to Measurement
+
+Revision ID: c7d2e9a4f1b6
+Revises: b4c1e0f2a7d3
+Create Date: 2026-10-17 10:02:31.174519
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c7d2e9a4f1b6"
+down_revision = "b4c1e0f2a7d3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "measurement",
+        sa.Column("priority", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade():
+    op.drop_column("measurement", "priority")
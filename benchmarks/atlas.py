@@ -0,0 +1,85 @@
+"""
+Compare the probe grouping of the RIPE Atlas backend with the previous
+implementation, based on sets of flows and TTLs, on a synthetic probes file.
+
+    python -m benchmarks.atlas --probes 50000000 --output atlas.json
+
+Each implementation runs in a new process, so that its peak memory is measured alone.
+"""
+
+import argparse
+import json
+import resource
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Iterable
+from ipaddress import IPv6Address
+from multiprocessing import get_context
+from pathlib import Path
+
+from benchmarks.synthetic import write_probes_file
+from iris.agent.backend.atlas import group_probes
+from iris.commons.utils import zstd_stream_reader_text
+
+
+def group_probes_sets(lines: Iterable[str]) -> dict:
+    targets: dict = defaultdict(lambda: (set(), set()))
+    for line in lines:
+        dst_addr, src_port, dst_port, ttl, protocol = line.strip().split(",")
+        dst_addr_v6 = IPv6Address(dst_addr)
+        dst_addr = (
+            str(dst_addr_v6.ipv4_mapped)
+            if dst_addr_v6.ipv4_mapped
+            else str(dst_addr_v6)
+        )
+        targets[(dst_addr, protocol)][0].add((int(src_port), int(dst_port)))
+        targets[(dst_addr, protocol)][1].add(int(ttl))
+    return {
+        k: (len(flows), min(ttls), max(ttls)) for k, (flows, ttls) in targets.items()
+    }
+
+
+IMPLEMENTATIONS = {"arrays": group_probes, "sets": group_probes_sets}
+
+
+def benchmark(probes_file: Path, implementation: str) -> dict:
+    start = time.perf_counter()
+    with zstd_stream_reader_text(probes_file) as f:
+        groups = IMPLEMENTATIONS[implementation](f)
+    duration = time.perf_counter() - start
+    return {
+        "implementation": implementation,
+        "groups": len(groups),
+        "duration": duration,
+        # Kilobytes on Linux.
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--probes", type=int, default=50_000_000)
+    parser.add_argument(
+        "--implementations",
+        nargs="+",
+        choices=list(IMPLEMENTATIONS),
+        default=list(IMPLEMENTATIONS),
+    )
+    parser.add_argument("--directory", type=Path, default=Path("iris_data/benchmarks"))
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    args = parser.parse_args(args)
+
+    args.directory.mkdir(parents=True, exist_ok=True)
+    probes_file = write_probes_file(
+        args.directory / f"probes_{args.probes}.csv.zst", args.probes
+    )
+    report = []
+    for implementation in args.implementations:
+        with get_context("spawn").Pool(1) as pool:
+            report.append(pool.apply(benchmark, (probes_file, implementation)))
+    json.dump(report, args.output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
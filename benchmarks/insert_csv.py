@@ -0,0 +1,79 @@
+"""
+Compare the `ClickHouse.insert_csv` modes on a synthetic results file.
+
+    python -m benchmarks.insert_csv --replies 10000000 --output insert_csv.json
+
+The ClickHouse instance is configured through the usual `CLICKHOUSE_*` variables.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from diamond_miner.queries import results_table
+
+from benchmarks.synthetic import write_results_file
+from iris.commons.clickhouse import ClickHouse, measurement_id
+from iris.commons.logger import Adapter, base_logger
+from iris.commons.settings import CommonSettings
+
+MODES = ["compressed", "split", "stream"]
+
+
+async def benchmark(
+    settings: CommonSettings, results_file: Path, mode: str, repeat: int
+) -> dict:
+    logger = Adapter(base_logger, dict(component="benchmark"))
+    settings = settings.model_copy(update={"CLICKHOUSE_INSERT_CSV_MODE": mode})
+    clickhouse = ClickHouse(settings, logger)
+    durations = []
+    for _ in range(repeat):
+        measurement_uuid, agent_uuid = str(uuid4()), str(uuid4())
+        await clickhouse.create_tables(measurement_uuid, agent_uuid, 24, 64, drop=True)
+        start = time.perf_counter()
+        await clickhouse.insert_csv(measurement_uuid, agent_uuid, results_file)
+        durations.append(time.perf_counter() - start)
+        rows = await clickhouse.call(
+            "SELECT count() AS count FROM {table:Identifier}",
+            params={
+                "table": results_table(measurement_id(measurement_uuid, agent_uuid))
+            },
+        )
+        await clickhouse.drop_tables(measurement_uuid, agent_uuid)
+    return {
+        "mode": mode,
+        "rows": rows[0]["count"],
+        "file_size": results_file.stat().st_size,
+        "durations": durations,
+        "rows_per_second": rows[0]["count"] / min(durations),
+    }
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--replies", type=int, default=1_000_000)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--directory", type=Path, default=Path("iris_data/benchmarks"))
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.WARNING)
+    args.directory.mkdir(parents=True, exist_ok=True)
+    results_file = write_results_file(
+        args.directory / f"results_{args.replies}.csv.zst", args.replies
+    )
+    settings = CommonSettings()
+    report = [
+        asyncio.run(benchmark(settings, results_file, mode, args.repeat))
+        for mode in args.modes
+    ]
+    json.dump(report, args.output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
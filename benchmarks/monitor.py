@@ -0,0 +1,99 @@
+"""Per-stage wall time, memory and disk usage measurements."""
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import psutil
+
+
+@dataclass
+class Stage:
+    name: str
+    duration: float = 0.0
+    """Wall time in seconds."""
+    rows: int | None = None
+    """Number of rows (replies, links, probes, ...) processed by the stage."""
+    peak_rss: int = 0
+    """Peak resident memory of the process and its children, in bytes."""
+    peak_disk: int = 0
+    """Peak disk usage of the working directory above its initial size, in bytes."""
+
+    @property
+    def rows_per_second(self) -> float | None:
+        """
+        >>> Stage("insert_csv", duration=2.0, rows=10).rows_per_second
+        5.0
+        >>> Stage("insert_csv").rows_per_second is None
+        True
+        """
+        if self.rows is None or not self.duration:
+            return None
+        return self.rows / self.duration
+
+    def dict(self) -> dict:
+        return {**asdict(self), "rows_per_second": self.rows_per_second}
+
+
+def directory_size(path: Path) -> int:
+    """
+    Total size of the files in a directory, ignoring the files removed during the walk.
+
+    >>> directory_size(Path("/nonexistent"))
+    0
+    """
+    size = 0
+    for file in path.rglob("*"):
+        try:
+            if file.is_file():
+                size += file.stat().st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+
+def tree_rss(process: psutil.Process) -> int:
+    """Resident memory of a process and of its children."""
+    rss = 0
+    for p in [process, *process.children(recursive=True)]:
+        try:
+            rss += p.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+
+@contextmanager
+def measure(
+    stages: list[Stage], name: str, directory: Path, *, interval: float = 0.1
+) -> Iterator[Stage]:
+    """
+    Measure a stage and append it to `stages`.
+    Memory and disk usage are sampled every `interval` seconds in a background thread.
+    """
+    stage = Stage(name)
+    process = psutil.Process()
+    initial_disk = directory_size(directory)
+    stop = threading.Event()
+
+    def sample() -> None:
+        while True:
+            stage.peak_rss = max(stage.peak_rss, tree_rss(process))
+            stage.peak_disk = max(
+                stage.peak_disk, directory_size(directory) - initial_disk
+            )
+            if stop.wait(interval):
+                break
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    start = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        stage.duration = time.perf_counter() - start
+        stop.set()
+        thread.join()
+        stages.append(stage)
@@ -0,0 +1,190 @@
+"""
+Benchmark the stages of a worker round on synthetic results files.
+
+    python -m benchmarks.pipeline --replies 1000000 10000000 --output pipeline.json
+
+The stages are run against the ClickHouse and S3 (e.g. MinIO) instances configured
+through the usual `CLICKHOUSE_*` and `S3_*` variables, such as the ones started by
+`docker compose up clickhouse minio`. The report is a JSON list with one entry
+per results file size, containing the wall time, the number of rows per second,
+the peak RSS and the temporary disk usage of each stage.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import shutil
+import sys
+from pathlib import Path
+from uuid import uuid4
+
+from diamond_miner.generators import probe_generator_parallel
+from diamond_miner.insert import insert_mda_probe_counts
+from diamond_miner.queries import (
+    links_table,
+    prefixes_table,
+    probes_table,
+    results_table,
+)
+from pych_client import ClickHouseClient
+
+from benchmarks.monitor import Stage, measure
+from benchmarks.synthetic import write_results_file
+from iris import __version__
+from iris.commons.clickhouse import ClickHouse, measurement_id
+from iris.commons.logger import Adapter, base_logger
+from iris.commons.models import Round, ToolParameters
+from iris.commons.settings import CommonSettings
+from iris.commons.storage import Storage, next_round_key, results_key
+from iris.worker.inner_pipeline.diamond_miner import instantiate_flow_mappers
+
+
+async def count(clickhouse: ClickHouse, table: str, where: str = "1") -> int:
+    rows = await clickhouse.call(
+        f"SELECT count() AS count FROM {{table:Identifier}} WHERE {where}",
+        params={"table": table},
+    )
+    return int(rows[0]["count"])
+
+
+async def benchmark_round(
+    settings: CommonSettings,
+    directory: Path,
+    results_file: Path,
+    n_replies: int,
+    tool_parameters: ToolParameters,
+) -> list[Stage]:
+    """Run the stages of a round 2 computation from the results of round 1."""
+    logger = Adapter(base_logger, dict(component="benchmark"))
+    clickhouse = ClickHouse(settings, logger)
+    async with Storage.open(settings, logger) as storage:
+        measurement_uuid, agent_uuid = str(uuid4()), str(uuid4())
+        measurement_id_ = measurement_id(measurement_uuid, agent_uuid)
+        bucket = storage.measurement_agent_bucket(measurement_uuid, agent_uuid)
+        working_directory = directory / measurement_id_
+        working_directory.mkdir(parents=True)
+
+        previous_round = Round(number=1, limit=0, offset=0)
+        next_round = previous_round.next_round()
+        flow_mapper_v4, flow_mapper_v6 = instantiate_flow_mappers(
+            tool_parameters.flow_mapper.value,
+            tool_parameters.flow_mapper_kwargs or {},
+            tool_parameters.prefix_size_v4,
+            tool_parameters.prefix_size_v6,
+        )
+
+        stages: list[Stage] = []
+        await storage.create_bucket(bucket)
+        await clickhouse.create_tables(
+            measurement_uuid,
+            agent_uuid,
+            tool_parameters.prefix_len_v4,
+            tool_parameters.prefix_len_v6,
+            drop=True,
+        )
+        try:
+            with measure(stages, "upload_results", working_directory) as stage:
+                await storage.upload_file(
+                    bucket, results_key(previous_round), results_file
+                )
+                stage.rows = n_replies
+
+            with measure(stages, "download_results", working_directory) as stage:
+                results_filepath = await storage.download_file_to(
+                    bucket, results_key(previous_round), working_directory
+                )
+                stage.rows = n_replies
+
+            with measure(stages, "insert_csv", working_directory) as stage:
+                await clickhouse.insert_csv(
+                    measurement_uuid, agent_uuid, results_filepath
+                )
+                stage.rows = await count(clickhouse, results_table(measurement_id_))
+
+            with measure(stages, "insert_prefixes", working_directory) as stage:
+                await clickhouse.insert_prefixes(measurement_uuid, agent_uuid)
+                stage.rows = await count(clickhouse, prefixes_table(measurement_id_))
+
+            with measure(stages, "insert_links", working_directory) as stage:
+                await clickhouse.insert_links(measurement_uuid, agent_uuid)
+                stage.rows = await count(clickhouse, links_table(measurement_id_))
+
+            with ClickHouseClient(**settings.clickhouse) as client:
+                with measure(stages, "insert_probe_counts", working_directory) as stage:
+                    insert_mda_probe_counts(
+                        client=client,
+                        measurement_id=measurement_id_,
+                        previous_round=previous_round.number,
+                        target_epsilon=tool_parameters.failure_probability,
+                        adaptive_eps=True,
+                    )
+                    stage.rows = await count(
+                        clickhouse,
+                        probes_table(measurement_id_),
+                        f"round = {next_round.number}",
+                    )
+
+                probes_filepath = working_directory / next_round_key(next_round)
+                with measure(stages, "probe_generation", working_directory) as stage:
+                    stage.rows = probe_generator_parallel(
+                        filepath=probes_filepath,
+                        client=client,
+                        measurement_id=measurement_id_,
+                        round_=next_round.number,
+                        mapper_v4=flow_mapper_v4,
+                        mapper_v6=flow_mapper_v6,
+                        probe_src_port=tool_parameters.initial_source_port,
+                        probe_dst_port=tool_parameters.destination_port,
+                    )
+
+            with measure(stages, "upload_probes", working_directory) as stage:
+                if probes_filepath.exists():
+                    await storage.upload_file(
+                        bucket, probes_filepath.name, probes_filepath
+                    )
+                stage.rows = stages[-1].rows
+        finally:
+            await clickhouse.drop_tables(measurement_uuid, agent_uuid)
+            await storage.delete_bucket_with_files(bucket)
+            shutil.rmtree(working_directory)
+    return stages
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--replies", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--directory", type=Path, default=Path("iris_data/benchmarks"))
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.WARNING)
+    args.directory.mkdir(parents=True, exist_ok=True)
+    settings = CommonSettings()
+    tool_parameters = ToolParameters()
+    report = []
+    for n_replies in args.replies:
+        results_file = write_results_file(
+            args.directory / f"results_{n_replies}.csv.zst", n_replies
+        )
+        stages = asyncio.run(
+            benchmark_round(
+                settings, args.directory, results_file, n_replies, tool_parameters
+            )
+        )
+        report.append(
+            {
+                "version": __version__,
+                "replies": n_replies,
+                "results_file_size": results_file.stat().st_size,
+                "settings": {
+                    "CLICKHOUSE_INSERT_CSV_MODE": settings.CLICKHOUSE_INSERT_CSV_MODE,
+                },
+                "stages": [stage.dict() for stage in stages],
+            }
+        )
+    json.dump(report, args.output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
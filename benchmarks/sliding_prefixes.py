@@ -0,0 +1,148 @@
+"""
+Compare the resolution of the sliding prefixes of the diamond-miner inner pipeline
+with the previous implementation, based on JSON rows and a radix tree,
+on a synthetic target list where every prefix is still to be probed.
+
+    python -m benchmarks.sliding_prefixes --prefixes 10000000 --output sliding.json
+
+The ClickHouse responses are generated in memory, in the format of each
+implementation, and the probe counts are not inserted.
+Each implementation runs in a new process, so that its peak memory is measured alone.
+"""
+
+import argparse
+import json
+import logging
+import resource
+import struct
+import sys
+import time
+from collections.abc import Iterator
+from ipaddress import IPv6Address
+from itertools import islice
+from multiprocessing import get_context
+from pathlib import Path
+
+import orjson
+
+from benchmarks.synthetic import write_targets_file
+from iris.worker.inner_pipeline.diamond_miner import resolve_prefixes
+from iris.worker.settings import WorkerSettings
+from iris.worker.tree import TargetIndex, load_targets, parse_prefix
+
+CHUNK_SIZE = 2**16
+
+
+def networks(targets_file: Path) -> Iterator[int]:
+    with targets_file.open() as f:
+        for line in f:
+            yield parse_prefix(line.split(",", 1)[0])[0]
+
+
+def json_response(targets_file: Path) -> Iterator[bytes]:
+    for network in networks(targets_file):
+        yield b'{"probe_dst_prefix":"%s"}' % str(IPv6Address(network)).encode()
+
+
+def rowbinary_response(targets_file: Path) -> Iterator[bytes]:
+    chunk = bytearray()
+    for network in networks(targets_file):
+        chunk += struct.pack(">QQ", network >> 64, network & (2**64 - 1))
+        if len(chunk) >= CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+    yield bytes(chunk)
+
+
+def resolve_tree(targets_file: Path) -> tuple[int, float]:
+    with targets_file.open() as f:
+        targets = load_targets(f, clamp_ttl_min=2, clamp_ttl_max=8)
+    response = list(json_response(targets_file))
+    start = time.perf_counter()
+    prefixes = []
+    for line in response:
+        row = orjson.loads(line)
+        addr_v6 = IPv6Address(row["probe_dst_prefix"])
+        if addr_v4 := addr_v6.ipv4_mapped:
+            prefix = f"{addr_v4}/24"
+        else:
+            prefix = f"{addr_v6}/64"
+        for protocol, ttls, n_initial_flows in targets[prefix]:
+            prefixes.append((prefix, protocol, ttls, n_initial_flows))
+    return len(prefixes), time.perf_counter() - start
+
+
+def resolve_index(targets_file: Path) -> tuple[int, float]:
+    targets = TargetIndex.open(targets_file)
+    response = list(rowbinary_response(targets_file))
+    start = time.perf_counter()
+    remainder = b""
+
+    # Same as `iter_prefixes`, on the in-memory response.
+    def prefixes_() -> Iterator[int]:
+        nonlocal remainder
+        for chunk in response:
+            data = remainder + chunk
+            end = len(data) - len(data) % 16
+            remainder = data[end:]
+            for hi, lo in struct.iter_unpack(">QQ", data[:end]):
+                yield hi << 64 | lo
+
+    prefixes = resolve_prefixes(
+        logging.getLogger(__name__),
+        targets,
+        prefixes_(),
+        prefix_len_v4=24,
+        prefix_len_v6=64,
+        clamp_ttl_min=2,
+        clamp_ttl_max=8,
+    )
+    batch_size = WorkerSettings().WORKER_PROBE_COUNTS_BATCH_SIZE
+    n_prefixes = 0
+    while batch := list(islice(prefixes, batch_size)):
+        n_prefixes += len(batch)
+    duration = time.perf_counter() - start
+    targets.close()
+    return n_prefixes, duration
+
+
+IMPLEMENTATIONS = {"index": resolve_index, "tree": resolve_tree}
+
+
+def benchmark(targets_file: Path, implementation: str) -> dict:
+    n_prefixes, duration = IMPLEMENTATIONS[implementation](targets_file)
+    return {
+        "implementation": implementation,
+        "prefixes": n_prefixes,
+        "duration": duration,
+        # Kilobytes on Linux.
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--prefixes", type=int, default=10_000_000)
+    parser.add_argument(
+        "--implementations",
+        nargs="+",
+        choices=list(IMPLEMENTATIONS),
+        default=list(IMPLEMENTATIONS),
+    )
+    parser.add_argument("--directory", type=Path, default=Path("iris_data/benchmarks"))
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    args = parser.parse_args(args)
+
+    args.directory.mkdir(parents=True, exist_ok=True)
+    targets_file = write_targets_file(
+        args.directory / f"targets_{args.prefixes}.csv", args.prefixes
+    )
+    report = []
+    for implementation in args.implementations:
+        with get_context("spawn").Pool(1) as pool:
+            report.append(pool.apply(benchmark, (targets_file, implementation)))
+    json.dump(report, args.output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
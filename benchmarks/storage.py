@@ -0,0 +1,119 @@
+"""
+Compare a new S3 client per call with a long-lived pooled client,
+on many small uploads, downloads and deletions.
+
+    python -m benchmarks.storage --files 200 --concurrency 16 --output storage.json
+
+The object storage is configured through the usual `S3_*` variables.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from uuid import uuid4
+
+from iris.commons.logger import Adapter, base_logger
+from iris.commons.settings import CommonSettings
+from iris.commons.storage import Storage
+
+CLIENTS = ["per-call", "pooled"]
+
+
+@asynccontextmanager
+async def open_storage(settings: CommonSettings, client: str):
+    logger = Adapter(base_logger, dict(component="benchmark"))
+    if client == "pooled":
+        async with Storage.open(settings, logger) as storage:
+            yield storage
+    else:
+        yield Storage(settings, logger)
+
+
+async def timed(latencies: list[float], semaphore: asyncio.Semaphore, coro) -> None:
+    async with semaphore:
+        start = time.perf_counter()
+        await coro
+        latencies.append(time.perf_counter() - start)
+
+
+async def benchmark(
+    settings: CommonSettings,
+    directory: Path,
+    client: str,
+    n_files: int,
+    file_size: int,
+    concurrency: int,
+) -> dict:
+    source = directory / f"storage_{file_size}.bin"
+    source.write_bytes(b"0" * file_size)
+    report: dict = {"client": client, "files": n_files, "file_size": file_size}
+    async with open_storage(settings, client) as storage:
+        bucket = f"{settings.S3_PREFIX}-benchmark-{uuid4().hex[:18]}"
+        await storage.create_bucket(bucket)
+        keys = [f"file_{i}" for i in range(n_files)]
+        operations = {
+            "upload": lambda key: storage.upload_file(bucket, key, source),
+            "download": lambda key: storage.download_file(
+                bucket, key, directory / f"{bucket}_{key}"
+            ),
+            "delete": lambda key: storage.delete_file_no_check(bucket, key),
+        }
+        try:
+            for name, operation in operations.items():
+                latencies: list[float] = []
+                semaphore = asyncio.Semaphore(concurrency)
+                start = time.perf_counter()
+                await asyncio.gather(
+                    *[timed(latencies, semaphore, operation(key)) for key in keys]
+                )
+                duration = time.perf_counter() - start
+                latencies.sort()
+                report[name] = {
+                    "duration": duration,
+                    "operations_per_second": n_files / duration,
+                    "latency_median": statistics.median(latencies),
+                    "latency_p99": latencies[int(0.99 * (len(latencies) - 1))],
+                }
+        finally:
+            await storage.delete_bucket_with_files(bucket)
+            for key in keys:
+                (directory / f"{bucket}_{key}").unlink(missing_ok=True)
+    return report
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--clients", nargs="+", choices=CLIENTS, default=CLIENTS)
+    parser.add_argument("--directory", type=Path, default=Path("iris_data/benchmarks"))
+    parser.add_argument("--output", type=argparse.FileType("w"), default=sys.stdout)
+    args = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.WARNING)
+    args.directory.mkdir(parents=True, exist_ok=True)
+    settings = CommonSettings()
+    report = [
+        asyncio.run(
+            benchmark(
+                settings,
+                args.directory,
+                client,
+                args.files,
+                args.file_size,
+                args.concurrency,
+            )
+        )
+        for client in args.clients
+    ]
+    json.dump(report, args.output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Synthetic measurement files."""
+import random
+from pathlib import Path
+
+from iris.commons.utils import zstd_stream_writer
+
+RESULTS_HEADER = (
+    "capture_timestamp,probe_protocol,probe_src_addr,probe_dst_addr,"
+    "probe_src_port,probe_dst_port,probe_ttl,quoted_ttl,reply_src_addr,"
+    "reply_protocol,reply_icmp_type,reply_icmp_code,reply_ttl,reply_size,"
+    "reply_mpls_labels,rtt,round"
+)
+
+
+def results_lines(n_replies: int, *, seed: int = 42, round_: int = 1):
+    """
+    Generate `n_replies` traceroute replies in the format written by caracal.
+    Replies are grouped by destination /24 and TTL, and the hops are shared
+    between prefixes so that the links and prefixes tables are non-trivial.
+
+    >>> lines = list(results_lines(3))
+    >>> len(lines)
+    3
+    >>> lines[0].count(",") == RESULTS_HEADER.count(",")
+    True
+    """
+    rng = random.Random(seed)
+    timestamp = 1640006077
+    for i in range(n_replies):
+        prefix = i // 256
+        ttl = (i % 32) + 1
+        flow = (i // 32) % 8
+        dst_addr = f"::ffff:{(prefix >> 16) % 224 + 1}.{(prefix >> 8) % 256}.{prefix % 256}.{flow}"
+        hop = (prefix // 64) * 32 + ttl
+        reply_src_addr = (
+            f"::ffff:100.{(hop >> 16) % 256}.{(hop >> 8) % 256}.{hop % 256}"
+        )
+        yield (
+            f"{timestamp},1,::ffff:192.0.2.1,{dst_addr},24000,{flow},{ttl},1,"
+            f'{reply_src_addr},1,11,0,{64 - ttl},56,"[]",{rng.randrange(1, 3000)},{round_}'
+        )
+
+
+def write_results_file(
+    path: Path, n_replies: int, *, seed: int = 42, round_: int = 1
+) -> Path:
+    """Write a zstd-compressed results file, if it does not already exist."""
+    if path.exists():
+        return path
+    tmp_path = path.with_suffix(".tmp")
+    with zstd_stream_writer(tmp_path) as f:
+        f.write(RESULTS_HEADER.encode() + b"\n")
+        batch = []
+        for line in results_lines(n_replies, seed=seed, round_=round_):
+            batch.append(line)
+            if len(batch) >= 100_000:
+                f.write(("\n".join(batch) + "\n").encode())
+                batch.clear()
+        if batch:
+            f.write(("\n".join(batch) + "\n").encode())
+    tmp_path.rename(path)
+    return path
+
+
+def probes_lines(n_probes: int, *, n_flows: int = 6, max_ttl: int = 32):
+    """
+    Generate `n_probes` probes in the format read by caracal,
+    with `n_flows` flows per destination, each probed from TTL 1 to `max_ttl`.
+
+    >>> list(probes_lines(2))
+    ['::ffff:1.0.0.0,24000,33434,1,icmp', '::ffff:1.0.0.0,24000,33434,2,icmp']
+    """
+    for i in range(n_probes):
+        ttl = i % max_ttl + 1
+        flow = (i // max_ttl) % n_flows
+        prefix = i // (max_ttl * n_flows)
+        dst_addr = (
+            f"::ffff:{(prefix >> 16) % 224 + 1}.{(prefix >> 8) % 256}.{prefix % 256}.0"
+        )
+        yield f"{dst_addr},{24000 + flow},33434,{ttl},icmp"
+
+
+def write_probes_file(path: Path, n_probes: int) -> Path:
+    """Write a zstd-compressed probes file, if it does not already exist."""
+    if path.exists():
+        return path
+    tmp_path = path.with_suffix(".tmp")
+    with zstd_stream_writer(tmp_path) as f:
+        batch = []
+        for line in probes_lines(n_probes):
+            batch.append(line)
+            if len(batch) >= 100_000:
+                f.write(("\n".join(batch) + "\n").encode())
+                batch.clear()
+        if batch:
+            f.write(("\n".join(batch) + "\n").encode())
+    tmp_path.rename(path)
+    return path
+
+
+def targets_lines(n_prefixes: int, *, min_ttl: int = 2, max_ttl: int = 32):
+    """
+    Generate `n_prefixes` /24 targets in the format of the target lists.
+
+    >>> list(targets_lines(2))
+    ['1.0.0.0/24,icmp,2,32,6', '1.0.1.0/24,icmp,2,32,6']
+    """
+    for i in range(n_prefixes):
+        prefix = f"{(i >> 16) % 224 + 1}.{(i >> 8) % 256}.{i % 256}.0/24"
+        yield f"{prefix},icmp,{min_ttl},{max_ttl},6"
+
+
+def write_targets_file(path: Path, n_prefixes: int) -> Path:
+    """Write an uncompressed target list, if it does not already exist."""
+    if path.exists():
+        return path
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w") as f:
+        batch = []
+        for line in targets_lines(n_prefixes):
+            batch.append(line)
+            if len(batch) >= 100_000:
+                f.write("\n".join(batch) + "\n")
+                batch.clear()
+        if batch:
+            f.write("\n".join(batch) + "\n")
+    tmp_path.rename(path)
+    return path
@@ -1,13 +1,15 @@
 import asyncio
 import json
-from collections import defaultdict
-from collections.abc import AsyncIterator, Iterable, Iterator
-from ipaddress import IPv6Address
+from array import array
+from collections.abc import AsyncIterator, Awaitable, Iterable, Iterator
+from contextlib import suppress
+from ipaddress import IPv4Address, IPv6Address
 from logging import LoggerAdapter
 from pathlib import Path
-from typing import BinaryIO
+from socket import AF_INET6, inet_pton
+from typing import BinaryIO, TypeVar
 
-from httpx import AsyncClient
+from httpx import AsyncClient, Limits, Response, TransportError
 
 from iris.agent.settings import AgentSettings
 from iris.commons.models import MeasurementRoundRequest
@@ -17,6 +19,21 @@ from iris.commons.utils import zstd_stream_reader_text, zstd_stream_writer
 ATLAS_BASE_URL = "https://atlas.ripe.net/api/v2/"
 ATLAS_PROTOCOLS = {"icmp": "ICMP", "icmp6": "ICMP", "tcp": "TCP", "udp": "UDP"}
 IRIS_PROTOCOLS = {"ICMP": 1, "TCP": 6, "UDP": 17}
+ATLAS_FINAL_STATUSES = {
+    "Archived",
+    "Failed",
+    "Forced to stop",
+    "No suitable probes",
+    "Stopped",
+}
+# Rate limits and transient server errors.
+ATLAS_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+ATLAS_RETRIES = 8
+ATLAS_BACKOFF = 1.0  # seconds
+ATLAS_CONCURRENCY = 16
+ATLAS_DEFINITIONS_PER_REQUEST = 100
+
+T = TypeVar("T")
 
 
 async def atlas_backend(
@@ -26,10 +43,13 @@ async def atlas_backend(
     redis: Redis,
     probes_filepath: Path,
     results_filepath: Path,
+    cancelled: asyncio.Event | None = None,
 ) -> dict | None:
     """
     This is an experimental backend using `RIPE Atlas <https://atlas.ripe.net/>`_ to send the probes.
     This gives access to a large number of vantage points, at the expense of very low speed probing.
+    If `cancelled` is specified, the round is cancelled when it is set,
+    otherwise the measurement request is polled.
     """
     logger.info("Converting probes to RIPE Atlas targets")
     with zstd_stream_reader_text(probes_filepath) as f:
@@ -47,28 +67,44 @@ async def atlas_backend(
         for (dst_addr, protocol), (n_flows, min_ttl, max_ttl) in targets.items()
     ]
 
+    concurrency = settings.AGENT_RIPE_ATLAS_CONCURRENCY
     async with AsyncClient(
         base_url=ATLAS_BASE_URL,
         params=dict(key=settings.AGENT_RIPE_ATLAS_KEY),
         timeout=30,
+        limits=Limits(max_connections=concurrency),
     ) as client:
-        logger.info("Creating RIPE Atlas measurements")
-        group_id = await create_measurement_group(client, definitions)
-        logger.info("Watching RIPE Atlas measurements (group %s)", group_id)
-        cancelled = await watch_measurement_group(
+        logger.info("Creating %s RIPE Atlas measurements", len(definitions))
+        groups = await create_measurement_groups(
+            client,
+            definitions,
+            chunk_size=settings.AGENT_RIPE_ATLAS_DEFINITIONS_PER_REQUEST,
+            concurrency=concurrency,
+        )
+        logger.info(
+            "Watching RIPE Atlas measurements (groups %s)", [g[0] for g in groups]
+        )
+        stopped = await watch_measurements(
             client,
             logger,
             redis,
             request.measurement_uuid,
             settings.AGENT_UUID,
-            group_id,
+            groups,
+            refresh_interval=settings.AGENT_RIPE_ATLAS_REFRESH_INTERVAL,
+            concurrency=concurrency,
+            cancelled=cancelled,
         )
-        if cancelled:
+        if stopped:
             return None
         logger.info("Fetching RIPE Atlas results")
         with zstd_stream_writer(results_filepath) as f:
-            await fetch_measurement_group_results(
-                client, group_id, request.round.number, f
+            await fetch_measurements_results(
+                client,
+                [x for group in groups for x in group],
+                request.round.number,
+                f,
+                concurrency=concurrency,
             )
         return dict(
             probes_read=0,
@@ -86,29 +122,79 @@ async def atlas_backend(
         )  # TODO
 
 
+def encode_address(addr: str) -> int:
+    """
+    >>> encode_address("::ffff:192.0.2.1")
+    281473902969345
+    """
+    return int.from_bytes(inet_pton(AF_INET6, addr), "big")
+
+
+def decode_address(addr: int) -> str:
+    """
+    >>> decode_address(281473902969345)
+    '192.0.2.1'
+    >>> decode_address(encode_address("2001:db8::1"))
+    '2001:db8::1'
+    """
+    if addr >> 32 == 0xFFFF:
+        return str(IPv4Address(addr & 0xFFFFFFFF))
+    return str(IPv6Address(addr))
+
+
 def group_probes(lines: Iterable[str]) -> dict:
     """
     Group probes by destination address and protocol in order to minimize the number of measurements required.
+    The probes are streamed, and only the number of flows and the min/max TTL
+    are kept per group, in arrays indexed by group.
+    The flows are counted with a single set of integers encoding the group
+    and the source and destination ports, instead of a set of tuples per group.
     >>> group_probes([
     ...     "::ffff:192.0.2.1,24000,33434,1,icmp",
     ...     "::ffff:192.0.2.1,24000,33435,4,icmp",
     ...     "::ffff:192.0.2.2,24000,33434,1,icmp",
     ... ])
     {('192.0.2.1', 'icmp'): (2, 1, 4), ('192.0.2.2', 'icmp'): (1, 1, 1)}
+    >>> group_probes([
+    ...     "::ffff:192.0.2.1,24000,33434,1,icmp",
+    ...     *(f"::ffff:192.0.2.1,{24000 + i},33434,2,icmp" for i in range(6)),
+    ...     "::ffff:192.0.2.1,24000,33434,3,icmp",
+    ...     "::ffff:192.0.2.1,24000,33434,1,udp",
+    ... ])
+    {('192.0.2.1', 'icmp'): (6, 1, 3), ('192.0.2.1', 'udp'): (1, 1, 1)}
     """
-    targets = defaultdict(lambda: (set(), set()))
+    protocols = list(ATLAS_PROTOCOLS)
+    protocol_ids = {protocol: i for i, protocol in enumerate(protocols)}
+    # Group index by destination address and protocol, encoded as an integer.
+    groups: dict[int, int] = {}
+    # Flows seen, encoded as `group index << 32 | src_port << 16 | dst_port`.
+    flows: set[int] = set()
+    n_flows = array("Q")
+    min_ttls, max_ttls = array("B"), array("B")
     for line in lines:
-        dst_addr, src_port, dst_port, ttl, protocol = line.strip().split(",")
-        dst_addr_v6 = IPv6Address(dst_addr)
-        dst_addr = (
-            str(dst_addr_v6.ipv4_mapped)
-            if dst_addr_v6.ipv4_mapped
-            else str(dst_addr_v6)
-        )
-        targets[(dst_addr, protocol)][0].add((int(src_port), int(dst_port)))
-        targets[(dst_addr, protocol)][1].add(int(ttl))
+        dst_addr, src_port, dst_port, ttl_, protocol = line.rstrip().split(",")
+        ttl = int(ttl_)
+        key = encode_address(dst_addr) << 2 | protocol_ids[protocol]
+        i = groups.setdefault(key, len(groups))
+        if i == len(n_flows):
+            n_flows.append(0)
+            min_ttls.append(ttl)
+            max_ttls.append(ttl)
+        elif ttl < min_ttls[i]:
+            min_ttls[i] = ttl
+        elif ttl > max_ttls[i]:
+            max_ttls[i] = ttl
+        flow = i << 32 | int(src_port) << 16 | int(dst_port)
+        if flow not in flows:
+            flows.add(flow)
+            n_flows[i] += 1
     return {
-        k: (len(flows), min(ttls), max(ttls)) for k, (flows, ttls) in targets.items()
+        (decode_address(key >> 2), protocols[key & 3]): (
+            n_flows[i],
+            min_ttls[i],
+            max_ttls[i],
+        )
+        for key, i in groups.items()
     }
 
 
@@ -165,83 +251,260 @@ def make_definition(
     )
 
 
-async def create_measurement_group(client: AsyncClient, definitions: list[dict]) -> int:
-    r = await client.post(
+def retry_delay(response: Response | None, attempt: int, backoff: float) -> float:
+    """
+    Delay before retrying a request, given by the `Retry-After` header
+    of the response if present, with exponential backoff otherwise.
+    >>> retry_delay(None, 0, 1.0)
+    1.0
+    >>> retry_delay(None, 3, 1.0)
+    8.0
+    >>> retry_delay(Response(429, headers={"Retry-After": "5"}), 3, 1.0)
+    5.0
+    """
+    if response is not None:
+        with suppress(KeyError, ValueError):
+            return float(response.headers["Retry-After"])
+    return backoff * 2**attempt
+
+
+async def atlas_request(
+    client: AsyncClient,
+    method: str,
+    url: str,
+    *,
+    retries: int = ATLAS_RETRIES,
+    backoff: float = ATLAS_BACKOFF,
+    **kwargs,
+) -> Response:
+    """
+    Send a request to the RIPE Atlas API, and retry it on rate limits,
+    server errors and network errors.
+    """
+    attempt = 0
+    while True:
+        response = None
+        try:
+            response = await client.request(method, url, **kwargs)
+            if (
+                response.status_code not in ATLAS_RETRY_STATUS_CODES
+                or attempt >= retries
+            ):
+                response.raise_for_status()
+                return response
+        except TransportError:
+            if attempt >= retries:
+                raise
+        await asyncio.sleep(retry_delay(response, attempt, backoff))
+        attempt += 1
+
+
+async def gather_bounded(
+    aws: Iterable[Awaitable[T]], concurrency: int = ATLAS_CONCURRENCY
+) -> list[T]:
+    """
+    Like `asyncio.gather`, with at most `concurrency` awaitables running at once.
+    >>> async def double(x):
+    ...     return 2 * x
+    >>> asyncio.run(gather_bounded([double(1), double(2), double(3)], 2))
+    [2, 4, 6]
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # Do not leave requests running if one of them failed.
+        for task in tasks:
+            task.cancel()
+
+
+async def create_measurement_group(
+    client: AsyncClient, definitions: list[dict]
+) -> list[int]:
+    """Create a group of measurements, and return their IDs (group ID first)."""
+    r = await atlas_request(
+        client,
+        "POST",
         "/measurements",
         json=dict(
             definitions=definitions,
             probes=[dict(requested=1, type="area", value="WW")],
         ),
     )
-    data = r.json()
-    return data["measurements"][0]
+    return r.json()["measurements"]
+
+
+async def create_measurement_groups(
+    client: AsyncClient,
+    definitions: list[dict],
+    *,
+    chunk_size: int = ATLAS_DEFINITIONS_PER_REQUEST,
+    concurrency: int = ATLAS_CONCURRENCY,
+) -> list[list[int]]:
+    """
+    Create the measurements by groups of at most `chunk_size` definitions,
+    the maximum accepted by the API in a single request.
+    """
+    chunks = [
+        definitions[i : i + chunk_size] for i in range(0, len(definitions), chunk_size)
+    ]
+    return await gather_bounded(
+        (create_measurement_group(client, chunk) for chunk in chunks), concurrency
+    )
 
 
 async def get_measurement_group_members(
     client: AsyncClient, group_id: int
 ) -> list[int]:
-    data = (await client.get(f"/measurements/groups/{group_id}")).json()
+    data = (
+        await atlas_request(client, "GET", f"/measurements/groups/{group_id}")
+    ).json()
     return [member["id"] for member in data["group_members"]]
 
 
 async def get_measurement_group_results(
-    client: AsyncClient, group_id: int
+    client: AsyncClient, group_id: int, *, concurrency: int = ATLAS_CONCURRENCY
 ) -> AsyncIterator[dict]:
     members = await get_measurement_group_members(client, group_id)
-    for member in members:
-        async for result in get_measurement_results(client, member):
-            yield result
+    async for result in get_measurements_results(
+        client, members, concurrency=concurrency
+    ):
+        yield result
+
+
+async def get_measurements_results(
+    client: AsyncClient,
+    measurement_ids: list[int],
+    *,
+    concurrency: int = ATLAS_CONCURRENCY,
+) -> AsyncIterator[dict]:
+    """Fetch the results of the measurements concurrently, in completion order."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(measurement_id: int) -> list[dict]:
+        async with semaphore:
+            return [x async for x in get_measurement_results(client, measurement_id)]
+
+    tasks = [asyncio.create_task(fetch(x)) for x in measurement_ids]
+    try:
+        for results in asyncio.as_completed(tasks):
+            for result in await results:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 async def get_measurement_results(
     client: AsyncClient, measurement_id: int
 ) -> AsyncIterator[dict]:
-    async with client.stream(
-        "GET", f"/measurements/{measurement_id}/results", params=dict(format="txt")
-    ) as stream:
-        async for line in stream.aiter_lines():
+    # The results are not streamed, so that the request can be retried.
+    r = await atlas_request(
+        client,
+        "GET",
+        f"/measurements/{measurement_id}/results",
+        params=dict(format="txt"),
+    )
+    for line in r.text.splitlines():
+        if line:
             yield json.loads(line)
 
 
-async def get_measurement_group_status(client: AsyncClient, group_id: int) -> list[str]:
+async def get_measurement_group_status(
+    client: AsyncClient, group_id: int, *, concurrency: int = ATLAS_CONCURRENCY
+) -> list[str]:
     members = await get_measurement_group_members(client, group_id)
-    return [await get_measurement_status(client, member) for member in members]
+    return await get_measurements_status(client, members, concurrency=concurrency)
+
+
+async def get_measurements_status(
+    client: AsyncClient,
+    measurement_ids: list[int],
+    *,
+    concurrency: int = ATLAS_CONCURRENCY,
+) -> list[str]:
+    return await gather_bounded(
+        (get_measurement_status(client, x) for x in measurement_ids), concurrency
+    )
 
 
 async def get_measurement_status(client: AsyncClient, measurement_id: int) -> str:
-    data = (await client.get(f"/measurements/{measurement_id}")).json()
+    data = (
+        await atlas_request(client, "GET", f"/measurements/{measurement_id}")
+    ).json()
     return data["status"]["name"]
 
 
 async def stop_measurement_group(client: AsyncClient, group_id: int) -> None:
-    await client.delete(f"/measurements/groups/{group_id}")
+    await atlas_request(client, "DELETE", f"/measurements/groups/{group_id}")
 
 
-async def watch_measurement_group(
+async def watch_measurements(
     client: AsyncClient,
     logger: LoggerAdapter,
     redis: Redis,
     measurement_uuid: str,
     agent_uuid: str,
-    group_id: int,
+    groups: list[list[int]],
     *,
-    refresh_interval: int = 10,
+    refresh_interval: float = 10,
+    concurrency: int = ATLAS_CONCURRENCY,
+    cancelled: asyncio.Event | None = None,
 ) -> bool:
-    group_status = await get_measurement_group_status(client, group_id)
-    while not all(x == "Stopped" for x in group_status):
-        group_status = await get_measurement_group_status(client, group_id)
-        logger.info("RIPE Atlas group status: %s", group_status)
+    """
+    Wait for the measurements of the groups to be stopped.
+    Only the measurements not yet stopped are polled again.
+    Returns `True` if the groups were stopped following a cancellation.
+    """
+    pending = [x for group in groups for x in group]
+    total = len(pending)
+    while True:
+        statuses = await get_measurements_status(
+            client, pending, concurrency=concurrency
+        )
+        pending = [
+            x
+            for x, status in zip(pending, statuses)
+            if status not in ATLAS_FINAL_STATUSES
+        ]
+        logger.info(
+            "RIPE Atlas measurements stopped: %s/%s", total - len(pending), total
+        )
+        if not pending:
+            return False
         # Stop if the measurement request was cancelled.
-        if not await redis.get_request(measurement_uuid, agent_uuid):
-            await stop_measurement_group(client, group_id)
+        if cancelled:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(cancelled.wait(), refresh_interval)
+            stop = cancelled.is_set()
+        else:
+            stop = not await redis.get_request(measurement_uuid, agent_uuid)
+            if not stop:
+                await asyncio.sleep(refresh_interval)
+        if stop:
+            await gather_bounded(
+                (stop_measurement_group(client, group[0]) for group in groups),
+                concurrency,
+            )
             return True
-        await asyncio.sleep(refresh_interval)
-    return False
 
 
-async def fetch_measurement_group_results(
-    client: AsyncClient, group_id: int, round: int, writer: BinaryIO
+async def fetch_measurements_results(
+    client: AsyncClient,
+    measurement_ids: list[int],
+    round: int,
+    writer: BinaryIO,
+    *,
+    concurrency: int = ATLAS_CONCURRENCY,
 ) -> None:
-    async for result in get_measurement_group_results(client, group_id):
+    async for result in get_measurements_results(
+        client, measurement_ids, concurrency=concurrency
+    ):
         for reply in traceroute_to_replies(result, round):
             writer.write(",".join(str(x) for x in reply).encode() + b"\n")
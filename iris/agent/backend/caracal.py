@@ -1,14 +1,52 @@
 import asyncio
 import os
+import re
 import shlex
 import signal
-from asyncio.subprocess import create_subprocess_shell
+import time
+import zlib
+from asyncio.subprocess import PIPE, create_subprocess_shell
+from collections.abc import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterator,
+    Mapping,
+)
+from contextlib import nullcontext, suppress
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
 from logging import LoggerAdapter
 from pathlib import Path
 
+from iris.agent.budget import ProbingRateBudget
 from iris.agent.settings import AgentSettings
-from iris.commons.models import MeasurementRoundRequest
+from iris.commons.models import MeasurementRoundRequest, ProbingProgress
 from iris.commons.redis import Redis
+from iris.commons.storage import Storage, results_key
+
+# Counters reported by caracal, see `ProbingStatistics`.
+STATISTICS = (
+    "probes_read",
+    "packets_sent",
+    "packets_failed",
+    "filtered_low_ttl",
+    "filtered_high_ttl",
+    "filtered_prefix_excl",
+    "filtered_prefix_not_incl",
+    "packets_received",
+    "packets_received_invalid",
+    "pcap_received",
+    "pcap_dropped",
+    "pcap_interface_dropped",
+)
+STATISTICS_ALIASES = {
+    "filtered_lo_ttl": "filtered_low_ttl",
+    "filtered_hi_ttl": "filtered_high_ttl",
+}
+STATISTICS_PATTERN = re.compile(r"\b([a-z_]+)=(\d+)\b")
 
 
 async def caracal_backend(
@@ -18,42 +56,107 @@ async def caracal_backend(
     redis: Redis,
     probes_filepath: Path,
     results_filepath: Path,
+    storage: Storage | None = None,
+    budget: ProbingRateBudget | None = None,
+    cancelled: asyncio.Event | None = None,
 ) -> dict | None:
     """
     This is the default and reference backend for Iris.
     It uses `caracal <https://github.com/dioptra-io/caracal>`_ for sending the probes.
+    If `storage` is specified, the probes are streamed from the object storage
+    and the results to it, instead of the local files.
+    If `budget` is specified, the probing rate is limited to the share of the
+    budget allocated to this round, which changes as other rounds start and finish.
+    If `cancelled` is specified, the round is cancelled when it is set,
+    otherwise the measurement request is polled.
     """
-
-    prober = asyncio.create_task(
-        probe(
-            settings,
-            logger,
-            probes_filepath,
-            results_filepath,
-            request.round.number,
-            request.batch_size,
-            request.probing_rate,
+    probes_stream = None
+    results_stream = None
+    if storage:
+        bucket = storage.measurement_agent_bucket(
+            request.measurement_uuid, settings.AGENT_UUID
         )
-    )
+        probes_stream = storage.iter_file(bucket, request.probe_filename)
+        results_stream = partial(
+            storage.upload_chunks, bucket, results_key(request.round)
+        )
+
+    start_time = datetime.utcnow()
 
-    watcher = asyncio.create_task(
-        watch_cancellation(
-            redis,
+    async def publish_progress(statistics: dict[str, int], elapsed: float) -> None:
+        progress = ProbingProgress(
+            round=request.round,
+            start_time=start_time,
+            update_time=datetime.utcnow(),
+            probing_rate=request.probing_rate,
+            effective_rate=statistics["packets_sent"] / elapsed if elapsed else 0.0,
+            **{
+                k: v for k, v in statistics.items() if k in ProbingProgress.model_fields
+            },
+        )
+        await redis.set_measurement_progress(
             request.measurement_uuid,
             settings.AGENT_UUID,
-            settings.AGENT_STOPPER_REFRESH,
+            progress,
+            # Let the progress expire if the agent stops updating it.
+            ttl_seconds=int(10 * settings.AGENT_CARACAL_PROGRESS_INTERVAL) + 1,
         )
-    )
 
-    done, pending = await asyncio.wait(
-        [prober, watcher], return_when=asyncio.FIRST_COMPLETED
-    )
-    if watcher in done:
-        # Measurement was cancelled
-        prober.cancel()
-        return None
+    rate_limit = None
+    reservation = nullcontext()
+    if budget:
+        rate_limit = partial(budget.rate, request.measurement_uuid)
+        reservation = budget.reserve(
+            request.measurement_uuid, probing_rate_cap(settings, request.probing_rate)
+        )
+
+    # Split the probes between several caracal processes, if requested.
+    prober_fn = probe_sharded if settings.AGENT_CARACAL_SHARDS > 1 else probe
+    with reservation:
+        prober = asyncio.create_task(
+            prober_fn(
+                settings,
+                logger,
+                probes_filepath,
+                results_filepath,
+                request.round.number,
+                request.batch_size,
+                request.probing_rate,
+                probes_stream=probes_stream,
+                results_stream=results_stream,
+                on_progress=publish_progress,
+                rate_limit=rate_limit,
+            )
+        )
+
+        watcher = asyncio.create_task(
+            cancelled.wait()
+            if cancelled
+            else watch_cancellation(
+                redis,
+                request.measurement_uuid,
+                settings.AGENT_UUID,
+                settings.AGENT_STOPPER_REFRESH,
+            )
+        )
+
+        done, pending = await asyncio.wait(
+            [prober, watcher], return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in pending:
+            task.cancel()
+        if watcher in done:
+            # Measurement was cancelled
+            return None
+
+        return prober.result()
+
 
-    return prober.result()
+def probing_rate_cap(settings: AgentSettings, probing_rate: int | None) -> int:
+    """Cap the probing rate if superior to the maximum probing rate."""
+    if probing_rate and probing_rate <= settings.AGENT_MAX_PROBING_RATE:
+        return probing_rate
+    return settings.AGENT_MAX_PROBING_RATE
 
 
 async def watch_cancellation(
@@ -69,37 +172,42 @@ async def watch_cancellation(
         await asyncio.sleep(interval)
 
 
-async def probe(
-    settings: AgentSettings,
-    logger: LoggerAdapter,
-    probes_filepath: Path,
-    results_filepath: Path,
-    round_number: int,
-    batch_size: int | None,
-    probing_rate: int,
-) -> dict:
-    """Probing interface."""
-    # Cap the probing rate if superior to the maximum probing rate
-    measurement_probing_rate = (
-        probing_rate
-        if probing_rate and probing_rate <= settings.AGENT_MAX_PROBING_RATE
-        else settings.AGENT_MAX_PROBING_RATE
-    )
-
+def input_command(probes_filepath: Path, streaming: bool = False) -> str:
+    """Command writing the probes to stdout, reading them from stdin if streaming."""
+    input_file = "" if streaming else f" {shlex.quote(str(probes_filepath))}"
     if probes_filepath.suffix == ".zst":
-        input_cmd = f"zstd -cd {shlex.quote(str(probes_filepath))}"
-    else:
-        input_cmd = f"cat {shlex.quote(str(probes_filepath))}"
+        return f"zstd -cd{input_file}"
+    return f"cat{input_file}"
 
+
+def output_command(
+    settings: AgentSettings, results_filepath: Path, streaming: bool = False
+) -> str:
+    """Command writing the results from stdin, to stdout if streaming."""
+    output_file = "" if streaming else f" > {shlex.quote(str(results_filepath))}"
+    if results_filepath.suffix == ".zst" and settings.AGENT_RESULTS_FRAME_LINES:
+        # Write an independent zstd frame every N lines,
+        # so that the worker can decompress the results in parallel.
+        return (
+            f"split --lines {settings.AGENT_RESULTS_FRAME_LINES} --filter 'zstd -c'"
+            f"{output_file}"
+        )
     if results_filepath.suffix == ".zst":
-        output_cmd = f"zstd -c > {shlex.quote(str(results_filepath))}"
-    else:
-        output_cmd = f"tee > {shlex.quote(str(results_filepath))}"
+        return f"zstd -c{output_file}"
+    return f"tee{output_file}"
+
 
+def caracal_command(
+    settings: AgentSettings,
+    round_number: int,
+    batch_size: int | None,
+    probing_rate: int,
+    interface: str | None = None,
+) -> str:
     caracal_cmd = [
         "caracal",
         f"--meta-round {shlex.quote(str(round_number))}",
-        f"--probing-rate {shlex.quote(str(measurement_probing_rate))}",
+        f"--probing-rate {shlex.quote(str(probing_rate))}",
         f"--sniffer-wait-time {settings.AGENT_CARACAL_SNIFFER_WAIT_TIME}",
     ]
 
@@ -114,29 +222,422 @@ async def probe(
     if not settings.AGENT_CARACAL_INTEGRITY_CHECK:
         caracal_cmd.append("--no-integrity-check")
 
-    cmd = f"{input_cmd} | {' '.join(caracal_cmd)} | {output_cmd}"
+    if interface:
+        caracal_cmd.append(f"--interface {shlex.quote(interface)}")
+
+    return " ".join(caracal_cmd)
+
+
+async def probe(
+    settings: AgentSettings,
+    logger: LoggerAdapter,
+    probes_filepath: Path,
+    results_filepath: Path,
+    round_number: int,
+    batch_size: int | None,
+    probing_rate: int,
+    *,
+    probes_stream: AsyncIterable[bytes] | None = None,
+    results_stream: Callable[[AsyncIterable[bytes]], Awaitable] | None = None,
+    on_progress: Callable[[dict[str, int], float], Awaitable[None]] | None = None,
+    rate_limit: Callable[[], float] | None = None,
+) -> dict:
+    """
+    Probing interface.
+    If `probes_stream` is specified, the probes are read from it instead of
+    `probes_filepath`, and if `results_stream` is specified, the results
+    are passed to it instead of being written to `results_filepath`.
+    The suffixes of the paths still indicate whether the data is compressed.
+    `on_progress` is called every `AGENT_CARACAL_PROGRESS_INTERVAL` seconds
+    with the latest statistics reported by caracal and the elapsed time.
+    If `rate_limit` is specified, the probes are fed to caracal by the agent,
+    at most `rate_limit()` probes per second, so that the rate of a running
+    caracal process can be changed.
+
+    :returns: The final statistics reported by caracal.
+    """
+    input_cmd = input_command(probes_filepath, streaming=bool(probes_stream))
+    output_cmd = output_command(
+        settings, results_filepath, streaming=bool(results_stream)
+    )
+    caracal_cmd = caracal_command(
+        settings, round_number, batch_size, probing_rate_cap(settings, probing_rate)
+    )
+
+    processes = []
+    if rate_limit:
+        logger.info("Running %s", input_cmd)
+        reader = await create_subprocess_shell(
+            input_cmd,
+            stdin=PIPE if probes_stream else None,
+            stdout=PIPE,
+            preexec_fn=os.setsid,
+        )
+        processes.append(reader)
+        cmd = f"{caracal_cmd} | {output_cmd}"
+    else:
+        cmd = f"{input_cmd} | {caracal_cmd} | {output_cmd}"
     logger.info("Running %s", cmd)
 
-    process = await create_subprocess_shell(cmd, preexec_fn=os.setsid)
+    statistics = dict.fromkeys(STATISTICS, 0)
+    process = await create_subprocess_shell(
+        cmd,
+        stdin=PIPE if probes_stream or rate_limit else None,
+        stdout=PIPE if results_stream else None,
+        stderr=PIPE,
+        preexec_fn=os.setsid,
+    )
+    processes.append(process)
+    tasks = [p.wait() for p in processes]
+    tasks.append(read_statistics(process.stderr, logger, statistics))
+    if rate_limit:
+        tasks.append(write_throttled(processes[0].stdout, process.stdin, rate_limit))
+    if probes_stream:
+        tasks.append(write_stream(processes[0].stdin, probes_stream))
+    if results_stream:
+        tasks.append(results_stream(read_stream(process.stdout)))
+    publisher = None
+    if on_progress:
+        publisher = asyncio.create_task(
+            publish_statistics(
+                logger,
+                statistics,
+                on_progress,
+                settings.AGENT_CARACAL_PROGRESS_INTERVAL,
+            )
+        )
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException as e:
+        kill_processes(logger, processes)
+        if not isinstance(e, asyncio.CancelledError):
+            raise
+    finally:
+        if publisher:
+            publisher.cancel()
+
+    logger.info("Probing statistics: %s", statistics)
+    return statistics
+
+
+async def probe_sharded(
+    settings: AgentSettings,
+    logger: LoggerAdapter,
+    probes_filepath: Path,
+    results_filepath: Path,
+    round_number: int,
+    batch_size: int | None,
+    probing_rate: int,
+    *,
+    probes_stream: AsyncIterable[bytes] | None = None,
+    results_stream: Callable[[AsyncIterable[bytes]], Awaitable] | None = None,
+    on_progress: Callable[[dict[str, int], float], Awaitable[None]] | None = None,
+    rate_limit: Callable[[], float] | None = None,
+) -> dict:
+    """
+    Same as `probe`, but split the probes by destination address between
+    `AGENT_CARACAL_SHARDS` caracal processes, each probing at a fraction of
+    the probing rate, from the interfaces of `AGENT_CARACAL_SHARD_INTERFACES`
+    in turn, if any. The results are merged into a single file.
+
+    :returns: The sum of the final statistics reported by the caracal processes.
+    """
+    shards = settings.AGENT_CARACAL_SHARDS
+    interfaces = settings.AGENT_CARACAL_SHARD_INTERFACES
+    shard_probing_rate = max(probing_rate_cap(settings, probing_rate) // shards, 1)
+
+    input_cmd = input_command(probes_filepath, streaming=bool(probes_stream))
+    output_cmd = output_command(
+        settings, results_filepath, streaming=bool(results_stream)
+    )
+
+    logger.info("Running %s", input_cmd)
+    reader = await create_subprocess_shell(
+        input_cmd,
+        stdin=PIPE if probes_stream else None,
+        stdout=PIPE,
+        preexec_fn=os.setsid,
+    )
+    processes = [reader]
+    try:
+        probers = []
+        for shard in range(shards):
+            caracal_cmd = caracal_command(
+                settings,
+                round_number,
+                batch_size,
+                shard_probing_rate,
+                interface=interfaces[shard % len(interfaces)] if interfaces else None,
+            )
+            logger.info("Running %s", caracal_cmd)
+            prober = await create_subprocess_shell(
+                caracal_cmd,
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=PIPE,
+                preexec_fn=os.setsid,
+            )
+            processes.append(prober)
+            probers.append(prober)
+        logger.info("Running %s", output_cmd)
+        writer = await create_subprocess_shell(
+            output_cmd,
+            stdin=PIPE,
+            stdout=PIPE if results_stream else None,
+            preexec_fn=os.setsid,
+        )
+        processes.append(writer)
+    except BaseException:
+        kill_processes(logger, processes)
+        raise
+
+    statistics = ShardedStatistics([dict.fromkeys(STATISTICS, 0) for _ in probers])
+    tasks = [p.wait() for p in processes]
+    tasks += [
+        read_statistics(p.stderr, logger, s) for p, s in zip(probers, statistics.shards)
+    ]
+    tasks.append(write_sharded(reader.stdout, [p.stdin for p in probers], rate_limit))
+    tasks.append(merge_lines([p.stdout for p in probers], writer.stdin))
+    if probes_stream:
+        tasks.append(write_stream(reader.stdin, probes_stream))
+    if results_stream:
+        tasks.append(results_stream(read_stream(writer.stdout)))
+    publisher = None
+    if on_progress:
+        publisher = asyncio.create_task(
+            publish_statistics(
+                logger,
+                statistics,
+                on_progress,
+                settings.AGENT_CARACAL_PROGRESS_INTERVAL,
+            )
+        )
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException as e:
+        kill_processes(logger, processes)
+        if not isinstance(e, asyncio.CancelledError):
+            raise
+    finally:
+        if publisher:
+            publisher.cancel()
+
+    for shard, shard_statistics in enumerate(statistics.shards):
+        logger.info("Probing statistics of shard %s: %s", shard, shard_statistics)
+    logger.info("Probing statistics: %s", dict(statistics))
+    return dict(statistics)
+
+
+@dataclass
+class ShardedStatistics(Mapping[str, int]):
+    """
+    Sum of the statistics of the shards, updated in place by `read_statistics`.
+    >>> statistics = ShardedStatistics([{"probes_read": 1}, {"probes_read": 2}])
+    >>> statistics["probes_read"]
+    3
+    """
+
+    shards: list[dict[str, int]]
+
+    def __getitem__(self, key: str) -> int:
+        if not any(key in shard for shard in self.shards):
+            raise KeyError(key)
+        return sum(shard.get(key, 0) for shard in self.shards)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter({key: None for shard in self.shards for key in shard})
+
+    def __len__(self) -> int:
+        return len({key for shard in self.shards for key in shard})
+
+
+def kill_processes(
+    logger: LoggerAdapter, processes: list[asyncio.subprocess.Process]
+) -> None:
+    for p in processes:
+        logger.info("Terminating pid %s", p.pid)
+        with suppress(ProcessLookupError):
+            os.killpg(os.getpgid(p.pid), signal.SIGKILL)
+
+
+def parse_statistics(line: str) -> dict[str, int]:
+    """
+    Parse the counters from a statistics line logged by caracal.
+    >>> parse_statistics("probes_read=10 packets_sent=9 (90.00%) filtered_lo_ttl=1")
+    {'probes_read': 10, 'packets_sent': 9, 'filtered_low_ttl': 1}
+    >>> parse_statistics("[info] average_rate=100.5")
+    {}
+    """
+    statistics = {}
+    for key, value in STATISTICS_PATTERN.findall(line):
+        key = STATISTICS_ALIASES.get(key, key)
+        if key in STATISTICS:
+            statistics[key] = int(value)
+    return statistics
+
+
+async def read_statistics(
+    reader: asyncio.StreamReader, logger: LoggerAdapter, statistics: dict[str, int]
+) -> None:
+    """Forward caracal logs to `logger` and update `statistics` in place."""
+    while line := await reader.readline():
+        line_ = line.decode(errors="replace").rstrip()
+        logger.info("%s", line_)
+        statistics.update(parse_statistics(line_))
+
+
+async def publish_statistics(
+    logger: LoggerAdapter,
+    statistics: Mapping[str, int],
+    on_progress: Callable[[dict[str, int], float], Awaitable[None]],
+    interval: float,
+) -> None:
+    start = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await on_progress(dict(statistics), time.monotonic() - start)
+        except Exception as e:
+            # The progress is informative only, do not interrupt the probing.
+            logger.warning("Cannot publish probing progress: %s", e)
+
+
+async def write_stream(
+    writer: asyncio.StreamWriter, chunks: AsyncIterable[bytes]
+) -> None:
+    try:
+        async for chunk in chunks:
+            writer.write(chunk)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def read_stream(
+    reader: asyncio.StreamReader, chunk_size: int = 2**20
+) -> AsyncIterator[bytes]:
+    while chunk := await reader.read(chunk_size):
+        yield chunk
+
+
+async def read_lines(
+    reader: asyncio.StreamReader,
+    rate: Callable[[], float] | None = None,
+    interval: float = 0.1,
+    chunk_size: int = 2**20,
+) -> AsyncIterator[list[bytes]]:
+    """
+    Read the lines from `reader` by batches,
+    at most `rate()` lines per second if specified.
+    """
+    if not rate:
+        remainder = b""
+        while chunk := await reader.read(chunk_size):
+            data = remainder + chunk
+            end = data.rfind(b"\n") + 1
+            remainder = data[end:]
+            if end:
+                yield data[:end].splitlines(keepends=True)
+        if remainder:
+            yield [remainder]
+        return
+    buffer = b""
+    eof = False
+    tokens = 0.0
+    last = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        now, rate_ = time.monotonic(), rate()
+        # Do not accumulate more than two intervals worth of probes.
+        tokens = min(tokens + (now - last) * rate_, max(2 * interval * rate_, 1))
+        last = now
+        n = int(tokens)
+        # Read by chunks, and cut them at the n-th line, rather than line by line.
+        chunks = [buffer]
+        newlines = buffer.count(b"\n")
+        while not eof and newlines < n:
+            chunk = await reader.read(chunk_size)
+            eof = not chunk
+            chunks.append(chunk)
+            newlines += chunk.count(b"\n")
+        buffer = b"".join(chunks)
+        rest = buffer.split(b"\n", n)
+        end = len(buffer) - len(rest[n]) if len(rest) > n else len(buffer)
+        lines = buffer[:end].splitlines(keepends=True)
+        buffer = buffer[end:]
+        tokens -= len(lines)
+        yield lines
+        if eof and not buffer:
+            break
+
+
+async def write_throttled(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    rate: Callable[[], float],
+    interval: float = 0.1,
+) -> None:
+    """Copy the lines from `reader` to `writer`, at most `rate()` lines per second."""
+    try:
+        async for lines in read_lines(reader, rate, interval):
+            writer.write(b"".join(lines))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def write_sharded(
+    reader: asyncio.StreamReader,
+    writers: list[asyncio.StreamWriter],
+    rate: Callable[[], float] | None = None,
+    interval: float = 0.1,
+) -> None:
+    """
+    Copy the lines from `reader` to `writers`, by hash of their first field,
+    the destination address, so that all the probes towards a destination
+    are sent by the same shard; at most `rate()` lines per second if specified.
+    """
+    try:
+        async for lines in read_lines(reader, rate, interval):
+            shards: list[list[bytes]] = [[] for _ in writers]
+            for line in lines:
+                destination = line.split(b",", 1)[0]
+                shards[zlib.crc32(destination) % len(writers)].append(line)
+            for writer, shard in zip(writers, shards):
+                writer.write(b"".join(shard))
+            await asyncio.gather(*(writer.drain() for writer in writers))
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+async def merge_lines(
+    readers: list[asyncio.StreamReader], writer: asyncio.StreamWriter
+) -> None:
+    """
+    Copy the lines from `readers` to `writer`,
+    keeping only the first of the header lines of the readers.
+    """
+    header_written = False
+    # Older versions of asyncio do not support concurrent calls to `drain`.
+    drain_lock = asyncio.Lock()
+
+    async def copy(reader: asyncio.StreamReader) -> None:
+        nonlocal header_written
+        header = await reader.readline()
+        if not header_written:
+            writer.write(header)
+            header_written = True
+        async for lines in read_lines(reader):
+            # Write complete lines only, so that the lines of the readers
+            # are not interleaved.
+            if not lines[-1].endswith(b"\n"):
+                lines.append(b"\n")
+            writer.write(b"".join(lines))
+            async with drain_lock:
+                await writer.drain()
+
     try:
-        await process.wait()
-    except asyncio.CancelledError:
-        logger.info("Terminating pid %s", process.pid)
-        os.killpg(os.getpgid(process.pid), signal.SIGKILL)
-
-    # These statistics have been lost when migrating from pycaracal to caracal.
-    # TODO: Re-implement them.
-    return {
-        "probes_read": 0,
-        "packets_sent": 0,
-        "packets_failed": 0,
-        "filtered_low_ttl": 0,
-        "filtered_high_ttl": 0,
-        "filtered_prefix_excl": 0,
-        "filtered_prefix_not_incl": 0,
-        "packets_received": 0,
-        "packets_received_invalid": 0,
-        "pcap_received": 0,
-        "pcap_dropped": 0,
-        "pcap_interface_dropped": 0,
-    }
+        await asyncio.gather(*(copy(reader) for reader in readers))
+    finally:
+        writer.close()
@@ -0,0 +1,59 @@
+"""Share the agent probing rate between concurrent rounds."""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+
+def fair_shares(total: float, requested: dict[str, float]) -> dict[str, float]:
+    """
+    Max-min fair allocation of `total` between the `requested` rates:
+    rounds requesting less than an equal share get their requested rate,
+    and the remainder is split equally between the other rounds.
+    >>> fair_shares(1000, {"a": 100, "b": 2000, "c": 2000})
+    {'a': 100, 'b': 450.0, 'c': 450.0}
+    >>> fair_shares(1000, {"a": 100, "b": 200})
+    {'a': 100, 'b': 200}
+    >>> fair_shares(1000, {})
+    {}
+    """
+    shares = {}
+    remaining = total
+    pending = sorted(requested.items(), key=lambda x: x[1])
+    for i, (key, rate) in enumerate(pending):
+        share = remaining / (len(pending) - i)
+        if rate > share:
+            shares.update({key: share for key, _ in pending[i:]})
+            break
+        shares[key] = rate
+        remaining -= rate
+    return {key: shares[key] for key in requested}
+
+
+@dataclass
+class ProbingRateBudget:
+    """
+    Global probing rate budget of an agent, shared between the active rounds.
+    The shares are recomputed as rounds start and finish.
+    >>> budget = ProbingRateBudget(1000)
+    >>> with budget.reserve("a", 2000):
+    ...     budget.rate("a")
+    ...     with budget.reserve("b", 2000):
+    ...         budget.rate("a")
+    ...     budget.rate("a")
+    1000.0
+    500.0
+    1000.0
+    """
+
+    total: int
+    requested: dict[str, float] = field(default_factory=dict)
+
+    def rate(self, key: str) -> float:
+        return fair_shares(self.total, self.requested).get(key, 0.0)
+
+    @contextmanager
+    def reserve(self, key: str, rate: float):
+        self.requested[key] = rate
+        try:
+            yield
+        finally:
+            del self.requested[key]
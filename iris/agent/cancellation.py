@@ -0,0 +1,73 @@
+"""Notify the running rounds of their cancellation."""
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from logging import LoggerAdapter
+
+from redis.exceptions import RedisError
+
+from iris.commons.redis import Redis
+
+
+@dataclass
+class CancellationListener:
+    """
+    Listen for the deletion of the requests of the agent on a single Redis
+    subscription, and set the events of the corresponding running rounds.
+    The running rounds are also checked every `check_interval` seconds,
+    in case a notification is lost.
+    """
+
+    redis: Redis
+    logger: LoggerAdapter
+    agent_uuid: str
+    check_interval: float = 60
+    events: dict[str, set[asyncio.Event]] = field(
+        default_factory=lambda: defaultdict(set)
+    )
+
+    @asynccontextmanager
+    async def watch(self, measurement_uuid: str):
+        """Yield an event set when the request of the measurement is deleted."""
+        event = asyncio.Event()
+        self.events[measurement_uuid].add(event)
+        try:
+            # The request may have been deleted before we started watching it.
+            if not await self.redis.get_request(measurement_uuid, self.agent_uuid):
+                event.set()
+            yield event
+        finally:
+            self.events[measurement_uuid].discard(event)
+            if not self.events[measurement_uuid]:
+                del self.events[measurement_uuid]
+
+    async def run(self) -> None:
+        await asyncio.gather(self.listen(), self.check())
+
+    async def listen(self) -> None:
+        while True:
+            try:
+                async for measurement_uuid in self.redis.listen_cancellations(
+                    self.agent_uuid
+                ):
+                    await self.cancel(measurement_uuid)
+            except RedisError as e:
+                self.logger.error("Cancellations subscription failed: %s", e)
+                await asyncio.sleep(1)
+
+    async def check(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for measurement_uuid in list(self.events):
+                await self.cancel(measurement_uuid)
+
+    async def cancel(self, measurement_uuid: str) -> None:
+        if measurement_uuid not in self.events:
+            return
+        # Ignore stale notifications, the request may have been set again since.
+        if await self.redis.get_request(measurement_uuid, self.agent_uuid):
+            return
+        self.logger.info("Cancelling measurement %s", measurement_uuid)
+        for event in self.events.get(measurement_uuid, ()):
+            event.set()
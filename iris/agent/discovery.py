@@ -0,0 +1,113 @@
+"""Discover the external addresses and the exit TTL of the agent, with a disk cache."""
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from ipaddress import IPv4Address, IPv6Address
+from logging import LoggerAdapter
+from pathlib import Path
+
+from iris.agent.settings import AgentSettings
+from iris.agent.ttl import find_exit_ttl_with_mtr
+from iris.commons.models.base import BaseModel
+from iris.commons.utils import get_external_ipv4_address, get_external_ipv6_address
+
+
+class Discovery(BaseModel):
+    external_ipv4_address: IPv4Address | None = None
+    external_ipv6_address: IPv6Address | None = None
+    min_ttl: int | None = None
+    min_ttl_target: str | None = None
+    update_time: datetime
+
+
+@dataclass
+class DiscoveryCache:
+    """
+    Run the discoveries concurrently, and cache their results in
+    `AGENT_DISCOVERY_CACHE_PATH` for `AGENT_DISCOVERY_REFRESH_INTERVAL` seconds.
+    The exit TTL is only discovered if `find_exit_ttl` is set.
+    """
+
+    settings: AgentSettings
+    logger: LoggerAdapter
+    find_exit_ttl: bool
+
+    @property
+    def path(self) -> Path:
+        return self.settings.AGENT_DISCOVERY_CACHE_PATH
+
+    async def get(self) -> Discovery:
+        """Return the cached discovery, even if expired, or discover now if none."""
+        if (discovery := self.load()) and self.usable(discovery):
+            self.logger.info("Use discovery cached at %s", discovery.update_time)
+            return discovery
+        return await self.refresh()
+
+    async def refresh(self, previous: Discovery | None = None) -> Discovery:
+        """
+        Discover again; the previous addresses and exit TTL are kept
+        if they cannot be found.
+        """
+        discovery = await self.discover()
+        if previous:
+            if discovery.external_ipv4_address is None:
+                discovery.external_ipv4_address = previous.external_ipv4_address
+            if discovery.external_ipv6_address is None:
+                discovery.external_ipv6_address = previous.external_ipv6_address
+            if discovery.min_ttl is None:
+                discovery.min_ttl = previous.min_ttl
+        self.save(discovery)
+        return discovery
+
+    async def discover(self) -> Discovery:
+        self.logger.info("Discovering external addresses and exit TTL")
+        ipv4_address, ipv6_address, min_ttl = await asyncio.gather(
+            get_external_ipv4_address(),
+            get_external_ipv6_address(),
+            self.discover_exit_ttl(),
+        )
+        return Discovery(
+            external_ipv4_address=ipv4_address,
+            external_ipv6_address=ipv6_address,
+            min_ttl=min_ttl,
+            min_ttl_target=self.settings.AGENT_MIN_TTL_FIND_TARGET,
+            update_time=datetime.utcnow(),
+        )
+
+    async def discover_exit_ttl(self) -> int | None:
+        if not self.find_exit_ttl:
+            return None
+        # mtr is blocking, run it in a thread to not delay the other discoveries.
+        return await asyncio.to_thread(
+            find_exit_ttl_with_mtr,
+            self.settings.AGENT_MIN_TTL_FIND_TARGET,
+            min_ttl=2,
+            logger=self.logger,
+        )
+
+    def expires_in(self, discovery: Discovery) -> float:
+        """Seconds until the discovery must be refreshed."""
+        refresh_interval = timedelta(
+            seconds=self.settings.AGENT_DISCOVERY_REFRESH_INTERVAL
+        )
+        expiration = discovery.update_time + refresh_interval
+        return (expiration - datetime.utcnow()).total_seconds()
+
+    def usable(self, discovery: Discovery) -> bool:
+        return not self.find_exit_ttl or (
+            discovery.min_ttl is not None
+            and discovery.min_ttl_target == self.settings.AGENT_MIN_TTL_FIND_TARGET
+        )
+
+    def load(self) -> Discovery | None:
+        try:
+            return Discovery.parse_raw(self.path.read_text())
+        except (OSError, ValueError) as e:
+            self.logger.info("Cannot load cached discovery: %s", e)
+            return None
+
+    def save(self, discovery: Discovery) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(discovery.json())
+        tmp_path.rename(self.path)
@@ -1,24 +1,39 @@
 import asyncio
 import logging
+import shutil
 import socket
 import time
+from collections.abc import Coroutine
+from typing import Any
 
 from redis import asyncio as aioredis
 import psutil
 
 from iris import __version__
-from iris.agent.pipeline import outer_pipeline
+from iris.agent.budget import ProbingRateBudget
+from iris.agent.cancellation import CancellationListener
+from iris.agent.discovery import Discovery, DiscoveryCache
+from iris.agent.pipeline import (
+    is_streaming,
+    probe_round,
+    upload_round,
+    upload_spooled,
+)
+from iris.agent.prefetch import Prefetcher
 from iris.agent.settings import AgentSettings
-from iris.agent.ttl import find_exit_ttl_with_mtr
+from iris.agent.spool import ResultsSpool
 from iris.commons.dependencies import get_redis_context
 from iris.commons.logger import Adapter, base_logger
-from iris.commons.models import AgentParameters, AgentState
+from iris.commons.models import (
+    AgentParameters,
+    AgentState,
+    MeasurementRoundRequest,
+    ProbingStatistics,
+)
 from iris.commons.redis import Redis
 from iris.commons.storage import Storage
 from iris.commons.utils import (
     cancel_task,
-    get_external_ipv4_address,
-    get_external_ipv6_address,
     get_internal_ipv4_address,
     get_internal_ipv6_address,
 )
@@ -31,22 +46,210 @@ async def heartbeat(agent_uuid: str, redis: Redis) -> None:
         await asyncio.sleep(5)
 
 
-async def consumer(redis: Redis, storage: Storage, settings: AgentSettings):
-    """Consume tasks from the queue and run measurements."""
+def agent_parameters(settings: AgentSettings, discovery: Discovery) -> AgentParameters:
+    return AgentParameters(
+        version=__version__,
+        hostname=socket.gethostname(),
+        internal_ipv4_address=get_internal_ipv4_address(),
+        internal_ipv6_address=get_internal_ipv6_address(),
+        external_ipv4_address=discovery.external_ipv4_address,
+        external_ipv6_address=discovery.external_ipv6_address,
+        cpus=psutil.cpu_count(),
+        disk=round(
+            psutil.disk_usage(str(settings.AGENT_RESULTS_DIR_PATH)).total / 1000**3,
+            3,
+        ),
+        memory=round(psutil.virtual_memory().total / 1024**3, 3),
+        min_ttl=settings.AGENT_MIN_TTL,
+        max_probing_rate=settings.AGENT_MAX_PROBING_RATE,
+        tags=settings.AGENT_TAGS.split(","),
+        max_concurrent_rounds=settings.AGENT_MAX_CONCURRENT_ROUNDS,
+    )
+
+
+async def refresh_discovery(
+    logger: Adapter,
+    redis: Redis,
+    settings: AgentSettings,
+    discoveries: DiscoveryCache,
+    discovery: Discovery,
+) -> None:
+    """Periodically refresh the discovery, and update the agent parameters."""
     while True:
-        request = await redis.get_random_request(settings.AGENT_UUID)
+        await asyncio.sleep(max(discoveries.expires_in(discovery), 0))
+        try:
+            discovery = await discoveries.refresh(discovery)
+        except Exception as e:
+            logger.error("Cannot refresh discovery: %s", e)
+            await asyncio.sleep(60)
+            continue
+        if discoveries.find_exit_ttl and discovery.min_ttl:
+            settings.AGENT_MIN_TTL = discovery.min_ttl
+        await redis.set_agent_parameters(
+            settings.AGENT_UUID, agent_parameters(settings, discovery)
+        )
+
+
+async def consumer(
+    redis: Redis,
+    storage: Storage,
+    settings: AgentSettings,
+    cancellations: CancellationListener,
+):
+    """
+    Consume tasks from the queue and run measurements,
+    up to `AGENT_MAX_CONCURRENT_ROUNDS` rounds at a time.
+    The results of a round are uploaded in the background, and the probe file
+    of the next round is prefetched, while the next rounds are probing.
+    """
+    logger = Adapter(
+        base_logger, dict(component="agent", agent_uuid=settings.AGENT_UUID)
+    )
+    budget = None
+    if settings.AGENT_MAX_CONCURRENT_ROUNDS > 1:
+        budget = ProbingRateBudget(settings.AGENT_MAX_PROBING_RATE)
+    prefetcher = None
+    if settings.AGENT_PREFETCH_MAX_SIZE > 0 and not is_streaming(settings):
+        prefetcher = Prefetcher(settings, logger, redis, storage)
+    await resume_uploads(redis, storage, settings)
+    running: set[asyncio.Task] = set()
+    uploading: set[asyncio.Task] = set()
+    fetcher = None
+    prefetch = None
+    # Prefetch when all the slots are busy, once each time the rounds change.
+    prefetch_pending = False
+    try:
+        while True:
+            if (
+                not fetcher
+                and len(running) < settings.AGENT_MAX_CONCURRENT_ROUNDS
+                # Bound the results waiting for upload on the disk.
+                and len(uploading) <= settings.AGENT_MAX_CONCURRENT_ROUNDS
+            ):
+                # The running requests stay in the queue until they are done,
+                # but they are not returned again.
+                fetcher = asyncio.create_task(
+                    redis.get_next_request(settings.AGENT_UUID)
+                )
+            if (
+                prefetcher
+                and prefetch_pending
+                and not prefetch
+                and len(running) >= settings.AGENT_MAX_CONCURRENT_ROUNDS
+            ):
+                prefetch = asyncio.create_task(prefetcher.prefetch())
+                prefetch_pending = False
+            done, _ = await asyncio.wait(
+                [task for task in (fetcher, prefetch) if task] + [*running, *uploading],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if task is fetcher:
+                    request = fetcher.result()
+                    fetcher = None
+                    await redis.set_agent_state(settings.AGENT_UUID, AgentState.Working)
+                    running.add(
+                        asyncio.create_task(
+                            consume_request(
+                                redis,
+                                storage,
+                                settings,
+                                cancellations,
+                                request,
+                                budget,
+                                prefetcher,
+                            )
+                        )
+                    )
+                    prefetch_pending = True
+                elif task is prefetch:
+                    prefetch = None
+                    try:
+                        task.result()
+                    except Exception as e:
+                        # Prefetching is an optimization only, do not stop the agent.
+                        logger.warning("Prefetch failed: %s", e)
+                elif task in running:
+                    running.remove(task)
+                    # Propagate the exceptions, if any.
+                    uploading.add(asyncio.create_task(task.result()))
+                    prefetch_pending = True
+                else:
+                    uploading.remove(task)
+                    task.result()  # Propagate the exceptions, if any.
+                if not running and not uploading:
+                    await redis.set_agent_state(settings.AGENT_UUID, AgentState.Idle)
+    finally:
+        for task in [fetcher, prefetch, *running, *uploading]:
+            if task:
+                await cancel_task(task)
+
+
+async def resume_uploads(redis: Redis, storage: Storage, settings: AgentSettings):
+    """Upload the results spooled by a previous run, before taking new work."""
+    spool = ResultsSpool(settings.AGENT_SPOOL_DIR_PATH)
+    for entry in spool.entries():
+        measurement_uuid = entry.request.measurement_uuid
         logger = Adapter(
             base_logger,
             dict(
                 component="agent",
-                measurement_uuid=request.measurement_uuid,
+                measurement_uuid=measurement_uuid,
                 agent_uuid=settings.AGENT_UUID,
             ),
         )
-        await redis.set_agent_state(settings.AGENT_UUID, AgentState.Working)
-        await outer_pipeline(settings, request, logger, redis, storage)
-        await redis.set_agent_state(settings.AGENT_UUID, AgentState.Idle)
-        await redis.delete_request(request.measurement_uuid, settings.AGENT_UUID)
+        if not await redis.get_request(measurement_uuid, settings.AGENT_UUID):
+            logger.info("Discard the spooled results of a cancelled round")
+            spool.remove(entry)
+            continue
+        logger.info("Resume the upload of the spooled results")
+        await upload_spooled(settings, logger, redis, storage, spool, entry)
+        await redis.delete_request(measurement_uuid, settings.AGENT_UUID)
+
+
+async def consume_request(
+    redis: Redis,
+    storage: Storage,
+    settings: AgentSettings,
+    cancellations: CancellationListener,
+    request: MeasurementRoundRequest,
+    budget: ProbingRateBudget | None,
+    prefetcher: Prefetcher | None = None,
+) -> Coroutine[Any, Any, None]:
+    """
+    Probe a round, and return a coroutine uploading its results,
+    so that the next round can start probing during the upload.
+    """
+    logger = Adapter(
+        base_logger,
+        dict(
+            component="agent",
+            measurement_uuid=request.measurement_uuid,
+            agent_uuid=settings.AGENT_UUID,
+        ),
+    )
+    if prefetcher:
+        await prefetcher.wait(request.measurement_uuid)
+    start = time.monotonic()
+    async with cancellations.watch(request.measurement_uuid) as cancelled:
+        statistics = await probe_round(
+            settings, request, logger, redis, storage, budget, cancelled
+        )
+    # The round only occupies a slot of the agent while probing.
+    await redis.record_round_duration(settings.AGENT_UUID, time.monotonic() - start)
+    return finish_request(redis, storage, settings, logger, request, statistics)
+
+
+async def finish_request(
+    redis: Redis,
+    storage: Storage,
+    settings: AgentSettings,
+    logger: Adapter,
+    request: MeasurementRoundRequest,
+    statistics: ProbingStatistics | None,
+):
+    await upload_round(settings, request, logger, redis, storage, statistics)
+    await redis.delete_request(request.measurement_uuid, settings.AGENT_UUID)
 
 
 async def main(settings=AgentSettings()):
@@ -55,23 +258,28 @@ async def main(settings=AgentSettings()):
     logger = Adapter(
         base_logger, dict(component="agent", agent_uuid=settings.AGENT_UUID)
     )
-    storage = Storage(settings, logger)
-    async with get_redis_context(settings, logger) as redis:
-        await main_with_deps(logger, redis, settings, storage)
+    async with Storage.open(settings, logger) as storage:
+        async with get_redis_context(settings, logger) as redis:
+            await main_with_deps(logger, redis, settings, storage)
 
 
 async def main_with_deps(
     logger: Adapter, redis: Redis, settings: AgentSettings, storage: Storage
 ):
+    # Remove the files left by rounds interrupted in a previous run.
+    shutil.rmtree(settings.AGENT_RESULTS_DIR_PATH, ignore_errors=True)
+    shutil.rmtree(settings.AGENT_TARGETS_DIR_PATH, ignore_errors=True)
     settings.AGENT_RESULTS_DIR_PATH.mkdir(parents=True, exist_ok=True)
     settings.AGENT_TARGETS_DIR_PATH.mkdir(parents=True, exist_ok=True)
 
-    if settings.AGENT_MIN_TTL < 0:
-        min_ttl = find_exit_ttl_with_mtr(
-            settings.AGENT_MIN_TTL_FIND_TARGET, min_ttl=2, logger=logger
-        )
-        assert min_ttl, "Unable to find exit TTL"
-        settings.AGENT_MIN_TTL = min_ttl
+    # Start with the cached discovery, if any, and refresh it in the background.
+    discoveries = DiscoveryCache(
+        settings, logger, find_exit_ttl=settings.AGENT_MIN_TTL < 0
+    )
+    discovery = await discoveries.get()
+    if discoveries.find_exit_ttl:
+        assert discovery.min_ttl, "Unable to find exit TTL"
+        settings.AGENT_MIN_TTL = discovery.min_ttl
 
     while True:
         try:
@@ -84,31 +292,25 @@ async def main_with_deps(
     tasks = []
     try:
         await redis.set_agent_state(settings.AGENT_UUID, AgentState.Idle)
+        # Requests marked as running by a previous run are to be probed again.
+        await redis.delete_running_requests(settings.AGENT_UUID)
         await redis.set_agent_parameters(
-            settings.AGENT_UUID,
-            AgentParameters(
-                version=__version__,
-                hostname=socket.gethostname(),
-                internal_ipv4_address=get_internal_ipv4_address(),
-                internal_ipv6_address=get_internal_ipv6_address(),
-                external_ipv4_address=get_external_ipv4_address(),
-                external_ipv6_address=get_external_ipv6_address(),
-                cpus=psutil.cpu_count(),
-                disk=round(
-                    psutil.disk_usage(str(settings.AGENT_RESULTS_DIR_PATH)).total
-                    / 1000**3,
-                    3,
-                ),
-                memory=round(psutil.virtual_memory().total / 1024**3, 3),
-                min_ttl=settings.AGENT_MIN_TTL,
-                max_probing_rate=settings.AGENT_MAX_PROBING_RATE,
-                tags=settings.AGENT_TAGS.split(","),
-            ),
+            settings.AGENT_UUID, agent_parameters(settings, discovery)
         )
 
+        cancellations = CancellationListener(
+            redis,
+            logger,
+            settings.AGENT_UUID,
+            check_interval=settings.AGENT_CANCELLATION_CHECK_INTERVAL,
+        )
         tasks = [
             asyncio.create_task(heartbeat(settings.AGENT_UUID, redis)),
-            asyncio.create_task(consumer(redis, storage, settings)),
+            asyncio.create_task(
+                refresh_discovery(logger, redis, settings, discoveries, discovery)
+            ),
+            asyncio.create_task(cancellations.run()),
+            asyncio.create_task(consumer(redis, storage, settings, cancellations)),
         ]
         await asyncio.gather(*tasks)
 
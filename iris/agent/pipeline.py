@@ -1,39 +1,95 @@
 """Measurement interface."""
+import asyncio
 import shutil
 from datetime import datetime
 from logging import LoggerAdapter
+from pathlib import Path
 
 from iris.agent.backend import backend_from_string
+from iris.agent.budget import ProbingRateBudget
 from iris.agent.settings import AgentSettings
+from iris.agent.spool import ResultsSpool, SpoolEntry
 from iris.commons.models import MeasurementRoundRequest, ProbingStatistics
 from iris.commons.redis import Redis
 from iris.commons.storage import Storage, results_key
 
 
+def measurement_paths(
+    settings: AgentSettings, measurement_uuid: str
+) -> tuple[Path, Path]:
+    """Return the local results and targets directories of a measurement."""
+    # Use per-measurement directories as several rounds can run concurrently.
+    return (
+        settings.AGENT_RESULTS_DIR_PATH / measurement_uuid,
+        settings.AGENT_TARGETS_DIR_PATH / measurement_uuid,
+    )
+
+
+def is_streaming(settings: AgentSettings) -> bool:
+    # When streaming, the probes are read from, and the results written to,
+    # the object storage directly by the backend: the paths are not created.
+    return settings.AGENT_BACKEND == "caracal" and settings.AGENT_CARACAL_STREAMING
+
+
 async def outer_pipeline(
     settings: AgentSettings,
     request: MeasurementRoundRequest,
     logger: LoggerAdapter,
     redis: Redis,
     storage: Storage,
+    budget: ProbingRateBudget | None = None,
+    cancelled: asyncio.Event | None = None,
 ):
-    """Conduct a measurement."""
+    """
+    Conduct a measurement.
+    If `budget` is specified, the probing rate is shared with the other rounds
+    running concurrently on the agent.
+    If `cancelled` is specified, the round is cancelled when it is set.
+    """
+    statistics = await probe_round(
+        settings, request, logger, redis, storage, budget, cancelled
+    )
+    await upload_round(settings, request, logger, redis, storage, statistics)
+
+
+async def probe_round(
+    settings: AgentSettings,
+    request: MeasurementRoundRequest,
+    logger: LoggerAdapter,
+    redis: Redis,
+    storage: Storage,
+    budget: ProbingRateBudget | None = None,
+    cancelled: asyncio.Event | None = None,
+) -> ProbingStatistics | None:
+    """
+    Probe a round, and leave its results in the local results directory.
+    The probe file is downloaded, unless it has already been prefetched.
+    Returns `None` if the round was cancelled.
+    """
     logger.info("Launch measurement procedure")
 
-    logger.info("Create local measurement directory")
-    measurement_results_path = (
-        settings.AGENT_RESULTS_DIR_PATH / request.measurement_uuid
+    logger.info("Create local measurement directories")
+    measurement_results_path, measurement_targets_path = measurement_paths(
+        settings, request.measurement_uuid
     )
     measurement_results_path.mkdir(exist_ok=True)
+    measurement_targets_path.mkdir(exist_ok=True)
 
     results_filepath = measurement_results_path / results_key(request.round)
+    probes_filepath = measurement_targets_path / request.probe_filename
 
-    logger.info("Download CSV probe file locally")
-    probes_filepath = await storage.download_file_to(
-        storage.measurement_agent_bucket(request.measurement_uuid, settings.AGENT_UUID),
-        request.probe_filename,
-        settings.AGENT_TARGETS_DIR_PATH,
-    )
+    streaming = is_streaming(settings)
+    if not streaming and probes_filepath.exists():
+        logger.info("Use prefetched CSV probe file")
+    elif not streaming:
+        logger.info("Download CSV probe file locally")
+        await storage.download_file(
+            storage.measurement_agent_bucket(
+                request.measurement_uuid, settings.AGENT_UUID
+            ),
+            request.probe_filename,
+            probes_filepath,
+        )
 
     logger.info("Probe file: %s", request.probe_filename)
     logger.info("%s", request.round)
@@ -41,37 +97,105 @@ async def outer_pipeline(
 
     probing_start_time = datetime.utcnow()
     backend = backend_from_string[settings.AGENT_BACKEND]
+    backend_kwargs: dict = dict(cancelled=cancelled)
+    if settings.AGENT_BACKEND == "caracal":
+        backend_kwargs |= dict(storage=storage if streaming else None, budget=budget)
     prober_statistics = await backend(
-        settings, request, logger, redis, probes_filepath, results_filepath
+        settings,
+        request,
+        logger,
+        redis,
+        probes_filepath,
+        results_filepath,
+        **backend_kwargs,
     )
 
-    if prober_statistics:
-        logger.info("Upload probing statistics to Redis")
-        statistics = ProbingStatistics(
-            round=request.round,
-            start_time=probing_start_time,
-            end_time=datetime.utcnow(),
-            **prober_statistics,
-        )
-        await redis.set_measurement_stats(
-            request.measurement_uuid, settings.AGENT_UUID, statistics
-        )
+    await redis.delete_measurement_progress(
+        request.measurement_uuid, settings.AGENT_UUID
+    )
 
-        logger.info("Upload results file into S3")
-        await storage.upload_file(
-            storage.measurement_agent_bucket(
-                request.measurement_uuid, settings.AGENT_UUID
-            ),
-            results_key(request.round),
-            results_filepath,
-        )
-    else:
+    if not prober_statistics:
+        return None
+    return ProbingStatistics(
+        round=request.round,
+        start_time=probing_start_time,
+        end_time=datetime.utcnow(),
+        **prober_statistics,
+    )
+
+
+async def upload_round(
+    settings: AgentSettings,
+    request: MeasurementRoundRequest,
+    logger: LoggerAdapter,
+    redis: Redis,
+    storage: Storage,
+    statistics: ProbingStatistics | None,
+):
+    """
+    Upload the results of a round probed by `probe_round`,
+    and remove its local directories.
+    The results file is kept in the spool until it is uploaded.
+    """
+    measurement_results_path, measurement_targets_path = measurement_paths(
+        settings, request.measurement_uuid
+    )
+
+    spool, entry = ResultsSpool(settings.AGENT_SPOOL_DIR_PATH), None
+    if not statistics:
         logger.warning("Measurement canceled")
+    elif is_streaming(settings):
+        # The results have already been uploaded by the backend.
+        await publish_results(settings, request, logger, redis, statistics)
+    else:
+        logger.info("Move results file to the spool")
+        entry = spool.add(
+            request,
+            statistics,
+            measurement_results_path / results_key(request.round),
+        )
+
+    logger.info("Remove local measurement directories")
+    shutil.rmtree(measurement_results_path)
+    shutil.rmtree(measurement_targets_path)
 
-    logger.info("Empty local results directory")
-    shutil.rmtree(settings.AGENT_RESULTS_DIR_PATH)
-    settings.AGENT_RESULTS_DIR_PATH.mkdir()
+    if entry:
+        await upload_spooled(settings, logger, redis, storage, spool, entry)
 
-    logger.info("Empty local targets directory")
-    shutil.rmtree(settings.AGENT_TARGETS_DIR_PATH)
-    settings.AGENT_TARGETS_DIR_PATH.mkdir()
+
+async def upload_spooled(
+    settings: AgentSettings,
+    logger: LoggerAdapter,
+    redis: Redis,
+    storage: Storage,
+    spool: ResultsSpool,
+    entry: SpoolEntry,
+):
+    """Upload a spooled results file, resuming a previous upload if any."""
+    request = entry.request
+    logger.info("Upload results file into S3")
+    await storage.upload_file_resumable(
+        storage.measurement_agent_bucket(request.measurement_uuid, settings.AGENT_UUID),
+        results_key(request.round),
+        spool.results_filepath(entry),
+        entry.upload,
+        checkpoint=lambda _: spool.save(entry),
+    )
+    await publish_results(settings, request, logger, redis, entry.statistics)
+    spool.remove(entry)
+
+
+async def publish_results(
+    settings: AgentSettings,
+    request: MeasurementRoundRequest,
+    logger: LoggerAdapter,
+    redis: Redis,
+    statistics: ProbingStatistics,
+):
+    logger.info("Upload probing statistics to Redis")
+    await redis.set_measurement_stats(
+        request.measurement_uuid, settings.AGENT_UUID, statistics
+    )
+    await redis.notify_results(
+        request.measurement_uuid, settings.AGENT_UUID, results_key(request.round)
+    )
@@ -0,0 +1,120 @@
+"""Download the probe files of the queued requests in advance."""
+import asyncio
+import shutil
+from dataclasses import dataclass, field
+from datetime import datetime
+from logging import LoggerAdapter
+from pathlib import Path
+
+from iris.agent.pipeline import measurement_paths
+from iris.agent.settings import AgentSettings
+from iris.commons.models import MeasurementRoundRequest
+from iris.commons.redis import Redis
+from iris.commons.scheduler import schedule
+from iris.commons.storage import Storage
+
+
+@dataclass
+class Prefetcher:
+    """
+    Download the probe file of the next request of the queue while the
+    current rounds are probing, so that it is ready when a round finishes.
+    The prefetched files take at most `AGENT_PREFETCH_MAX_SIZE` bytes,
+    and at least `AGENT_PREFETCH_MIN_FREE_SPACE` bytes are left on the disk.
+    """
+
+    settings: AgentSettings
+    logger: LoggerAdapter
+    redis: Redis
+    storage: Storage
+    # Size of the prefetched files, by measurement UUID.
+    prefetched: dict[str, int] = field(default_factory=dict)
+    downloads: dict[str, asyncio.Task] = field(default_factory=dict)
+
+    async def prefetch(self) -> None:
+        """Prefetch the probe file of the next queued request, if possible."""
+        try:
+            await self.forget()
+            queued = await self.redis.get_queued_requests(self.settings.AGENT_UUID)
+            if not queued:
+                return
+            request = schedule(
+                queued,
+                await self.redis.get_queue_service(self.settings.AGENT_UUID),
+                datetime.utcnow(),
+                self.settings.REDIS_QUEUE_AGING_INTERVAL,
+            )[0]
+            if request.measurement_uuid in self.prefetched:
+                return
+            task = asyncio.create_task(self.download(request))
+            self.downloads[request.measurement_uuid] = task
+            try:
+                await task
+            finally:
+                del self.downloads[request.measurement_uuid]
+        except Exception as e:
+            # Prefetching is an optimization only, the round will download the file.
+            self.logger.warning("Cannot prefetch probe file: %s", e)
+
+    async def download(self, request: MeasurementRoundRequest) -> None:
+        bucket = self.storage.measurement_agent_bucket(
+            request.measurement_uuid, self.settings.AGENT_UUID
+        )
+        size = await self.storage.get_file_size(bucket, request.probe_filename)
+        _, targets_path = measurement_paths(self.settings, request.measurement_uuid)
+        path = targets_path / request.probe_filename
+        targets_path.mkdir(parents=True, exist_ok=True)
+        if not self.has_space(path.parent, size):
+            self.logger.info("Not enough space to prefetch %s", request.probe_filename)
+            return
+        self.logger.info("Prefetch probe file %s", request.probe_filename)
+        # Rename the file once complete, so that a partial file is never used.
+        partial_path = path.with_name(f"{path.name}.partial")
+        self.prefetched[request.measurement_uuid] = size
+        try:
+            await self.storage.download_file(
+                bucket, request.probe_filename, partial_path
+            )
+            partial_path.rename(path)
+        except BaseException:
+            del self.prefetched[request.measurement_uuid]
+            partial_path.unlink(missing_ok=True)
+            raise
+
+    def has_space(self, directory: Path, size: int) -> bool:
+        prefetched = sum(self.prefetched.values())
+        free = shutil.disk_usage(directory).free
+        return (
+            prefetched + size <= self.settings.AGENT_PREFETCH_MAX_SIZE
+            and free - size >= self.settings.AGENT_PREFETCH_MIN_FREE_SPACE
+        )
+
+    async def wait(self, measurement_uuid: str) -> None:
+        """Wait for the prefetch of the measurement probe file, if in progress."""
+        if task := self.downloads.get(measurement_uuid):
+            await asyncio.wait([task])
+
+    async def forget(self) -> None:
+        """
+        Forget the files of the requests that are not queued anymore:
+        the running rounds delete their files, and the others are deleted here.
+        """
+        running = {
+            request.measurement_uuid
+            for request in await self.redis.get_running_requests(
+                self.settings.AGENT_UUID
+            )
+        }
+        queued = {
+            request.measurement_uuid
+            for request in await self.redis.get_queued_requests(
+                self.settings.AGENT_UUID
+            )
+        }
+        for measurement_uuid in list(self.prefetched):
+            if measurement_uuid in queued:
+                continue
+            del self.prefetched[measurement_uuid]
+            if measurement_uuid not in running:
+                _, targets_path = measurement_paths(self.settings, measurement_uuid)
+                shutil.rmtree(targets_path, ignore_errors=True)
@@ -19,21 +19,49 @@ class AgentSettings(CommonSettings):
     AGENT_CARACAL_EXCLUDE_PATH: Path = Path("statics/excluded_prefixes")
     AGENT_CARACAL_INTEGRITY_CHECK: bool = True
     AGENT_CARACAL_SNIFFER_WAIT_TIME: int = 5
-    
+    # Stream the probes from, and the results to, S3 instead of local files.
+    # The results are not spooled: if their upload fails, the round is lost
+    # and is not resumed after a restart.
+    AGENT_CARACAL_STREAMING: bool = False
+    AGENT_CARACAL_PROGRESS_INTERVAL: float = 5  # seconds
+    # Split the probes by destination between several caracal processes,
+    # sending from these interfaces in turn, if any.
+    AGENT_CARACAL_SHARDS: int = 1
+    AGENT_CARACAL_SHARD_INTERFACES: list[str] = []
+
     AGENT_UUID: str = str(uuid4())
     AGENT_UUID_FILE: Path | None = None
     AGENT_MAX_PROBING_RATE: int = 1000  # pps
+    # Rounds of different measurements run concurrently share the probing rate.
+    AGENT_MAX_CONCURRENT_ROUNDS: int = 1
     AGENT_MIN_TTL: int = -1  # A value < 0 will trigger `find_exit_ttl`
     AGENT_MIN_TTL_FIND_TARGET: str = "example.org"
+    # The external addresses and the exit TTL are cached on disk: the agent starts
+    # with the cached values, and refreshes them in the background.
+    AGENT_DISCOVERY_CACHE_PATH: Path = Path("iris_data/agent/discovery.json")
+    AGENT_DISCOVERY_REFRESH_INTERVAL: int = 24 * 60 * 60  # seconds
     AGENT_RIPE_ATLAS_KEY: str = ""
+    AGENT_RIPE_ATLAS_CONCURRENCY: int = 16  # API requests in flight
+    AGENT_RIPE_ATLAS_DEFINITIONS_PER_REQUEST: int = 100
+    AGENT_RIPE_ATLAS_REFRESH_INTERVAL: float = 10  # seconds
     AGENT_TAGS: str = "all"  # comma-separated list of tags
 
     AGENT_TARGETS_DIR_PATH: Path = Path("iris_data/agent/targets")
     AGENT_RESULTS_DIR_PATH: Path = Path("iris_data/agent/results")
+    # Results files waiting for upload, kept across restarts of the agent.
+    AGENT_SPOOL_DIR_PATH: Path = Path("iris_data/agent/spool")
+    AGENT_RESULTS_FRAME_LINES: int = 1_000_000  # put to 0 to write a single frame
+    # The probe file of the next round is downloaded while the current rounds
+    # are probing, within these limits; put the max size to 0 to disable it.
+    AGENT_PREFETCH_MAX_SIZE: int = 2**30  # bytes
+    AGENT_PREFETCH_MIN_FREE_SPACE: int = 2**30  # bytes
 
     AGENT_STOPPER_REFRESH: int = 1  # seconds
+    # Cancellations are notified through Redis, the running rounds are only
+    # checked at this interval in case a notification is lost.
+    AGENT_CANCELLATION_CHECK_INTERVAL: int = 60  # seconds
 
-    @model_validator(mode='after')
+    @model_validator(mode="after")
     def load_or_save_uuid(self):
         """
         If an AGENT_UUID_FILE is specified:
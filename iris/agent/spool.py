@@ -0,0 +1,66 @@
+"""Local spool of the results files waiting to be uploaded."""
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+
+from iris.commons.models import MeasurementRoundRequest, ProbingStatistics
+from iris.commons.models.base import BaseModel
+from iris.commons.storage import results_key
+
+
+class SpoolEntry(BaseModel):
+    request: MeasurementRoundRequest
+    statistics: ProbingStatistics
+    # State of the resumable upload, see `Storage.upload_file_resumable`.
+    upload: dict = {}
+
+
+@dataclass(frozen=True)
+class ResultsSpool:
+    """
+    The results file of a probed round is moved to `path/<measurement_uuid>/`,
+    next to a `manifest.json` file describing the round, until it is uploaded.
+    The spooled rounds are uploaded again after a restart of the agent.
+    """
+
+    path: Path
+
+    def add(
+        self,
+        request: MeasurementRoundRequest,
+        statistics: ProbingStatistics,
+        results_filepath: Path,
+    ) -> SpoolEntry:
+        entry = SpoolEntry(request=request, statistics=statistics)
+        self.entry_path(entry).mkdir(parents=True, exist_ok=True)
+        # The spool can be on another filesystem than the results directory.
+        shutil.move(results_filepath, self.results_filepath(entry))
+        # The manifest is written last: a directory without one is incomplete.
+        self.save(entry)
+        return entry
+
+    def entries(self) -> list[SpoolEntry]:
+        """Return the spooled rounds, and remove the incomplete ones."""
+        entries = []
+        for path in sorted(self.path.glob("*")):
+            try:
+                entries.append(
+                    SpoolEntry.parse_raw((path / "manifest.json").read_text())
+                )
+            except (OSError, ValueError):
+                shutil.rmtree(path, ignore_errors=True)
+        return entries
+
+    def entry_path(self, entry: SpoolEntry) -> Path:
+        return self.path / entry.request.measurement_uuid
+
+    def results_filepath(self, entry: SpoolEntry) -> Path:
+        return self.entry_path(entry) / results_key(entry.request.round)
+
+    def save(self, entry: SpoolEntry) -> None:
+        tmp_path = self.entry_path(entry) / "manifest.json.tmp"
+        tmp_path.write_text(entry.json())
+        tmp_path.rename(self.entry_path(entry) / "manifest.json")
+
+    def remove(self, entry: SpoolEntry) -> None:
+        shutil.rmtree(self.entry_path(entry), ignore_errors=True)
@@ -4,7 +4,7 @@ from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 
 from iris.api.authentication import assert_probing_enabled, current_verified_user
 from iris.commons.dependencies import get_redis
-from iris.commons.models import Agent, Paginated, User
+from iris.commons.models import Agent, AgentQueue, Paginated, User
 from iris.commons.redis import Redis
 
 router = APIRouter()
@@ -38,3 +38,21 @@ async def get_agent_by_uuid(
     if agent := await redis.get_agent_by_uuid(str(uuid)):
         return agent
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found")
+
+
+@router.get(
+    "/{uuid}/queue",
+    response_model=AgentQueue,
+    summary="Get the requests running and queued on the agent specified by UUID.",
+)
+async def get_agent_queue(
+    uuid: UUID,
+    user: User = Depends(current_verified_user),
+    redis: Redis = Depends(get_redis),
+):
+    assert_probing_enabled(user)
+    if not await redis.get_agent_by_uuid(str(uuid)):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found"
+        )
+    return await redis.get_agent_queue(str(uuid))
@@ -1,4 +1,6 @@
 """API Entrypoint."""
+from contextlib import asynccontextmanager
+
 import botocore.exceptions
 from fastapi import Depends, FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,12 +13,23 @@ from iris import __version__
 from iris.api import agents, maintenance, measurements, status, targets, users
 from iris.api.authentication import current_superuser
 from iris.api.settings import APISettings
+from iris.commons.logger import Adapter, base_logger
+from iris.commons.storage import Storage
 
 
 def make_app(*args, settings: APISettings | None = None) -> FastAPI:
     settings = settings or APISettings()
 
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Share a pool of S3 connections between the requests.
+        logger = Adapter(base_logger, dict(component="api"))
+        async with Storage.open(settings, logger) as storage:
+            app.state.s3_client = storage.s3_client
+            yield
+
     app = FastAPI(
+        lifespan=lifespan,
         title="🕸️ Iris",
         description="""
     Iris is a system to coordinate complex network measurements from multiple vantage points.<br/>
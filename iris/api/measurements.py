@@ -26,6 +26,7 @@ from iris.commons.models import (
     MeasurementRead,
     MeasurementReadWithAgents,
     Paginated,
+    ProbingProgress,
     Target,
     User,
 )
@@ -216,6 +217,7 @@ async def post_measurement(
         user_id=str(user.id),
         tool=measurement_body.tool,
         tags=measurement_body.tags,
+        priority=measurement_body.priority,
     )
     session.add(measurement)
     session.commit()
@@ -327,6 +329,31 @@ async def get_measurement_agent_target(
     return Target.from_s3(target_file)
 
 
+@router.get(
+    "/{measurement_uuid}/{agent_uuid}/progress",
+    response_model=ProbingProgress,
+    summary="Get the progress of the round being probed by the agent specified by UUID.",
+)
+async def get_measurement_agent_progress(
+    measurement_uuid: UUID,
+    agent_uuid: UUID,
+    user: User = Depends(current_verified_user),
+    session: Session = Depends(get_session),
+    settings: APISettings = Depends(get_settings),
+    redis: Redis = Depends(get_redis),
+):
+    measurement = Measurement.get(session, str(measurement_uuid))
+    assert_measurement_visibility(measurement, user, settings)
+    progress = await redis.get_measurement_progress(
+        str(measurement_uuid), str(agent_uuid)
+    )
+    if not progress:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="No round in progress"
+        )
+    return progress
+
+
 @router.delete(
     "/{measurement_uuid}",
     response_model=MeasurementReadWithAgents,
@@ -0,0 +1,295 @@
+"""Adaptive concurrency and chunk size of the ClickHouse inserts and queries."""
+
+import math
+import os
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from functools import cache
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, TypeVar
+
+from pych_client.exceptions import ClickHouseException
+
+if TYPE_CHECKING:
+    from prometheus_client import Counter, Gauge
+
+T = TypeVar("T")
+
+MEMORY_LIMIT_EXCEEDED = 241
+"""ClickHouse error code of the queries that exceeded their memory limit."""
+
+
+@dataclass(frozen=True)
+class AdaptiveMetrics:
+    concurrency: "Gauge"
+    chunk_size: "Gauge"
+    throughput: "Gauge"
+    decisions: "Counter"
+
+
+@cache
+def adaptive_metrics() -> AdaptiveMetrics:
+    """Create the metrics on their first use, as `stage_metrics`."""
+    from prometheus_client import Counter, Gauge
+
+    return AdaptiveMetrics(
+        concurrency=Gauge(
+            "iris_adaptive_concurrency",
+            "Number of concurrent requests chosen by the adaptive controller",
+            ["operation"],
+            multiprocess_mode="liveall",
+        ),
+        chunk_size=Gauge(
+            "iris_adaptive_chunk_size",
+            "Size of the chunks chosen by the adaptive controller",
+            ["operation"],
+            multiprocess_mode="liveall",
+        ),
+        throughput=Gauge(
+            "iris_adaptive_throughput",
+            "Throughput, in units per second, of the last window "
+            "of the adaptive controller",
+            ["operation"],
+            multiprocess_mode="liveall",
+        ),
+        decisions=Counter(
+            "iris_adaptive_decisions",
+            "Decisions of the adaptive controller",
+            ["operation", "decision"],
+        ),
+    )
+
+
+@dataclass
+class AdaptiveController:
+    """
+    Choose the number of concurrent requests, and the size of their chunks,
+    from the requests completed during a window of `concurrency` requests.
+    The concurrency climbs in the direction that increases the throughput,
+    and decreases when the latency exceeds `latency_target`.
+    On `MEMORY_LIMIT_EXCEEDED` errors, the concurrency and the chunk size are halved,
+    the chunk size then ramps up again, up to `max_chunk_size`, after the windows
+    whose throughput does not decrease and whose latency is below the target.
+
+    >>> controller = AdaptiveController("example", concurrency=2, max_concurrency=4)
+    >>> controller.start(now=0.0)
+    >>> controller.record(100, 0.5, now=0.5)
+    >>> controller.record(100, 0.5, now=1.0)
+    >>> controller.concurrency, controller.throughput
+    (3, 200.0)
+    >>> controller.backoff()
+    >>> controller.concurrency
+    1
+    """
+
+    operation: str
+    concurrency: int
+    max_concurrency: int
+    min_concurrency: int = 1
+    chunk_size: int = 0
+    max_chunk_size: int = 0
+    min_chunk_size: int = 0
+    latency_target: float = 60.0  # seconds
+    # Relative change of throughput below which the concurrency is kept.
+    tolerance: float = 0.05
+    direction: int = 1
+    throughput: float = 0.0
+    window_start: float | None = None
+    window_requests: int = 0
+    window_size: int = 0
+    window_latency: float = 0.0
+    lock: Lock = field(default_factory=Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        self.concurrency = self.clamp(self.concurrency)
+        self.export()
+
+    def clamp(self, concurrency: int) -> int:
+        return max(self.min_concurrency, min(self.max_concurrency, concurrency))
+
+    def start(self, now: float | None = None) -> None:
+        """Start the window at the first request, if not already started."""
+        with self.lock:
+            if self.window_start is None:
+                self.window_start = perf_counter() if now is None else now
+
+    def record(self, size: int, latency: float, now: float | None = None) -> None:
+        """Record a successful request of `size` units, that took `latency` seconds."""
+        now = perf_counter() if now is None else now
+        with self.lock:
+            if self.window_start is None:
+                self.window_start = now - latency
+            self.window_requests += 1
+            self.window_size += size
+            self.window_latency += latency
+            if self.window_requests >= self.concurrency:
+                self.update(now)
+
+    def update(self, now: float) -> None:
+        assert self.window_start is not None
+        throughput = self.window_size / max(now - self.window_start, 1e-9)
+        latency = self.window_latency / self.window_requests
+        if latency > self.latency_target:
+            decision = "latency"
+            self.direction = -1
+        elif throughput < self.throughput * (1 - self.tolerance):
+            decision = "reverse"
+            self.direction = -self.direction
+        elif throughput > self.throughput * (1 + self.tolerance):
+            decision = "continue"
+        else:
+            decision = "hold"
+        if decision != "hold":
+            self.concurrency = self.clamp(self.concurrency + self.direction)
+        # The chunk size ramps up only while ClickHouse keeps up.
+        if decision in ("continue", "hold") and self.chunk_size < self.max_chunk_size:
+            self.chunk_size = min(self.chunk_size * 2, self.max_chunk_size)
+            adaptive_metrics().decisions.labels(self.operation, "ramp_up").inc()
+        adaptive_metrics().decisions.labels(self.operation, decision).inc()
+        self.throughput = throughput
+        self.reset()
+
+    def backoff(self) -> None:
+        """Halve the concurrency and the chunk size after a memory error."""
+        with self.lock:
+            self.concurrency = self.clamp(self.concurrency // 2)
+            self.chunk_size = max(self.chunk_size // 2, self.min_chunk_size)
+            self.direction = 1
+            # The throughput measured before the error is no longer a reference.
+            self.throughput = 0.0
+            adaptive_metrics().decisions.labels(self.operation, "backoff").inc()
+            self.reset()
+
+    def reset(self) -> None:
+        self.window_start = None
+        self.window_requests = 0
+        self.window_size = 0
+        self.window_latency = 0.0
+        self.export()
+
+    def export(self) -> None:
+        metrics = adaptive_metrics()
+        metrics.concurrency.labels(self.operation).set(self.concurrency)
+        metrics.chunk_size.labels(self.operation).set(self.chunk_size)
+        metrics.throughput.labels(self.operation).set(self.throughput)
+
+
+controllers: dict[str, AdaptiveController] = {}
+controllers_lock = Lock()
+
+
+def adaptive_controller(operation: str, **kwargs) -> AdaptiveController:
+    """
+    Return the controller of an operation, created with `kwargs` on the first call.
+    The controllers are shared by all the measurements of a process,
+    since they share the same ClickHouse server.
+    """
+    with controllers_lock:
+        if operation not in controllers:
+            controllers[operation] = AdaptiveController(operation, **kwargs)
+        return controllers[operation]
+
+
+def execute_adaptive(
+    controller: AdaptiveController,
+    func: Callable[[T], object],
+    items: Iterable[T],
+    *,
+    size: Callable[[T], int] = lambda _: 1,
+    retries: int = 3,
+) -> int:
+    """
+    Call `func` on each item in a thread pool, with at most `controller.concurrency`
+    calls in flight. The items are consumed lazily, as the calls complete.
+    The calls that fail with `MEMORY_LIMIT_EXCEEDED` are retried,
+    up to `retries` times, after backing off.
+
+    >>> controller = AdaptiveController("example", concurrency=2, max_concurrency=4)
+    >>> execute_adaptive(controller, print, [1])
+    1
+    1
+
+    :returns: The number of items.
+    """
+    items_ = iter(items)
+    retried: deque[tuple[T, int]] = deque()
+    pending: dict[Future, tuple[T, int]] = {}
+    n_items = 0
+
+    def timed(item: T) -> float:
+        start = perf_counter()
+        func(item)
+        return perf_counter() - start
+
+    with ThreadPoolExecutor(controller.max_concurrency) as pool:
+        try:
+            while True:
+                while len(pending) < controller.concurrency:
+                    if retried:
+                        item, attempt = retried.popleft()
+                    else:
+                        try:
+                            item, attempt = next(items_), 0
+                        except StopIteration:
+                            break
+                        n_items += 1
+                    controller.start()
+                    pending[pool.submit(timed, item)] = (item, attempt)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, attempt = pending.pop(future)
+                    try:
+                        latency = future.result()
+                    except ClickHouseException as e:
+                        if e.code != MEMORY_LIMIT_EXCEEDED or attempt >= retries:
+                            raise
+                        controller.backoff()
+                        retried.append((item, attempt + 1))
+                    else:
+                        controller.record(size(item), latency)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return n_items
+
+
+def available_cpus() -> int:
+    """
+    Number of CPUs available to this process, taking into account its affinity
+    and the CPU quota of its cgroup, as in containers.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        cpus = os.cpu_count() or 1
+    if quota := cgroup_cpu_quota():
+        cpus = min(cpus, max(math.ceil(quota), 1))
+    return cpus
+
+
+def cgroup_cpu_quota(root: Path = Path("/sys/fs/cgroup")) -> float | None:
+    """Return the CPU quota of the cgroup, in CPUs, or None if there is none."""
+    try:
+        # cgroup v2
+        quota, period = (root / "cpu.max").read_text().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        quota_us = int((root / "cpu" / "cpu.cfs_quota_us").read_text())
+        period_us = int((root / "cpu" / "cpu.cfs_period_us").read_text())
+        if quota_us > 0:
+            return quota_us / period_us
+    except (OSError, ValueError):
+        pass
+    return None
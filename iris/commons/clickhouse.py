@@ -1,30 +1,47 @@
 import asyncio
-import os
-from collections.abc import Iterator
-from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Iterable, Iterator
 from dataclasses import dataclass
 from datetime import datetime
+from functools import partial
 from logging import LoggerAdapter
 from pathlib import Path
 from typing import Any
 
 import aiofiles.os
+from diamond_miner.defaults import UNIVERSE_SUBSET
 from diamond_miner.queries import (
+    CountResultsPerPrefix,
     CreateTables,
     DropTables,
+    GetLinksFromResults,
+    GetPrefixesWithAmplification,
+    GetPrefixesWithLoops,
     InsertLinks,
     InsertPrefixes,
     Query,
+    ResultsQuery,
     StoragePolicy,
     links_table,
     prefixes_table,
     results_table,
 )
-from diamond_miner.subsets import subsets_for
+from diamond_miner.queries.fragments import and_
+from diamond_miner.subsets import addr_to_network, split, subsets_for
+from diamond_miner.typing import IPNetwork
 from pych_client import AsyncClickHouseClient, ClickHouseClient
+from pych_client.base import get_http_params
+from pych_client.client import raise_for_status
 
-from iris.commons.filesplit import split_compressed_file
+from iris.commons.adaptive import (
+    AdaptiveController,
+    adaptive_controller,
+    available_cpus,
+    execute_adaptive,
+)
+from iris.commons.filesplit import split_compressed_file, split_lines
+from iris.commons.instrumentation import stage
 from iris.commons.settings import CommonSettings, fault_tolerant
+from iris.commons.utils import zstd_stream_reader
 
 
 def iter_file(file: str, *, read_size: int = 2**20) -> Iterator[bytes]:
@@ -36,10 +53,191 @@ def iter_file(file: str, *, read_size: int = 2**20) -> Iterator[bytes]:
             yield chunk
 
 
+def execute_compressed(
+    client: ClickHouseClient,
+    query: str,
+    data: Iterable[bytes],
+    encoding: str,
+    settings: dict | None = None,
+) -> None:
+    """
+    Execute a query with a compressed request body.
+    `ClickHouseClient.execute` does not allow to set the `Content-Encoding` header.
+    """
+    r = client.client.post(
+        "/",
+        content=data,
+        params=get_http_params(query, None, settings),
+        headers={"Content-Encoding": encoding},
+    )
+    raise_for_status(r, query)
+
+
 def measurement_id(measurement_uuid: str, agent_uuid: str) -> str:
     return f"{measurement_uuid}__{agent_uuid}"
 
 
+PREFIX_COLUMNS = "probe_protocol, probe_src_addr, probe_dst_prefix"
+
+
+def pending_table(table: str) -> str:
+    """
+    Table of the prefixes with new results since the last update of `table`.
+    >>> pending_table("links__abc")
+    'pending_links__abc'
+    """
+    return f"pending_{table}"
+
+
+def pending_tables(measurement_id_: str) -> list[str]:
+    return [
+        pending_table(links_table(measurement_id_)),
+        pending_table(prefixes_table(measurement_id_)),
+    ]
+
+
+@dataclass(frozen=True)
+class PendingQuery(ResultsQuery):
+    """Restrict a query on the results table to the prefixes of a pending table."""
+
+    pending_table: str = ""
+
+    def filters(self, subset: IPNetwork) -> str:
+        return and_(
+            super().filters(subset),
+            f"({PREFIX_COLUMNS}) IN "
+            f"(SELECT {PREFIX_COLUMNS} FROM {self.pending_table})",
+        )
+
+
+@dataclass(frozen=True)
+class CountPendingResultsPerPrefix(PendingQuery, CountResultsPerPrefix):
+    pass
+
+
+@dataclass(frozen=True)
+class InsertPendingLinks(PendingQuery, GetLinksFromResults):
+    """Insert the links of the pending prefixes into the links table."""
+
+    def statement(
+        self, measurement_id: str, subset: IPNetwork = UNIVERSE_SUBSET
+    ) -> str:
+        return f"""
+        INSERT INTO {links_table(measurement_id)}
+        SELECT * FROM ({super().statement(measurement_id, subset)})
+        """
+
+
+@dataclass(frozen=True)
+class GetPendingPrefixesWithAmplification(PendingQuery, GetPrefixesWithAmplification):
+    pass
+
+
+@dataclass(frozen=True)
+class GetPendingPrefixesWithLoops(PendingQuery, GetPrefixesWithLoops):
+    pass
+
+
+@dataclass(frozen=True)
+class InsertPendingPrefixes(PendingQuery):
+    """
+    Insert the pending prefixes into the prefixes table,
+    as `InsertPrefixes` does for all the prefixes.
+    """
+
+    def statement(
+        self, measurement_id: str, subset: IPNetwork = UNIVERSE_SUBSET
+    ) -> str:
+        parameters = dict(pending_table=self.pending_table)
+        amplification_query = GetPendingPrefixesWithAmplification(
+            **parameters
+        ).statement(measurement_id, subset)
+        loops_query = GetPendingPrefixesWithLoops(**parameters).statement(
+            measurement_id, subset
+        )
+        return f"""
+        INSERT INTO {prefixes_table(measurement_id)}
+        SELECT
+            prefixes.probe_protocol,
+            prefixes.probe_src_addr,
+            prefixes.probe_dst_prefix,
+            amplification.has_amplification,
+            loops.has_loops
+        FROM (
+            SELECT DISTINCT probe_protocol, probe_src_addr, probe_dst_prefix
+            FROM {results_table(measurement_id)}
+            WHERE {self.filters(subset)}
+        ) AS prefixes
+        FULL OUTER JOIN ({amplification_query}) AS amplification
+        ON  prefixes.probe_protocol   = amplification.probe_protocol
+        AND prefixes.probe_src_addr   = amplification.probe_src_addr
+        AND prefixes.probe_dst_prefix = amplification.probe_dst_prefix
+        FULL OUTER JOIN ({loops_query}) AS loops
+        ON  prefixes.probe_protocol   = loops.probe_protocol
+        AND prefixes.probe_src_addr   = loops.probe_src_addr
+        AND prefixes.probe_dst_prefix = loops.probe_dst_prefix
+        WHERE prefixes.probe_dst_prefix != toIPv6('::')
+        """
+
+
+def pending_subsets(
+    client: ClickHouseClient,
+    measurement_id_: str,
+    pending_table_: str,
+    *,
+    max_items_per_subset: int = 8_000_000,
+) -> list[IPNetwork]:
+    """Same as `subsets_for`, counting only the results of the pending prefixes."""
+    query = CountPendingResultsPerPrefix(pending_table=pending_table_)
+    counts = {
+        addr_to_network(row["prefix"], query.prefix_len_v4, query.prefix_len_v6): row[
+            "count"
+        ]
+        for row in query.execute_iter(client, measurement_id_)
+    }
+    return split(counts, max_items_per_subset)
+
+
+def execute_subsets(
+    controller: AdaptiveController,
+    client: ClickHouseClient,
+    measurement_id_: str,
+    query: Query,
+    subsets: Iterable[IPNetwork],
+) -> None:
+    """Same as `Query.execute_concurrent`, with an adaptive number of requests."""
+    execute_adaptive(
+        controller,
+        lambda subset: query.execute(client, measurement_id_, subsets=(subset,)),
+        subsets,
+    )
+
+
+def update_derived_table(
+    controller: AdaptiveController,
+    client: ClickHouseClient,
+    measurement_id_: str,
+    table: str,
+    query: PendingQuery,
+) -> None:
+    """
+    Recompute the rows of the pending prefixes of a derived table:
+    the links and the invalid prefixes of a prefix depend on all its results,
+    so the rows of the prefixes with new results are deleted and inserted again.
+    The pending prefixes are cleared last, so that a failed update can be retried.
+    """
+    client.execute(
+        f"""
+        DELETE FROM {table}
+        WHERE ({PREFIX_COLUMNS}) IN (SELECT {PREFIX_COLUMNS} FROM {query.pending_table})
+        """,
+        settings={"allow_experimental_lightweight_delete": 1, "mutations_sync": 1},
+    )
+    subsets = pending_subsets(client, measurement_id_, query.pending_table)
+    execute_subsets(controller, client, measurement_id_, query, subsets)
+    client.execute(f"TRUNCATE {query.pending_table}")
+
+
 @dataclass(frozen=True)
 class ClickHouse:
     settings: CommonSettings
@@ -50,6 +248,29 @@ class ClickHouse:
         async with AsyncClickHouseClient(**self.settings.clickhouse) as client:
             return await client.json(query, params)
 
+    def insert_controller(self) -> AdaptiveController:
+        cpus = available_cpus()
+        chunk_size = self.settings.CLICKHOUSE_PARALLEL_CSV_CHUNK_SIZE
+        return adaptive_controller(
+            "insert_csv",
+            concurrency=max(cpus // 2, 1),
+            max_concurrency=self.settings.CLICKHOUSE_INSERT_MAX_CONCURRENCY or cpus,
+            chunk_size=chunk_size,
+            max_chunk_size=chunk_size,
+            min_chunk_size=chunk_size // 16,
+        )
+
+    def query_controller(self, operation: str) -> AdaptiveController:
+        # These queries use a lot of memory (aggregation of the results table),
+        # the number of concurrent requests is bounded by a setting.
+        max_concurrency = self.settings.CLICKHOUSE_QUERY_MAX_CONCURRENCY
+        return adaptive_controller(
+            operation,
+            concurrency=max(max_concurrency // 2, 1),
+            max_concurrency=max_concurrency,
+            latency_target=10 * 60,
+        )
+
     @fault_tolerant
     async def execute(
         self, query: Query, measurement_id_: str, **kwargs: Any
@@ -82,85 +303,221 @@ class ClickHouse:
             ),
             measurement_id(measurement_uuid, agent_uuid),
         )
+        if self.settings.CLICKHOUSE_INCREMENTAL_DERIVED_TABLES:
+            await self.create_pending_tables(measurement_uuid, agent_uuid)
+
+    async def create_pending_tables(
+        self, measurement_uuid: str, agent_uuid: str
+    ) -> None:
+        """
+        Record the prefixes of the inserted results, at insert time,
+        in a pending table per derived table.
+        """
+        measurement_id_ = measurement_id(measurement_uuid, agent_uuid)
+        for table in pending_tables(measurement_id_):
+            await self.call(f"""
+                CREATE TABLE IF NOT EXISTS {table}
+                (
+                    probe_protocol   UInt8,
+                    probe_src_addr   IPv6,
+                    probe_dst_prefix IPv6
+                )
+                ENGINE MergeTree
+                ORDER BY ({PREFIX_COLUMNS})
+                """)
+            await self.call(f"""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS {table}_mv TO {table}
+                AS SELECT DISTINCT {PREFIX_COLUMNS}
+                FROM {results_table(measurement_id_)}
+                """)
 
     async def drop_tables(self, measurement_uuid: str, agent_uuid: str) -> None:
         self.logger.info("Deleting tables")
-        await self.execute(DropTables(), measurement_id(measurement_uuid, agent_uuid))
+        measurement_id_ = measurement_id(measurement_uuid, agent_uuid)
+        for table in pending_tables(measurement_id_):
+            await self.call(f"DROP TABLE IF EXISTS {table}_mv")
+            await self.call(f"DROP TABLE IF EXISTS {table}")
+        await self.execute(DropTables(), measurement_id_)
 
     async def insert_csv(
         self, measurement_uuid: str, agent_uuid: str, csv_filepath: Path
     ) -> None:
         """Insert CSV file into table."""
+        with stage("insert_csv", key=csv_filepath.name) as stats:
+            stats.bytes = csv_filepath.stat().st_size
+            if self.settings.CLICKHOUSE_INSERT_CSV_MODE == "compressed":
+                await self.insert_csv_compressed(
+                    measurement_uuid, agent_uuid, csv_filepath
+                )
+            elif self.settings.CLICKHOUSE_INSERT_CSV_MODE == "stream":
+                await self.insert_csv_stream(measurement_uuid, agent_uuid, csv_filepath)
+            else:
+                await self.insert_csv_split(measurement_uuid, agent_uuid, csv_filepath)
+
+    async def insert_csv_split(
+        self, measurement_uuid: str, agent_uuid: str, csv_filepath: Path
+    ) -> None:
+        """Insert CSV file into table by splitting it into files on disk first."""
         split_dir = csv_filepath.with_suffix(".split")
         split_dir.mkdir(exist_ok=True)
 
+        concurrency = max(available_cpus() // 2, 1)
+        self.logger.info("Number of concurrent processes: %s", concurrency)
+
         self.logger.info("Split CSV file")
         split_compressed_file(
-            str(csv_filepath),
-            str(split_dir / "splitted_"),
+            csv_filepath,
+            split_dir / "splitted_",
             self.settings.CLICKHOUSE_PARALLEL_CSV_MAX_LINE,
-            max_estimate_lines=10_000,
             skip_lines=1,
+            processes=concurrency,
         )
 
         files = list(split_dir.glob("*"))
         self.logger.info("Number of chunks: %s", len(files))
 
-        concurrency = (os.cpu_count() or 2) // 2
-        self.logger.info("Number of concurrent processes: %s", concurrency)
-
         def insert(file):
             with ClickHouseClient(**self.settings.clickhouse) as client:
                 table = results_table(measurement_id(measurement_uuid, agent_uuid))
                 query = f"INSERT INTO {table} FORMAT CSV"
-                try:
-                    client.execute(query, data=iter_file(file))
-                finally:
-                    os.remove(file)
-
-        loop = asyncio.get_running_loop()
-        with ThreadPoolExecutor(concurrency) as pool:
-            await asyncio.gather(
-                *[loop.run_in_executor(pool, insert, file) for file in files]
+                client.execute(query, data=iter_file(file))
+
+        controller = self.insert_controller()
+        self.logger.info("Number of concurrent inserts: %s", controller.concurrency)
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                partial(execute_adaptive, size=lambda file: file.stat().st_size),
+                controller,
+                insert,
+                files,
             )
-        await aiofiles.os.rmdir(split_dir)
+        finally:
+            # The files are removed at the end, to retry them after a memory error.
+            for file in split_dir.glob("*"):
+                file.unlink()
+            await aiofiles.os.rmdir(split_dir)
+
+    async def insert_csv_stream(
+        self, measurement_uuid: str, agent_uuid: str, csv_filepath: Path
+    ) -> None:
+        """
+        Insert CSV file into table by cutting the decompressed stream
+        at line boundaries and sending each chunk as soon as it is produced.
+        The number of concurrent inserts and the size of the chunks are adapted
+        by the insert controller, and at most `concurrency + 1` chunks are kept
+        in memory.
+        """
+        controller = self.insert_controller()
+        self.logger.info("Number of concurrent inserts: %s", controller.concurrency)
+
+        table = results_table(measurement_id(measurement_uuid, agent_uuid))
+        query = f"INSERT INTO {table} FORMAT CSV"
+
+        def insert(chunk: bytes) -> None:
+            with ClickHouseClient(**self.settings.clickhouse) as client:
+                client.execute(query, data=chunk)
+
+        def insert_chunks() -> int:
+            with zstd_stream_reader(csv_filepath) as f:
+                chunks = split_lines(f, lambda: controller.chunk_size, skip_lines=1)
+                return execute_adaptive(controller, insert, chunks, size=len)
+
+        # The chunks are decompressed in this thread, while the previous ones
+        # are being inserted, so that the event loop is not blocked.
+        n_chunks = await asyncio.get_running_loop().run_in_executor(None, insert_chunks)
+        self.logger.info("Number of chunks: %s", n_chunks)
+
+    async def insert_csv_compressed(
+        self, measurement_uuid: str, agent_uuid: str, csv_filepath: Path
+    ) -> None:
+        """
+        Insert CSV file into table by forwarding the zstd-compressed file as-is.
+        The decompression and the parallel parsing are done by ClickHouse.
+        """
+        table = results_table(measurement_id(measurement_uuid, agent_uuid))
+        # The header is skipped, as with the other insert modes.
+        query = f"INSERT INTO {table} FORMAT CSVWithNames"
+        settings = {"input_format_with_names_use_header": 0}
+
+        def insert() -> None:
+            with ClickHouseClient(**self.settings.clickhouse) as client:
+                execute_compressed(
+                    client, query, iter_file(str(csv_filepath)), "zstd", settings
+                )
+
+        await asyncio.get_running_loop().run_in_executor(None, insert)
 
     @fault_tolerant
     async def insert_links(self, measurement_uuid: str, agent_uuid: str) -> None:
         """Insert the links in the links' table from the flow view."""
         measurement_id_ = measurement_id(measurement_uuid, agent_uuid)
+        if self.settings.CLICKHOUSE_INCREMENTAL_DERIVED_TABLES:
+            table = links_table(measurement_id_)
+            query = InsertPendingLinks(pending_table=pending_table(table))
+            with (
+                stage("insert_links"),
+                ClickHouseClient(**self.settings.clickhouse) as client,
+            ):
+                update_derived_table(
+                    self.query_controller("insert_links"),
+                    client,
+                    measurement_id_,
+                    table,
+                    query,
+                )
+            return
         await self.call(
             "TRUNCATE {table:Identifier}",
             params={"table": links_table(measurement_id_)},
         )
-        with ClickHouseClient(**self.settings.clickhouse) as client:
+        with (
+            stage("insert_links"),
+            ClickHouseClient(**self.settings.clickhouse) as client,
+        ):
             query = InsertLinks()
             subsets = subsets_for(query, client, measurement_id_)
-            # We limit the number of concurrent requests since this query
-            # uses a lot of memory (aggregation of the flows table).
-            query.execute_concurrent(
+            execute_subsets(
+                self.query_controller("insert_links"),
                 client,
                 measurement_id_,
-                subsets=subsets,
-                concurrent_requests=8,
+                query,
+                subsets,
             )
 
     @fault_tolerant
     async def insert_prefixes(self, measurement_uuid: str, agent_uuid: str) -> None:
         """Insert the invalid prefixes in the prefix table."""
         measurement_id_ = measurement_id(measurement_uuid, agent_uuid)
+        if self.settings.CLICKHOUSE_INCREMENTAL_DERIVED_TABLES:
+            table = prefixes_table(measurement_id_)
+            query = InsertPendingPrefixes(pending_table=pending_table(table))
+            with (
+                stage("insert_prefixes"),
+                ClickHouseClient(**self.settings.clickhouse) as client,
+            ):
+                update_derived_table(
+                    self.query_controller("insert_prefixes"),
+                    client,
+                    measurement_id_,
+                    table,
+                    query,
+                )
+            return
         await self.call(
             "TRUNCATE {table:Identifier}",
             params={"table": prefixes_table(measurement_id_)},
         )
-        with ClickHouseClient(**self.settings.clickhouse) as client:
+        with (
+            stage("insert_prefixes"),
+            ClickHouseClient(**self.settings.clickhouse) as client,
+        ):
             query = InsertPrefixes()
             subsets = subsets_for(query, client, measurement_id_)
-            # We limit the number of concurrent requests since this query
-            # uses a lot of memory.
-            query.execute_concurrent(
+            execute_subsets(
+                self.query_controller("insert_prefixes"),
                 client,
                 measurement_id_,
-                subsets=subsets,
-                concurrent_requests=8,
+                query,
+                subsets,
             )
@@ -1,6 +1,6 @@
 from contextlib import asynccontextmanager, contextmanager
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi_users.db import SQLAlchemyUserDatabase
 from fastapi_users_db_sqlalchemy.access_token import SQLAlchemyAccessTokenDatabase
 from redis import asyncio as aioredis
@@ -86,8 +86,11 @@ async def get_redis(settings=Depends(get_settings), logger=Depends(get_logger)):
         await client.aclose()
 
 
-def get_storage(settings=Depends(get_settings), logger=Depends(get_logger)):
-    return Storage(settings, logger)
+def get_storage(
+    request: Request, settings=Depends(get_settings), logger=Depends(get_logger)
+):
+    # Reuse the S3 client opened for the lifetime of the application, if any.
+    return Storage(settings, logger, getattr(request.app.state, "s3_client", None))
 
 
 get_engine_context = contextmanager(get_engine)
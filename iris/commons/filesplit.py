@@ -1,97 +1,292 @@
-from collections.abc import Iterable
-from io import TextIOWrapper
-from math import ceil
+import mmap
+import os
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
 from typing import IO
 
-from iris.commons.utils import zstd_stream_reader, zstd_stream_reader_text
+from zstandard import ZstdDecompressor
 
-DEFAULT_ESTIMATE_MAX_LINES = 1000
+ZSTD_MAGIC_NUMBER = 0xFD2FB528
+ZSTD_SKIPPABLE_MAGIC_NUMBER = 0x184D2A50
+ZSTD_SKIPPABLE_MAGIC_MASK = 0xFFFFFFF0
 
 
-def estimate_line_size(f: IO[bytes], *, max_lines: int = DEFAULT_ESTIMATE_MAX_LINES):
+def zstd_frames(f: IO[bytes]) -> list[tuple[int, int]]:
     """
+    Return the `(offset, size)` of the zstd frames in a file,
+    by reading only the frame and block headers.
+
     >>> from io import BytesIO
-    >>> estimate_line_size(BytesIO(b""))
-    0
-    >>> estimate_line_size(BytesIO(b"1234"))
-    4
-    >>> estimate_line_size(BytesIO(b"1234\\n"))
-    5
-    >>> estimate_line_size(BytesIO(b"1234\\n5678\\n"))
-    5
+    >>> from zstandard import ZstdCompressor
+    >>> frame = ZstdCompressor().compress(b"1234\\n")
+    >>> zstd_frames(BytesIO(frame + frame)) == [(0, len(frame)), (len(frame), len(frame))]
+    True
+    >>> zstd_frames(BytesIO(b""))
+    []
+    >>> zstd_frames(BytesIO(b"1234"))
+    Traceback (most recent call last):
+        ...
+    ValueError: invalid zstd frame at offset 0
     """
-    n_lines = 0
-    first_byte = f.tell()
-    wrapper = TextIOWrapper(f)
-    for _ in wrapper:
-        n_lines += 1
-        if n_lines >= max_lines:
-            break
-    bytes_read = f.tell() - first_byte
-    return int(ceil(bytes_read / (n_lines or 1)))
+    frames = []
+    offset = f.seek(0)
+    while header := f.read(4):
+        magic = int.from_bytes(header, "little")
+        if magic & ZSTD_SKIPPABLE_MAGIC_MASK == ZSTD_SKIPPABLE_MAGIC_NUMBER:
+            offset = f.seek(offset + 8 + int.from_bytes(f.read(4), "little"))
+            continue
+        if magic != ZSTD_MAGIC_NUMBER:
+            raise ValueError(f"invalid zstd frame at offset {offset}")
+        descriptor = f.read(1)[0]
+        single_segment = (descriptor >> 5) & 1
+        content_size_size = [single_segment, 2, 4, 8][descriptor >> 6]
+        dictionary_id_size = [0, 1, 2, 4][descriptor & 3]
+        window_descriptor_size = 1 - single_segment
+        position = f.seek(
+            window_descriptor_size + dictionary_id_size + content_size_size,
+            os.SEEK_CUR,
+        )
+        while True:
+            block_header = int.from_bytes(f.read(3), "little")
+            last_block, block_type, block_size = (
+                block_header & 1,
+                (block_header >> 1) & 3,
+                block_header >> 3,
+            )
+            if block_type == 1:
+                # RLE block: a single byte is repeated `block_size` times.
+                block_size = 1
+            position = f.seek(position + 3 + block_size)
+            if last_block:
+                break
+        if (descriptor >> 2) & 1:
+            # Content checksum.
+            position = f.seek(position + 4)
+        frames.append((offset, position - offset))
+        offset = position
+    return frames
 
 
 def split_stream(
-    stream: IO[str], split_boundary: str, split_size: int, *, read_size: int = 2**20
-) -> Iterable[str | int]:
+    stream: IO[bytes],
+    lines_per_split: int,
+    *,
+    read_size: int = 2**20,
+    skip_lines: int = 0,
+) -> Iterator[int | memoryview]:
     """
-    >>> from io import StringIO
-    >>> list(split_stream(StringIO("1234\\n5678\\n"), "\\n", 5, read_size=5)) # Aligned read
-    [0, '1234\\n', 1, '5678\\n', 2]
-    >>> list(split_stream(StringIO("1234\\n5678\\n"), "\\n", 5, read_size=2)) # Smaller unaligned read
-    [0, '12', '34', '\\n', 1, '5', '67', '8\\n', 2]
-    >>> list(split_stream(StringIO("1234\\n5678\\n"), "\\n", 5, read_size=8)) # Larger unaligned read
-    [0, '1234\\n', 1, '567', '8\\n', 2]
-    >>> list(split_stream(StringIO("1234\\n5678\\n"), "\\n", 2, read_size=3)) # Split and read size smaller than line size
-    [0, '123', '4\\n', 1, '5', '678', '\\n', 2]
+    Split a byte stream in splits of exactly `lines_per_split` lines
+    (except for the last one), without decoding it.
+    Yield the index of each new split, followed by its data.
+
+    >>> from io import BytesIO
+    >>> def split(*args, **kwargs):
+    ...     return [x if isinstance(x, int) else bytes(x) for x in split_stream(*args, **kwargs)]
+    >>> split(BytesIO(b"1234\\n5678\\n"), 1, read_size=5) # Aligned read
+    [0, b'1234\\n', 1, b'5678\\n']
+    >>> split(BytesIO(b"1234\\n5678\\n"), 1, read_size=2) # Smaller unaligned read
+    [0, b'12', b'34', b'\\n', 1, b'5', b'67', b'8\\n']
+    >>> split(BytesIO(b"1234\\n5678\\n9"), 2, read_size=8) # Larger unaligned read
+    [0, b'1234\\n567', b'8\\n', 1, b'9']
+    >>> split(BytesIO(b"1234\\n5678\\n9"), 1, read_size=3, skip_lines=1)
+    [0, b'5', b'678', b'\\n', 1, b'9']
+    >>> split(BytesIO(b""), 1)
+    []
     """
-    bytes_read = 0
-    split_index = 0
-    yield split_index
-    while True:
-        chunk = stream.read(read_size)
-        bytes_read += read_size
-        if not chunk:
-            break
-        if bytes_read < split_size:
-            yield chunk
-        else:
-            # The current split is larger than the desired size.
-            s = chunk.split(split_boundary, maxsplit=1)
-            if len(s) == 1:
-                # Boundary not found, continue to yield chunks on this split.
-                yield s[0]
-            else:
-                # Boundary found, increment the split and yield leftover data.
-                yield s[0] + split_boundary
-                bytes_read = len(s[1])
+    split_index = -1
+    n_lines = lines_per_split
+    while chunk := stream.read(read_size):
+        view = memoryview(chunk)
+        while skip_lines and view:
+            end = chunk.find(b"\n", len(chunk) - len(view))
+            if end < 0:
+                view = view[len(view) :]
+                break
+            view = view[end + 1 - (len(chunk) - len(view)) :]
+            skip_lines -= 1
+        while view:
+            if n_lines == lines_per_split:
                 split_index += 1
+                n_lines = 0
                 yield split_index
-                if s[1]:
-                    yield s[1]
+            start = len(chunk) - len(view)
+            # Fast path: the whole chunk belongs to the current split.
+            if (count := chunk.count(b"\n", start)) + n_lines < lines_per_split:
+                n_lines += count
+                yield view
+                break
+            end = start
+            while n_lines < lines_per_split:
+                end = chunk.find(b"\n", end) + 1
+                n_lines += 1
+            yield view[: end - start]
+            view = view[end - start :]
 
 
-def split_compressed_file(
+def split_lines(
+    stream: IO[bytes],
+    split_size: int | Callable[[], int],
+    *,
+    read_size: int = 2**20,
+    skip_lines: int = 0,
+) -> Iterator[bytes]:
+    """
+    Yield chunks of at least `split_size` bytes (except for the last one)
+    that end on a line boundary, without decoding the stream.
+    At most `split_size + read_size` bytes are kept in memory.
+    `split_size` can be a function, called for each chunk, to change their size.
+
+    >>> from io import BytesIO
+    >>> list(split_lines(BytesIO(b"1234\\n5678\\n"), 5, read_size=5))
+    [b'1234\\n', b'5678\\n']
+    >>> list(split_lines(BytesIO(b"1234\\n5678\\n"), 5, read_size=3))
+    [b'1234\\n', b'5678\\n']
+    >>> list(split_lines(BytesIO(b"1234\\n5678\\n9"), 8, read_size=8))
+    [b'1234\\n', b'5678\\n9']
+    >>> list(split_lines(BytesIO(b"1234\\n5678\\n"), 5, read_size=2, skip_lines=1))
+    [b'5678\\n']
+    >>> list(split_lines(BytesIO(b""), 5))
+    []
+    >>> size = iter([2, 8])
+    >>> list(split_lines(BytesIO(b"1\\n2\\n3\\n4\\n"), lambda: next(size), read_size=2))
+    [b'1\\n', b'2\\n3\\n4\\n']
+    """
+    if isinstance(split_size, int):
+        split_size = partial(int, split_size)
+    chunk_size = split_size()
+    buffer = bytearray()
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        buffer += data
+        while skip_lines and buffer:
+            end = buffer.find(b"\n")
+            if end < 0:
+                # The line continues in the next read.
+                buffer.clear()
+                break
+            del buffer[: end + 1]
+            skip_lines -= 1
+        if len(buffer) >= chunk_size and (end := buffer.rfind(b"\n")) >= 0:
+            yield bytes(buffer[: end + 1])
+            del buffer[: end + 1]
+            chunk_size = split_size()
+    if buffer:
+        yield bytes(buffer)
+
+
+def split_compressed_range(
     input_file: str,
     output_prefix: str,
     lines_per_file: int,
     *,
-    max_estimate_lines: int = DEFAULT_ESTIMATE_MAX_LINES,
+    start: int = 0,
+    end: int | None = None,
     skip_lines: int = 0,
-):
-    with zstd_stream_reader(input_file) as f:
-        line_size = estimate_line_size(f, max_lines=max_estimate_lines)
-    split_size = lines_per_file * line_size
-    with zstd_stream_reader_text(input_file) as f:
-        outf = None
-        for _ in range(skip_lines):
-            next(f)
-        for chunk in split_stream(f, "\n", split_size):
-            if isinstance(chunk, int):
+) -> tuple[int, bool]:
+    """
+    Split the zstd frames between the `start` and `end` offsets of a file.
+
+    :returns: The number of files written and whether the data ends with a newline.
+    """
+    n_files, last_byte = 0, b"\n"
+    with open(input_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return n_files, True
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            source = memoryview(mm)[start:end]
+            outf = None
+            try:
+                with ZstdDecompressor().stream_reader(
+                    source, read_across_frames=True
+                ) as stream:
+                    for chunk in split_stream(
+                        stream, lines_per_file, skip_lines=skip_lines
+                    ):
+                        if isinstance(chunk, int):
+                            if outf:
+                                outf.close()
+                            outf = open(f"{output_prefix}_{chunk}", "wb")
+                            n_files += 1
+                        else:
+                            outf.write(chunk)  # type: ignore
+                            last_byte = chunk[-1:]
+            finally:
                 if outf:
                     outf.close()
-                outf = open(f"{output_prefix}_{chunk}", "w")
-            else:
-                outf.write(chunk)  # type: ignore
-        if outf:
-            outf.close()
+                source.release()
+    return n_files, last_byte == b"\n"
+
+
+def group_frames(frames: list[tuple[int, int]], n_groups: int) -> list[tuple[int, int]]:
+    """
+    Group contiguous frames into at most `n_groups` ranges of similar sizes.
+
+    >>> group_frames([(0, 10), (10, 10), (20, 10), (30, 10)], 2)
+    [(0, 20), (20, 40)]
+    >>> group_frames([(0, 10), (10, 30), (40, 10)], 2)
+    [(0, 40), (40, 50)]
+    >>> group_frames([(0, 10)], 4)
+    [(0, 10)]
+    """
+    total_size = sum(size for _, size in frames)
+    groups: list[tuple[int, int]] = []
+    start = frames[0][0]
+    for offset, size in frames:
+        end = offset + size
+        if end - frames[0][0] >= total_size * (len(groups) + 1) / n_groups:
+            groups.append((start, end))
+            start = end
+    if start < frames[-1][0] + frames[-1][1]:
+        groups.append((start, frames[-1][0] + frames[-1][1]))
+    return groups
+
+
+def split_compressed_file(
+    input_file: str | Path,
+    output_prefix: str | Path,
+    lines_per_file: int,
+    *,
+    skip_lines: int = 0,
+    processes: int = 1,
+) -> None:
+    """
+    Split a zstd-compressed file in files of `lines_per_file` lines.
+    If the file contains multiple frames, they are decompressed in parallel
+    by up to `processes` processes, and the last file of each process
+    can contain less than `lines_per_file` lines.
+    """
+    input_file, output_prefix = str(input_file), str(output_prefix)
+    with open(input_file, "rb") as f:
+        frames = zstd_frames(f)
+
+    if processes > 1 and len(frames) > 1:
+        groups = group_frames(frames, processes)
+        with ProcessPoolExecutor(len(groups)) as pool:
+            futures = [
+                pool.submit(
+                    split_compressed_range,
+                    input_file,
+                    f"{output_prefix}_{i}",
+                    lines_per_file,
+                    start=start,
+                    end=end,
+                    skip_lines=skip_lines if i == 0 else 0,
+                )
+                for i, (start, end) in enumerate(groups)
+            ]
+            results = [future.result() for future in futures]
+        if all(ends_with_newline for _, ends_with_newline in results[:-1]):
+            return
+        # The frames are not aligned on line boundaries:
+        # remove the partial files and fall back to a sequential split.
+        for i, (n_files, _) in enumerate(results):
+            for j in range(n_files):
+                os.remove(f"{output_prefix}_{i}_{j}")
+
+    split_compressed_range(
+        input_file, output_prefix, lines_per_file, skip_lines=skip_lines
+    )
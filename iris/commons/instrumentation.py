@@ -0,0 +1,101 @@
+"""Per-stage instrumentation of the measurement rounds."""
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+from functools import cache
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from iris.commons.models import StageStatistics
+
+if TYPE_CHECKING:
+    from prometheus_client import Histogram
+
+
+@dataclass(frozen=True)
+class StageMetrics:
+    duration: "Histogram"
+    bytes: "Histogram"
+    rows: "Histogram"
+
+
+@cache
+def stage_metrics() -> StageMetrics:
+    """
+    Create the metrics on their first use, after the process boot.
+    prometheus_client chooses between in-process and multi-process values
+    when it is first imported, and the dramatiq Prometheus middleware sets
+    `PROMETHEUS_MULTIPROC_DIR` only after the actors modules are imported.
+    """
+    from prometheus_client import Histogram
+
+    return StageMetrics(
+        duration=Histogram(
+            "iris_stage_duration_seconds",
+            "Duration of the stages of the measurement rounds",
+            ["stage"],
+            buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+        ),
+        bytes=Histogram(
+            "iris_stage_bytes",
+            "Number of bytes processed by the stages of the measurement rounds",
+            ["stage"],
+            buckets=tuple(10**i for i in range(3, 12)),
+        ),
+        rows=Histogram(
+            "iris_stage_rows",
+            "Number of rows processed by the stages of the measurement rounds",
+            ["stage"],
+            buckets=tuple(10**i for i in range(0, 10)),
+        ),
+    )
+
+
+current_stages: ContextVar[list[StageStatistics] | None] = ContextVar(
+    "current_stages", default=None
+)
+
+
+@contextmanager
+def record_stages() -> Iterator[list[StageStatistics]]:
+    """
+    Collect the stages executed in the current context.
+
+    >>> with record_stages() as stages:
+    ...     with stage("insert_csv") as s:
+    ...         s.rows = 10
+    >>> [(s.name, s.rows) for s in stages]
+    [('insert_csv', 10)]
+    """
+    stages: list[StageStatistics] = []
+    token = current_stages.set(stages)
+    try:
+        yield stages
+    finally:
+        current_stages.reset(token)
+
+
+@contextmanager
+def stage(name: str, *, key: str | None = None) -> Iterator[StageStatistics]:
+    """
+    Measure the duration of a stage, and optionally the number of bytes and rows
+    set by the caller on the yielded object.
+    The stage is exported to Prometheus and, if any, appended to the stages
+    collected by `record_stages`.
+    """
+    statistics = StageStatistics(name=name, key=key, start_time=datetime.utcnow())
+    start = perf_counter()
+    try:
+        yield statistics
+    finally:
+        statistics.duration = perf_counter() - start
+        metrics = stage_metrics()
+        metrics.duration.labels(name).observe(statistics.duration)
+        if statistics.bytes is not None:
+            metrics.bytes.labels(name).observe(statistics.bytes)
+        if statistics.rows is not None:
+            metrics.rows.labels(name).observe(statistics.rows)
+        if (stages := current_stages.get()) is not None:
+            stages.append(statistics)
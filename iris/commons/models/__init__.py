@@ -4,7 +4,9 @@ from iris.commons.models.agent import Agent, AgentParameters, AgentState
 from iris.commons.models.base import Base
 from iris.commons.models.diamond_miner import (
     FlowMapper,
+    ProbingProgress,
     ProbingStatistics,
+    StageStatistics,
     Tool,
     ToolParameters,
 )
@@ -23,7 +25,11 @@ from iris.commons.models.measurement_agent import (
     MeasurementAgentRead,
     MeasurementAgentState,
 )
-from iris.commons.models.measurement_round_request import MeasurementRoundRequest
+from iris.commons.models.measurement_round_request import (
+    AgentQueue,
+    MeasurementRoundRequest,
+    QueuedRequest,
+)
 from iris.commons.models.pagination import Paginated
 from iris.commons.models.round import Round
 from iris.commons.models.target import Target, TargetSummary
@@ -44,7 +50,9 @@ __all__ = (
     "FlowMapper",
     "Tool",
     "ToolParameters",
+    "ProbingProgress",
     "ProbingStatistics",
+    "StageStatistics",
     "MeasurementBase",
     "MeasurementCreate",
     "MeasurementPatch",
@@ -57,6 +65,8 @@ __all__ = (
     "MeasurementAgentRead",
     "MeasurementAgent",
     "MeasurementRoundRequest",
+    "QueuedRequest",
+    "AgentQueue",
     "Paginated",
     "Round",
     "TargetSummary",
@@ -31,6 +31,9 @@ class AgentParameters(BaseModel):
         description="Maximum Probing Rate allowed by the agent",
     )
     tags: list[str] = Field(default_factory=list)
+    max_concurrent_rounds: NonNegativeInt = Field(
+        1, title="Maximum number of rounds probed concurrently"
+    )
 
 
 class Agent(BaseModel):
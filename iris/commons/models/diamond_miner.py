@@ -79,3 +79,26 @@ class ProbingStatistics(BaseModel):
     pcap_received: NonNegativeInt
     pcap_dropped: NonNegativeInt
     pcap_interface_dropped: NonNegativeInt
+
+
+class ProbingProgress(BaseModel):
+    round: Round
+    start_time: datetime
+    update_time: datetime
+    probing_rate: NonNegativeInt = Field(title="Requested probing rate (pps)")
+    effective_rate: float = Field(0.0, title="Effective probing rate (pps)")
+    probes_read: NonNegativeInt = 0
+    packets_sent: NonNegativeInt = 0
+    packets_failed: NonNegativeInt = 0
+    packets_received: NonNegativeInt = 0
+    pcap_dropped: NonNegativeInt = 0
+    pcap_interface_dropped: NonNegativeInt = 0
+
+
+class StageStatistics(BaseModel):
+    name: str
+    key: str | None = Field(None, description="Object storage key, if any")
+    start_time: datetime
+    duration: float = Field(0.0, title="Duration in seconds")
+    bytes: NonNegativeInt | None = None
+    rows: NonNegativeInt | None = None
@@ -26,6 +26,13 @@ class MeasurementBase(BaseSQLModel):
     tags: list[str] = Field(
         default_factory=list, sa_column=Column(ARRAY(String)), title="Tags"
     )
+    priority: int = Field(
+        0,
+        ge=-10,
+        le=10,
+        title="Priority",
+        description="Priority of the measurement among those of the same user",
+    )
 
 
 class MeasurementCreate(MeasurementBase):
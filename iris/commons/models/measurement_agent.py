@@ -1,4 +1,5 @@
 import enum
+import json
 from datetime import datetime
 from typing import TYPE_CHECKING, Optional
 
@@ -8,7 +9,12 @@ from sqlmodel import Column, Enum, Field, Relationship, Session, update
 
 from iris.commons.models.agent import AgentParameters
 from iris.commons.models.base import BaseSQLModel, PydanticType
-from iris.commons.models.diamond_miner import ProbingStatistics, ToolParameters
+from iris.commons.models.diamond_miner import (
+    ProbingStatistics,
+    StageStatistics,
+    ToolParameters,
+)
+from iris.commons.models.round import Round
 
 if TYPE_CHECKING:
     from iris.commons.models.measurement import Measurement
@@ -54,6 +60,7 @@ class MeasurementAgentRead(MeasurementAgentBase):
     agent_uuid: str
     agent_parameters: AgentParameters
     probing_statistics: dict
+    worker_statistics: dict
     state: MeasurementAgentState
 
 
@@ -83,6 +90,9 @@ class MeasurementAgent(MeasurementAgentBase, table=True):
     # But this requires a composite foreign key (measurement_uuid, agent_uuid)
     # => how to do this with SQLModel?
     probing_statistics: dict = Field(default_factory=dict, sa_column=Column(JSONB))
+    # Duration, bytes and rows of each stage of the worker rounds,
+    # indexed by the encoded round of the results file ("initial" for the first round).
+    worker_statistics: dict = Field(default_factory=dict, sa_column=Column(JSONB))
     start_time: datetime | None = Field(default=None)
     end_time: datetime | None = Field(default=None)
     state: MeasurementAgentState = Field(
@@ -113,6 +123,21 @@ class MeasurementAgent(MeasurementAgentBase, table=True):
         session.execute(query)
         session.commit()
 
+    def append_worker_statistics(
+        self, session: Session, round_: Round | None, stages: list[StageStatistics]
+    ):
+        # HACK: See comment on `probing_statistics` column.
+        key = round_.encode() if round_ else "initial"
+        self.worker_statistics[key] = [json.loads(stage.json()) for stage in stages]
+        query = (
+            update(MeasurementAgent)
+            .where(MeasurementAgent.measurement_uuid == self.measurement_uuid)
+            .where(MeasurementAgent.agent_uuid == self.agent_uuid)
+            .values(worker_statistics=self.worker_statistics)
+        )
+        session.execute(query)
+        session.commit()
+
     def set_state(self, session: Session, state: MeasurementAgentState):
         self.state = state
         session.add(self)
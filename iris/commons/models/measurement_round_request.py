@@ -1,3 +1,7 @@
+from datetime import datetime
+
+from pydantic import Field, NonNegativeInt
+
 from iris.commons.models.base import BaseModel
 from iris.commons.models.round import Round
 
@@ -8,3 +12,25 @@ class MeasurementRoundRequest(BaseModel):
     probing_rate: int | None = None
     batch_size: int | None = None
     round: Round
+    # Scheduling parameters, see `iris.commons.scheduler`.
+    user_id: str | None = None
+    priority: int = 0
+    weight: float = Field(1.0, gt=0)
+    enqueue_time: datetime | None = None
+
+
+class QueuedRequest(BaseModel):
+    request: MeasurementRoundRequest
+    position: NonNegativeInt
+    expected_wait: float | None = Field(
+        None, title="Expected wait time in seconds", description="Rough estimate"
+    )
+
+
+class AgentQueue(BaseModel):
+    depth: NonNegativeInt = Field(title="Number of queued requests")
+    running: list[MeasurementRoundRequest] = Field(title="Running requests")
+    queued: list[QueuedRequest] = Field(title="Queued requests, in schedule order")
+    round_duration: float | None = Field(
+        None, title="Average round duration in seconds"
+    )
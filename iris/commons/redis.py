@@ -1,6 +1,6 @@
-import asyncio
-import random
+from collections.abc import AsyncIterator
 from dataclasses import dataclass
+from datetime import datetime
 from logging import LoggerAdapter
 
 from redis import asyncio as aioredis
@@ -8,10 +8,15 @@ from redis import asyncio as aioredis
 from iris.commons.models import (
     Agent,
     AgentParameters,
+    AgentQueue,
     AgentState,
     MeasurementRoundRequest,
+    ProbingProgress,
     ProbingStatistics,
+    QueuedRequest,
+    Round,
 )
+from iris.commons.scheduler import next_request, schedule
 from iris.commons.settings import CommonSettings, fault_tolerant
 
 
@@ -31,10 +36,42 @@ def agent_queue_key(uuid: str) -> str:
     return f"agent_queue:{uuid}"
 
 
+def agent_cancellations_key(uuid: str) -> str:
+    return f"agent_cancellations:{uuid}"
+
+
+def agent_queue_running_key(uuid: str) -> str:
+    return f"agent_queue_running:{uuid}"
+
+
+def agent_queue_service_key(uuid: str) -> str:
+    return f"agent_queue_service:{uuid}"
+
+
+def agent_queue_wakeup_key(uuid: str) -> str:
+    return f"agent_queue_wakeup:{uuid}"
+
+
+def agent_round_duration_key(uuid: str) -> str:
+    return f"agent_round_duration:{uuid}"
+
+
 def measurement_stats_key(measurement_uuid: str, agent_uuid: str) -> str:
     return f"measurement_stats:{measurement_uuid}:{agent_uuid}"
 
 
+def measurement_progress_key(measurement_uuid: str, agent_uuid: str) -> str:
+    return f"measurement_progress:{measurement_uuid}:{agent_uuid}"
+
+
+def measurement_results_key(measurement_uuid: str, agent_uuid: str) -> str:
+    return f"measurement_results:{measurement_uuid}:{agent_uuid}"
+
+
+def measurement_rounds_key(measurement_uuid: str, agent_uuid: str) -> str:
+    return f"measurement_rounds:{measurement_uuid}:{agent_uuid}"
+
+
 @dataclass(frozen=True)
 class Redis:
     client: aioredis.Redis
@@ -45,6 +82,12 @@ class Redis:
     def ns(self) -> str:
         return self.settings.REDIS_NAMESPACE
 
+    @fault_tolerant
+    async def blpop(self, name: str, timeout: float) -> str | None:
+        if item := await self.client.blpop(f"{self.ns}:{name}", timeout=timeout):
+            return str(item[1])
+        return None
+
     @fault_tolerant
     async def delete(self, *names: str) -> None:
         names_ = [f"{self.ns}:{name}" for name in names]
@@ -69,6 +112,10 @@ class Redis:
     async def hget(self, name: str, key: str) -> str | None:
         return await self.client.hget(f"{self.ns}:{name}", key)
 
+    @fault_tolerant
+    async def hgetall(self, name: str) -> dict[str, str]:
+        return await self.client.hgetall(f"{self.ns}:{name}")
+
     @fault_tolerant
     async def hkeys(self, name: str) -> list[str]:
         return await self.client.hkeys(f"{self.ns}:{name}")
@@ -82,10 +129,34 @@ class Redis:
         keys: list[str] = await self.client.keys(f"{self.ns}:{pattern}")
         return keys
 
+    @fault_tolerant
+    async def publish(self, channel: str, message: str) -> None:
+        await self.client.publish(f"{self.ns}:{channel}", message)
+
+    @fault_tolerant
+    async def rpush(self, name: str, *values: str) -> None:
+        await self.client.rpush(f"{self.ns}:{name}", *values)
+
+    @fault_tolerant
+    async def sadd(self, name: str, *values: str) -> None:
+        await self.client.sadd(f"{self.ns}:{name}", *values)
+
     @fault_tolerant
     async def set(self, name: str, value: str, **kwargs) -> None:
         await self.client.set(f"{self.ns}:{name}", value, **kwargs)
 
+    @fault_tolerant
+    async def sismember(self, name: str, value: str) -> bool:
+        return bool(await self.client.sismember(f"{self.ns}:{name}", value))
+
+    @fault_tolerant
+    async def smembers(self, name: str) -> list[str]:
+        return list(await self.client.smembers(f"{self.ns}:{name}"))
+
+    @fault_tolerant
+    async def srem(self, name: str, *values: str) -> None:
+        await self.client.srem(f"{self.ns}:{name}", *values)
+
     async def register_agent(self, uuid: str, ttl_seconds: int) -> None:
         self.logger.info("Registering agent for %s seconds", ttl_seconds)
         await self.set(agent_heartbeat_key(uuid), "alive", ex=ttl_seconds)
@@ -179,19 +250,161 @@ class Redis:
         self.logger.info("Deleting measurement statistics")
         await self.delete(measurement_stats_key(measurement_uuid, agent_uuid))
 
-    async def get_random_request(
+    async def get_measurement_progress(
+        self, measurement_uuid: str, agent_uuid: str
+    ) -> ProbingProgress | None:
+        if progress := await self.get(
+            measurement_progress_key(measurement_uuid, agent_uuid)
+        ):
+            return ProbingProgress.parse_raw(progress)
+        return None
+
+    async def set_measurement_progress(
+        self,
+        measurement_uuid: str,
+        agent_uuid: str,
+        progress: ProbingProgress,
+        ttl_seconds: int,
+    ) -> None:
+        # Not logged, as it is called every few seconds during a round.
+        await self.set(
+            measurement_progress_key(measurement_uuid, agent_uuid),
+            progress.json(),
+            ex=ttl_seconds,
+        )
+
+    async def delete_measurement_progress(
+        self, measurement_uuid: str, agent_uuid: str
+    ) -> None:
+        self.logger.info("Deleting measurement progress")
+        await self.delete(measurement_progress_key(measurement_uuid, agent_uuid))
+
+    async def notify_results(
+        self, measurement_uuid: str, agent_uuid: str, results_key: str
+    ) -> None:
+        """Notify the worker that a results file has been uploaded."""
+        self.logger.info("Notifying results %s", results_key)
+        await self.rpush(
+            measurement_results_key(measurement_uuid, agent_uuid), results_key
+        )
+
+    async def wait_results(
+        self, measurement_uuid: str, agent_uuid: str, timeout: float
+    ) -> str | None:
+        """
+        Wait for at most `timeout` seconds for a results notification.
+        Return the key of the results file, or None on timeout.
+        """
+        return await self.blpop(
+            measurement_results_key(measurement_uuid, agent_uuid), timeout
+        )
+
+    async def delete_results_notifications(
+        self, measurement_uuid: str, agent_uuid: str
+    ) -> None:
+        await self.delete(measurement_results_key(measurement_uuid, agent_uuid))
+
+    async def get_next_request(
         self, uuid: str, *, interval: float = 1.0
     ) -> MeasurementRoundRequest:
         """
-        Return a random request from the queue.
-        If the queue is empty, it will retry at the specified interval.
+        Return the next request to serve from the queue (see `iris.commons.scheduler`)
+        and mark it as running until it is deleted.
+        If there are no queued requests, it will wait for a new request,
+        and check the queue again at least at the specified interval.
         """
-        # TODO: Use HRANDFIELD when implemented by aioredis.
         while True:
-            if keys := await self.hkeys(agent_queue_key(uuid)):
-                value = await self.hget(agent_queue_key(uuid), random.choice(keys))
-                return MeasurementRoundRequest.parse_raw(value)
-            await asyncio.sleep(interval)
+            # Delete the wake-up notifications *before* reading the queue,
+            # so that a request set in the meantime is never missed.
+            await self.delete(agent_queue_wakeup_key(uuid))
+            if requests := await self.get_queued_requests(uuid):
+                request, virtual_time = next_request(
+                    requests,
+                    await self.get_queue_service(uuid),
+                    datetime.utcnow(),
+                    self.settings.REDIS_QUEUE_AGING_INTERVAL,
+                )
+                await self.hset(
+                    agent_queue_service_key(uuid),
+                    request.user_id or "",
+                    str(virtual_time),
+                )
+                await self.sadd(agent_queue_running_key(uuid), request.measurement_uuid)
+                return request
+            await self.blpop(agent_queue_wakeup_key(uuid), interval)
+
+    async def get_queued_requests(self, uuid: str) -> list[MeasurementRoundRequest]:
+        """Return the requests of the queue that are not running."""
+        running = await self.smembers(agent_queue_running_key(uuid))
+        values = await self.hgetall(agent_queue_key(uuid))
+        return [
+            MeasurementRoundRequest.parse_raw(value)
+            for key, value in values.items()
+            if key not in running
+        ]
+
+    async def get_running_requests(self, uuid: str) -> list[MeasurementRoundRequest]:
+        running = await self.smembers(agent_queue_running_key(uuid))
+        values = await self.hgetall(agent_queue_key(uuid))
+        return [
+            MeasurementRoundRequest.parse_raw(value)
+            for key, value in values.items()
+            if key in running
+        ]
+
+    async def delete_running_requests(self, uuid: str) -> None:
+        """Put back the running requests in the queue, e.g. after a restart."""
+        self.logger.info("Deleting running requests")
+        await self.delete(agent_queue_running_key(uuid))
+
+    async def get_queue_service(self, uuid: str) -> dict[str, float]:
+        """Return the virtual service time of each user."""
+        service = await self.hgetall(agent_queue_service_key(uuid))
+        return {user: float(value) for user, value in service.items()}
+
+    async def record_round_duration(self, uuid: str, duration: float) -> None:
+        """Update the moving average of the duration of the rounds of the agent."""
+        if average := await self.get(agent_round_duration_key(uuid)):
+            duration = 0.8 * float(average) + 0.2 * duration
+        await self.set(agent_round_duration_key(uuid), str(duration))
+
+    async def get_agent_queue(self, uuid: str) -> AgentQueue:
+        """
+        Return the running and the queued requests in schedule order.
+        The expected wait times assume rounds of average duration.
+        """
+        running = await self.get_running_requests(uuid)
+        queued = schedule(
+            await self.get_queued_requests(uuid),
+            await self.get_queue_service(uuid),
+            datetime.utcnow(),
+            self.settings.REDIS_QUEUE_AGING_INTERVAL,
+        )
+        round_duration = None
+        if value := await self.get(agent_round_duration_key(uuid)):
+            round_duration = float(value)
+        concurrency = 1
+        if parameters := await self.get_agent_parameters(uuid):
+            concurrency = max(parameters.max_concurrent_rounds, 1)
+        return AgentQueue(
+            depth=len(queued),
+            running=running,
+            queued=[
+                QueuedRequest(
+                    request=request,
+                    position=position,
+                    expected_wait=(
+                        max(len(running) + position - concurrency + 1, 0)
+                        * round_duration
+                        / concurrency
+                        if round_duration is not None
+                        else None
+                    ),
+                )
+                for position, request in enumerate(queued)
+            ],
+            round_duration=round_duration,
+        )
 
     async def get_requests(self, uuid: str
     ) -> list[str]:
@@ -210,10 +423,55 @@ class Redis:
             return MeasurementRoundRequest.parse_raw(value)
         return None
 
+    @fault_tolerant
     async def set_request(self, uuid: str, request: MeasurementRoundRequest) -> None:
-        """Set the measurement request for a specified agent and measurement."""
-        await self.hset(agent_queue_key(uuid), request.measurement_uuid, request.json())
+        """
+        Set the measurement request for a specified agent and measurement,
+        and record its round as sent, in the same transaction.
+        """
+        rounds_key = measurement_rounds_key(request.measurement_uuid, uuid)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                f"{self.ns}:{agent_queue_key(uuid)}",
+                request.measurement_uuid,
+                request.json(),
+            )
+            pipe.sadd(f"{self.ns}:{rounds_key}", request.round.encode())
+            pipe.rpush(
+                f"{self.ns}:{agent_queue_wakeup_key(uuid)}", request.measurement_uuid
+            )
+            await pipe.execute()
+
+    async def is_round_sent(
+        self, measurement_uuid: str, agent_uuid: str, round_: Round
+    ) -> bool:
+        """Return true if a request for the round has been queued."""
+        return await self.sismember(
+            measurement_rounds_key(measurement_uuid, agent_uuid), round_.encode()
+        )
+
+    async def delete_sent_rounds(self, measurement_uuid: str, agent_uuid: str) -> None:
+        await self.delete(measurement_rounds_key(measurement_uuid, agent_uuid))
 
     async def delete_request(self, measurement_uuid: str, agent_uuid: str) -> None:
-        """Delete the measurement request for a specified agent and measurement."""
+        """
+        Delete the measurement request for a specified agent and measurement.
+        If the request is running, this notifies the agent to stop it.
+        """
         await self.hdel(agent_queue_key(agent_uuid), measurement_uuid)
+        await self.srem(agent_queue_running_key(agent_uuid), measurement_uuid)
+        await self.publish(agent_cancellations_key(agent_uuid), measurement_uuid)
+
+    async def listen_cancellations(self, agent_uuid: str) -> AsyncIterator[str]:
+        """
+        Yield the UUIDs of the measurements whose request is deleted.
+        The notifications are not persisted: they are lost if nobody listens.
+        """
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(f"{self.ns}:{agent_cancellations_key(agent_uuid)}")
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield message["data"]
+        finally:
+            await pubsub.aclose()
@@ -0,0 +1,110 @@
+"""
+Scheduling of the measurement round requests queued for an agent.
+
+The users are served with weighted fair queueing: each user has a virtual
+service time, increased by `1 / weight` each time one of its requests is
+scheduled, and the user with the lowest virtual time is served first.
+Among the requests of a user, the one with the highest effective priority
+is served first: a request gains one priority level every `aging_interval`
+seconds spent in the queue, so that low priority requests are not starved.
+"""
+from collections.abc import Mapping
+from datetime import datetime
+
+from iris.commons.models import MeasurementRoundRequest
+
+
+def effective_priority(
+    request: MeasurementRoundRequest, now: datetime, aging_interval: float
+) -> int:
+    """
+    >>> from iris.commons.models import Round
+    >>> request = MeasurementRoundRequest(
+    ...     measurement_uuid="a",
+    ...     probe_filename="probes",
+    ...     round=Round(number=1, limit=0, offset=0),
+    ...     priority=1,
+    ...     enqueue_time=datetime(2022, 1, 1, 0, 0),
+    ... )
+    >>> effective_priority(request, datetime(2022, 1, 1, 0, 0), 60)
+    1
+    >>> effective_priority(request, datetime(2022, 1, 1, 0, 5), 60)
+    6
+    """
+    if not request.enqueue_time or aging_interval <= 0:
+        return request.priority
+    age = (now - request.enqueue_time).total_seconds()
+    return request.priority + max(int(age // aging_interval), 0)
+
+
+def next_request(
+    requests: list[MeasurementRoundRequest],
+    service: Mapping[str, float],
+    now: datetime,
+    aging_interval: float,
+) -> tuple[MeasurementRoundRequest, float]:
+    """
+    Return the next request to serve, and the new virtual time of its user.
+    The virtual time of a user is at least the minimum of the users with
+    queued requests, so that new users are not favored indefinitely.
+    """
+    users = {request.user_id or "" for request in requests}
+    floor = min(service.get(user, 0.0) for user in users)
+
+    def user_key(request: MeasurementRoundRequest):
+        return (
+            max(service.get(request.user_id or "", 0.0), floor),
+            request.enqueue_time or now,
+        )
+
+    def request_key(request: MeasurementRoundRequest):
+        return (
+            -effective_priority(request, now, aging_interval),
+            request.enqueue_time or now,
+        )
+
+    user = min(requests, key=user_key).user_id or ""
+    request = min((r for r in requests if (r.user_id or "") == user), key=request_key)
+    return request, max(service.get(user, 0.0), floor) + 1 / request.weight
+
+
+def schedule(
+    requests: list[MeasurementRoundRequest],
+    service: Mapping[str, float],
+    now: datetime,
+    aging_interval: float,
+) -> list[MeasurementRoundRequest]:
+    """
+    Return the requests in the order in which they will be served,
+    assuming that no other requests are queued in the meantime.
+    >>> from iris.commons.models import Round
+    >>> def make_request(measurement_uuid, user_id, priority=0, weight=1.0):
+    ...     return MeasurementRoundRequest(
+    ...         measurement_uuid=measurement_uuid,
+    ...         probe_filename="probes",
+    ...         round=Round(number=1, limit=0, offset=0),
+    ...         user_id=user_id,
+    ...         priority=priority,
+    ...         weight=weight,
+    ...         enqueue_time=datetime(2022, 1, 1),
+    ...     )
+    >>> requests = [
+    ...     make_request("a1", "a"),
+    ...     make_request("a2", "a", priority=1),
+    ...     make_request("a3", "a"),
+    ...     make_request("b1", "b", weight=2.0),
+    ...     make_request("b2", "b", weight=2.0),
+    ... ]
+    >>> order = schedule(requests, {"a": 1.0}, datetime(2022, 1, 1), 60)
+    >>> [request.measurement_uuid for request in order]
+    ['b1', 'b2', 'a2', 'a1', 'a3']
+    """
+    service = dict(service)
+    requests = list(requests)
+    order = []
+    while requests:
+        request, virtual_time = next_request(requests, service, now, aging_interval)
+        service[request.user_id or ""] = virtual_time
+        requests.remove(request)
+        order.append(request)
+    return order
@@ -1,12 +1,18 @@
+import asyncio
 import datetime
 import json
+import os
+from collections.abc import AsyncIterable, AsyncIterator, Callable
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from logging import LoggerAdapter
 from pathlib import Path
 from typing import Any
 
 import aioboto3
+from botocore.exceptions import ClientError
 
+from iris.commons.instrumentation import stage
 from iris.commons.models import Round
 from iris.commons.settings import CommonSettings, fault_tolerant
 
@@ -32,6 +38,31 @@ class Storage:
 
     settings: CommonSettings
     logger: LoggerAdapter
+    # Long-lived S3 client, see `Storage.open`.
+    # If None, a new client is created for each call.
+    s3_client: Any = None
+
+    @classmethod
+    @asynccontextmanager
+    async def open(
+        cls, settings: CommonSettings, logger: LoggerAdapter
+    ) -> AsyncIterator["Storage"]:
+        """
+        Return a storage instance that reuses the same S3 client,
+        and its pool of connections, for all the calls.
+        """
+        session = aioboto3.Session()
+        async with session.client("s3", **settings.s3) as s3:
+            yield cls(settings, logger, s3)
+
+    @asynccontextmanager
+    async def client(self) -> AsyncIterator[Any]:
+        if self.s3_client:
+            yield self.s3_client
+        else:
+            session = aioboto3.Session()
+            async with session.client("s3", **self.settings.s3) as s3:
+                yield s3
 
     def archive_bucket(self, user_id: str) -> str:
         return f"{self.settings.S3_PREFIX}-archive-{user_id}"
@@ -44,8 +75,7 @@ class Storage:
 
     @fault_tolerant
     async def get_measurement_buckets(self) -> list[str]:
-        session = aioboto3.Session()
-        async with session.client("s3", **self.settings.s3) as s3:
+        async with self.client() as s3:
             response = await s3.list_buckets()
             return [x["Name"] for x in response["Buckets"]]
 
@@ -53,8 +83,7 @@ class Storage:
     async def create_bucket(self, bucket: str) -> None:
         """Create a bucket."""
         self.logger.info("Creating bucket %s", bucket)
-        session = aioboto3.Session()
-        async with session.client("s3", **self.settings.s3) as s3:
+        async with self.client() as s3:
             try:
                 await s3.create_bucket(Bucket=bucket)
             except s3.exceptions.BucketAlreadyOwnedByYou:
@@ -63,8 +92,7 @@ class Storage:
     @fault_tolerant
     async def delete_bucket(self, bucket: str) -> None:
         """Delete a bucket."""
-        session = aioboto3.Session()
-        async with session.client("s3", **self.settings.s3) as s3:
+        async with self.client() as s3:
             await s3.delete_bucket(Bucket=bucket)
 
     async def delete_bucket_with_files(self, bucket: str) -> None:
@@ -74,23 +102,23 @@ class Storage:
     async def get_all_files_no_retry(self, bucket: str) -> list[dict]:
         """Get all files inside a bucket."""
         targets = []
-        session = aioboto3.Session()
-        async with session.resource("s3", **self.settings.s3) as s3:
-            b = await s3.Bucket(bucket)
-            async for obj_summary in b.objects.all():
-                obj = await obj_summary.Object()
-                targets.append(
-                    {
-                        "key": obj_summary.key,
-                        "size": await obj_summary.size,
-                        "metadata": await obj.metadata,
-                        "last_modified": datetime.datetime.fromisoformat(
-                            str(await obj_summary.last_modified)
-                        )
-                        .replace(microsecond=0)
-                        .replace(tzinfo=datetime.timezone.utc),
-                    }
-                )
+        async with self.client() as s3:
+            paginator = s3.get_paginator("list_objects_v2")
+            async for page in paginator.paginate(Bucket=bucket):
+                for obj in page.get("Contents", []):
+                    head = await s3.head_object(Bucket=bucket, Key=obj["Key"])
+                    targets.append(
+                        {
+                            "key": obj["Key"],
+                            "size": obj["Size"],
+                            "metadata": head["Metadata"],
+                            "last_modified": datetime.datetime.fromisoformat(
+                                str(obj["LastModified"])
+                            )
+                            .replace(microsecond=0)
+                            .replace(tzinfo=datetime.timezone.utc),
+                        }
+                    )
         return targets
 
     @fault_tolerant
@@ -98,12 +126,28 @@ class Storage:
         """Get all files inside a bucket."""
         return await self.get_all_files_no_retry(bucket)
 
+    @fault_tolerant
+    async def get_keys(self, bucket: str, prefix: str = "") -> list[str]:
+        """Get the keys of the files inside a bucket, without their metadata."""
+        keys = []
+        async with self.client() as s3:
+            paginator = s3.get_paginator("list_objects_v2")
+            async for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return keys
+
+    @fault_tolerant
+    async def get_file_size(self, bucket: str, filename: str) -> int:
+        """Get the size of a file, without downloading it."""
+        async with self.client() as s3:
+            head = await s3.head_object(Bucket=bucket, Key=filename)
+            return head["ContentLength"]
+
     async def get_file_no_retry(
         self, bucket: str, filename: str, retrieve_content: bool = True
     ) -> dict:
         """Get file information from a bucket."""
-        session = aioboto3.Session()
-        async with session.client("s3", **self.settings.s3) as s3:
+        async with self.client() as s3:
             file_object = await s3.get_object(Bucket=bucket, Key=filename)
 
             content = None
@@ -143,27 +187,269 @@ class Storage:
         metadata: Any = None,
     ) -> None:
         """Upload a file in a bucket."""
-        with Path(filepath).open("rb") as fd:
-            return await self.upload_file_no_retry(bucket, filename, fd, metadata)
+        with stage("upload_file", key=filename) as stats:
+            stats.bytes = Path(filepath).stat().st_size
+            with Path(filepath).open("rb") as fd:
+                return await self.upload_file_no_retry(bucket, filename, fd, metadata)
 
     async def upload_file_no_retry(
         self, bucket: str, filename: str, fd, metadata: Any = None
     ) -> None:
         """Upload a file in a bucket with no retry."""
-        session = aioboto3.Session()
-        async with session.client("s3", **self.settings.s3) as s3:
-            extraargs = {"Metadata": metadata} if metadata else None
-            await s3.upload_fileobj(fd, bucket, filename, ExtraArgs=extraargs)
+        start = fd.tell()
+        size = fd.seek(0, os.SEEK_END) - start
+        fd.seek(start)
+        async with self.client() as s3:
+            extraargs = {"Metadata": metadata} if metadata else {}
+            if size < self.settings.S3_MULTIPART_THRESHOLD:
+                await s3.put_object(
+                    Bucket=bucket, Key=filename, Body=fd.read(), **extraargs
+                )
+            else:
+                await s3.upload_fileobj(
+                    fd,
+                    bucket,
+                    filename,
+                    ExtraArgs=extraargs,
+                    Config=self.settings.s3_transfer,
+                )
+
+    @fault_tolerant
+    async def upload_file_resumable(
+        self,
+        bucket: str,
+        filename: str,
+        filepath: Path | str,
+        upload: dict,
+        checkpoint: Callable[[dict], None] | None = None,
+    ) -> None:
+        """
+        Upload a file in a bucket, resuming the multipart upload described by
+        `upload`, if any: the parts already uploaded are not sent again.
+        `upload` is updated with the ID of the multipart upload, and passed to
+        `checkpoint` so that it can be persisted to resume after a restart.
+        """
+        size = Path(filepath).stat().st_size
+        if size < self.settings.S3_MULTIPART_THRESHOLD:
+            with Path(filepath).open("rb") as fd:
+                return await self.upload_file_no_retry(bucket, filename, fd)
+        # S3 requires parts of at least 5 MiB, except for the last one.
+        part_size = max(self.settings.S3_MULTIPART_CHUNK_SIZE, 5 * 2**20)
+        semaphore = asyncio.Semaphore(self.settings.S3_MULTIPART_CONCURRENCY)
+        async with self.client() as s3:
+            uploaded = {}
+            if upload_id := upload.get("upload_id"):
+                try:
+                    paginator = s3.get_paginator("list_parts")
+                    async for page in paginator.paginate(
+                        Bucket=bucket, Key=filename, UploadId=upload_id
+                    ):
+                        for part in page.get("Parts", []):
+                            uploaded[part["PartNumber"]] = part
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "NoSuchUpload":
+                        raise
+                    upload_id = None
+            if not upload_id:
+                response = await s3.create_multipart_upload(Bucket=bucket, Key=filename)
+                upload_id = upload["upload_id"] = response["UploadId"]
+                if checkpoint:
+                    checkpoint(upload)
+            self.logger.info(
+                "Upload %s (%s parts already uploaded)", filename, len(uploaded)
+            )
+
+            async def upload_part(fd: int, number: int, start: int) -> dict:
+                length = min(part_size, size - start)
+                part = uploaded.get(number)
+                if part and part["Size"] == length:
+                    return {"ETag": part["ETag"], "PartNumber": number}
+                async with semaphore:
+                    response = await s3.upload_part(
+                        Bucket=bucket,
+                        Key=filename,
+                        UploadId=upload_id,
+                        PartNumber=number,
+                        Body=os.pread(fd, length, start),
+                    )
+                    return {"ETag": response["ETag"], "PartNumber": number}
+
+            with Path(filepath).open("rb") as f:
+                tasks = [
+                    asyncio.create_task(upload_part(f.fileno(), i + 1, start))
+                    for i, start in enumerate(range(0, size, part_size))
+                ]
+                try:
+                    parts = await asyncio.gather(*tasks)
+                except BaseException:
+                    # The multipart upload is not aborted, so that it can be resumed.
+                    for task in tasks:
+                        task.cancel()
+                    raise
+            await s3.complete_multipart_upload(
+                Bucket=bucket,
+                Key=filename,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
 
     @fault_tolerant
     async def download_file(
         self, bucket: str, filename: str, output_path: Path | str
     ) -> None:
         """Download a file in a bucket."""
-        session = aioboto3.Session()
-        async with session.client("s3", **self.settings.s3) as s3:
-            with Path(output_path).open("wb") as fd:
-                await s3.download_fileobj(bucket, filename, fd)
+        with stage("download_file", key=filename) as stats:
+            stats.bytes = await self.download_file_no_retry(
+                bucket, filename, output_path
+            )
+
+    async def download_file_no_retry(
+        self, bucket: str, filename: str, output_path: Path | str
+    ) -> int:
+        """
+        Download a file in a bucket with no retry.
+        Files larger than `S3_MULTIPART_THRESHOLD` are downloaded
+        by concurrent range requests written in place.
+
+        :returns: The size of the file.
+        """
+        chunk_size = self.settings.S3_MULTIPART_CHUNK_SIZE
+        semaphore = asyncio.Semaphore(self.settings.S3_MULTIPART_CONCURRENCY)
+        async with self.client() as s3:
+            head = await s3.head_object(Bucket=bucket, Key=filename)
+            size: int = head["ContentLength"]
+
+            async def download_range(fd: int, start: int, end: int | None) -> None:
+                params = {"Bucket": bucket, "Key": filename, "IfMatch": head["ETag"]}
+                if end is not None:
+                    params["Range"] = f"bytes={start}-{end - 1}"
+                async with semaphore:
+                    response = await s3.get_object(**params)
+                    async with response["Body"] as body:
+                        async for data in body.iter_chunks(2**20):
+                            view = memoryview(data)
+                            while view:
+                                written = os.pwrite(fd, view, start)
+                                start += written
+                                view = view[written:]
+
+            with Path(output_path).open("wb") as f:
+                f.truncate(size)
+                if size < self.settings.S3_MULTIPART_THRESHOLD:
+                    await download_range(f.fileno(), 0, None)
+                else:
+                    await asyncio.gather(
+                        *[
+                            download_range(
+                                f.fileno(), start, min(start + chunk_size, size)
+                            )
+                            for start in range(0, size, chunk_size)
+                        ]
+                    )
+        return size
+
+    async def iter_file(
+        self, bucket: str, filename: str, chunk_size: int = 2**20
+    ) -> AsyncIterator[bytes]:
+        """Iterate over the content of a file as it is downloaded."""
+        async with self.client() as s3:
+            response = await s3.get_object(Bucket=bucket, Key=filename)
+            async with response["Body"] as body:
+                async for chunk in body.iter_chunks(chunk_size):
+                    yield chunk
+
+    async def upload_chunks(
+        self, bucket: str, filename: str, chunks: AsyncIterable[bytes]
+    ) -> int:
+        """
+        Upload a stream of unknown size, in parts of `S3_MULTIPART_CHUNK_SIZE`
+        as soon as they are available. At most `S3_MULTIPART_CONCURRENCY` parts
+        are kept in memory: the stream is not consumed while they are uploaded.
+        Each part is retried, and the upload fails as soon as a part fails,
+        before consuming the rest of the stream. The stream cannot be replayed,
+        so a failed upload cannot be resumed.
+
+        :returns: The size of the file.
+        """
+        # S3 requires parts of at least 5 MiB, except for the last one.
+        part_size = max(self.settings.S3_MULTIPART_CHUNK_SIZE, 5 * 2**20)
+        semaphore = asyncio.Semaphore(self.settings.S3_MULTIPART_CONCURRENCY)
+        buffer = bytearray()
+        size = 0
+        upload_id = None
+        tasks: list[asyncio.Task] = []
+        async with self.client() as s3:
+
+            async def upload_part(number: int, data: bytes) -> dict:
+                try:
+                    return await self.upload_part(
+                        s3, bucket, filename, upload_id, number, data
+                    )
+                finally:
+                    semaphore.release()
+
+            async def submit_part(data: bytes) -> None:
+                nonlocal upload_id
+                if upload_id is None:
+                    response = await s3.create_multipart_upload(
+                        Bucket=bucket, Key=filename
+                    )
+                    upload_id = response["UploadId"]
+                await semaphore.acquire()
+                # Raise the error of a failed part before reading more of the stream.
+                for task in tasks:
+                    if task.done():
+                        task.result()
+                tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, data)))
+
+            try:
+                async for chunk in chunks:
+                    buffer += chunk
+                    size += len(chunk)
+                    while len(buffer) >= part_size:
+                        await submit_part(bytes(buffer[:part_size]))
+                        del buffer[:part_size]
+                if upload_id is None:
+                    await s3.put_object(Bucket=bucket, Key=filename, Body=bytes(buffer))
+                    return size
+                if buffer:
+                    await submit_part(bytes(buffer))
+                parts = await asyncio.gather(*tasks)
+                await s3.complete_multipart_upload(
+                    Bucket=bucket,
+                    Key=filename,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+                return size
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                if upload_id is not None:
+                    await s3.abort_multipart_upload(
+                        Bucket=bucket, Key=filename, UploadId=upload_id
+                    )
+                raise
+
+    @fault_tolerant
+    async def upload_part(
+        self,
+        s3: Any,
+        bucket: str,
+        filename: str,
+        upload_id: str,
+        number: int,
+        data: bytes,
+    ) -> dict:
+        """Upload a part of a multipart upload."""
+        response = await s3.upload_part(
+            Bucket=bucket,
+            Key=filename,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=data,
+        )
+        return {"ETag": response["ETag"], "PartNumber": number}
 
     async def download_file_to(self, bucket: str, filename: str, output_dir: Path):
         output_path = output_dir / filename
@@ -172,8 +458,7 @@ class Storage:
 
     async def delete_file_check_no_retry(self, bucket: str, filename: str) -> dict:
         """Delete a file with a check that it exists."""
-        session = aioboto3.Session()
-        async with session.client("s3", **self.settings.s3) as s3:
+        async with self.client() as s3:
             file_object = await s3.get_object(Bucket=bucket, Key=filename)
             async with file_object["Body"] as stream:
                 await stream.read()
@@ -183,8 +468,7 @@ class Storage:
     @fault_tolerant
     async def delete_file_no_check(self, bucket: str, filename: str) -> bool:
         """Delete a file with no check that it exists."""
-        session = aioboto3.Session()
-        async with session.client("s3", **self.settings.s3) as s3:
+        async with self.client() as s3:
             response = await s3.delete_object(Bucket=bucket, Key=filename)
         status_code: int = response["ResponseMetadata"]["HTTPStatusCode"]
         return status_code == 204
@@ -192,21 +476,20 @@ class Storage:
     @fault_tolerant
     async def delete_all_files_from_bucket(self, bucket: str) -> None:
         """Delete all files from a bucket."""
-        session = aioboto3.Session()
-        async with session.resource("s3", **self.settings.s3) as s3:
-            b = await s3.Bucket(bucket)
-            await b.objects.all().delete()
+        async with self.client() as s3:
+            paginator = s3.get_paginator("list_objects_v2")
+            async for page in paginator.paginate(Bucket=bucket):
+                if objects := [{"Key": obj["Key"]} for obj in page.get("Contents", [])]:
+                    await s3.delete_objects(Bucket=bucket, Delete={"Objects": objects})
 
     @fault_tolerant
     async def copy_file_to_bucket(
         self, bucket_src: str, bucket_dest: str, filename_src: str, filename_dst: str
     ) -> None:
         """Copy a file from a bucket to another."""
-        session = aioboto3.Session()
-        async with session.resource("s3", **self.settings.s3) as s3:
-            bucket_destination = await s3.Bucket(bucket_dest)
-            await bucket_destination.copy(
-                {"Bucket": bucket_src, "Key": filename_src}, filename_dst
+        async with self.client() as s3:
+            await s3.copy(
+                {"Bucket": bucket_src, "Key": filename_src}, bucket_dest, filename_dst
             )
 
     @fault_tolerant
@@ -85,45 +85,70 @@ def get_internal_ipv6_address(
     return ip_address
 
 
-def get_ip_from_endpoints(endpoints, ip_version='ipv4'):
-    for url in endpoints:
-        try:
-            result = subprocess.run(
-                ["curl", "-s", url],
-                capture_output=True,
-                text=True,
-                check=True,
-                timeout=5,
-            )
-            ip_str = result.stdout.strip()
-            if ip_version == 'ipv4':
-                ip = IPv4Address(ip_str)
-            else:
-                ip = IPv6Address(ip_str)
-            return ip
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError) as e:
-            base_logger.info("Failed to get valid %s from %s: %s", ip_version, url, e)
-            continue
+async def get_ip_from_endpoint(
+    url: str, ip_version: str = "ipv4", timeout: float = 5
+) -> IPv4Address | IPv6Address | None:
+    process = await asyncio.create_subprocess_exec(
+        "curl",
+        "-s",
+        "--fail",
+        "--max-time",
+        str(timeout),
+        url,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        stdout, _ = await process.communicate()
+    finally:
+        # Do not leave curl running if the query is cancelled.
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    try:
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, url)
+        ip_str = stdout.decode().strip()
+        if ip_version == "ipv4":
+            return IPv4Address(ip_str)
+        return IPv6Address(ip_str)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        base_logger.info("Failed to get valid %s from %s: %s", ip_version, url, e)
+        return None
+
+
+async def get_ip_from_endpoints(endpoints, ip_version="ipv4"):
+    """Query the endpoints concurrently, and return the first valid address."""
+    tasks = [
+        asyncio.create_task(get_ip_from_endpoint(url, ip_version)) for url in endpoints
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            if ip := await task:
+                return ip
+    finally:
+        for task in tasks:
+            task.cancel()
     return None
 
 
-def get_external_ipv4_address() -> IPv4Address | None:
+async def get_external_ipv4_address() -> IPv4Address | None:
     ipv4_endpoints = [
         "https://ipv4.icanhazip.com",
         "https://v4.ident.me",
-        "https://api.ipify.org"
+        "https://api.ipify.org",
     ]
-    return get_ip_from_endpoints(ipv4_endpoints, 'ipv4')
+    return await get_ip_from_endpoints(ipv4_endpoints, "ipv4")
 
 
-def get_external_ipv6_address() -> IPv6Address | None:
+async def get_external_ipv6_address() -> IPv6Address | None:
     ipv6_endpoints = [
         "https://ipv6.icanhazip.com",
         "https://v6.ident.me",
         "https://api6.ipify.org",
         "https://ifconfig.me",
     ]
-    return get_ip_from_endpoints(ipv6_endpoints, 'ipv6')
+    return await get_ip_from_endpoints(ipv6_endpoints, "ipv6")
 
 
 @contextmanager
@@ -1,4 +1,6 @@
-from ipaddress import IPv6Address
+import struct
+from collections.abc import Iterable, Iterator
+from itertools import islice
 from logging import Logger
 from pathlib import Path
 
@@ -10,8 +12,9 @@ from diamond_miner.typing import FlowMapper
 from pych_client import ClickHouseClient
 
 from iris.commons.clickhouse import ClickHouse
+from iris.commons.instrumentation import stage
 from iris.commons.models import Round, ToolParameters
-from iris.worker.tree import load_targets
+from iris.worker.tree import TargetIndex, format_prefix
 
 
 async def diamond_miner_inner_pipeline(
@@ -32,6 +35,7 @@ async def diamond_miner_inner_pipeline(
     previous_round: Round | None,
     next_round: Round,
     max_open_files: int,
+    probe_counts_batch_size: int,
 ) -> int:
     """
     Given a targets file and an optional results file, write the probes for the next round.
@@ -74,80 +78,74 @@ async def diamond_miner_inner_pipeline(
         )
 
         logger.info("Load targets")
-        with targets_filepath.open() as f:
-            targets = load_targets(
-                f,
-                clamp_ttl_min=probe_ttl_geq,
-                clamp_ttl_max=probe_ttl_leq,
-            )
-
-        logger.info("Compute the prefixes to probe")
-        prefixes = []
-
-        if previous_round is None:
-            logger.info("Enumerate initial prefixes")
-            for prefix in targets:
-                for protocol, ttls, n_initial_flows in targets[prefix]:
-                    prefixes.append((prefix, protocol, ttls, n_initial_flows))
-        else:
-            logger.info("Enumerate sliding prefixes")
-            query = GetSlidingPrefixes(
-                window_max_ttl=previous_round.max_ttl,
-                stopping_condition=sliding_window_stopping_condition,
-            )
-            for row in query.execute_iter(client, measurement_id):
-                addr_v6 = IPv6Address(row["probe_dst_prefix"])
-                if addr_v4 := addr_v6.ipv4_mapped:
-                    prefix = f"{addr_v4}/{tool_parameters.prefix_len_v4}"
-                else:
-                    prefix = f"{addr_v6}/{tool_parameters.prefix_len_v6}"
-                try:
-                    for protocol, ttls, n_initial_flows in targets[prefix]:
-                        prefixes.append((prefix, protocol, ttls, n_initial_flows))
-                except KeyError:
-                    logger.error(
-                        f"Prefix not in initial target file {targets_filepath}:{prefix}"
-                    )
-                    continue
-
-        logger.info("Insert probe counts")
-        insert_probe_counts(
-            client=client,
-            measurement_id=measurement_id,
-            round_=next_round.number,
-            prefixes=prefixes,
-            prefix_len_v4=tool_parameters.prefix_len_v4,
-            prefix_len_v6=tool_parameters.prefix_len_v6,
-        )
-
-        del prefixes, targets
+        with stage("load_targets"):
+            targets = TargetIndex.open(targets_filepath)
+        with targets:
+            logger.info("Compute the prefixes to probe")
+            if previous_round is None:
+                logger.info("Enumerate initial prefixes")
+                prefixes = targets.entries(
+                    clamp_ttl_min=probe_ttl_geq, clamp_ttl_max=probe_ttl_leq
+                )
+            else:
+                logger.info("Enumerate sliding prefixes")
+                query = GetSlidingPrefixes(
+                    window_max_ttl=previous_round.max_ttl,
+                    stopping_condition=sliding_window_stopping_condition,
+                )
+                prefixes = resolve_prefixes(
+                    logger,
+                    targets,
+                    iter_prefixes(client, measurement_id, query),
+                    prefix_len_v4=tool_parameters.prefix_len_v4,
+                    prefix_len_v6=tool_parameters.prefix_len_v6,
+                    clamp_ttl_min=probe_ttl_geq,
+                    clamp_ttl_max=probe_ttl_leq,
+                )
+
+            logger.info("Insert probe counts")
+            with stage("insert_probe_counts") as stats:
+                stats.rows = insert_probe_counts_batched(
+                    client=client,
+                    measurement_id=measurement_id,
+                    round_=next_round.number,
+                    prefixes=prefixes,
+                    prefix_len_v4=tool_parameters.prefix_len_v4,
+                    prefix_len_v6=tool_parameters.prefix_len_v6,
+                    batch_size=probe_counts_batch_size,
+                )
 
     # Compute MDA probes for round > 1
     else:
         assert previous_round, "round > 1 must have a previous round"
         logger.info("Insert MDA probe counts")
-        insert_mda_probe_counts(
+        with stage("insert_mda_probe_counts"):
+            insert_mda_probe_counts(
+                client=client,
+                measurement_id=measurement_id,
+                previous_round=previous_round.number,
+                target_epsilon=tool_parameters.failure_probability,
+                adaptive_eps=True,
+            )
+
+    logger.info("Generate probes file")
+    with stage("generate_probes") as stats:
+        n_probes = probe_generator_parallel(
+            filepath=probes_filepath,
             client=client,
             measurement_id=measurement_id,
-            previous_round=previous_round.number,
-            target_epsilon=tool_parameters.failure_probability,
-            adaptive_eps=True,
+            round_=next_round.number,
+            mapper_v4=flow_mapper_v4,
+            mapper_v6=flow_mapper_v6,
+            probe_src_port=tool_parameters.initial_source_port,
+            probe_dst_port=tool_parameters.destination_port,
+            probe_ttl_geq=probe_ttl_geq,
+            probe_ttl_leq=probe_ttl_leq,
+            max_open_files=max_open_files,
         )
-
-    logger.info("Generate probes file")
-    return probe_generator_parallel(
-        filepath=probes_filepath,
-        client=client,
-        measurement_id=measurement_id,
-        round_=next_round.number,
-        mapper_v4=flow_mapper_v4,
-        mapper_v6=flow_mapper_v6,
-        probe_src_port=tool_parameters.initial_source_port,
-        probe_dst_port=tool_parameters.destination_port,
-        probe_ttl_geq=probe_ttl_geq,
-        probe_ttl_leq=probe_ttl_leq,
-        max_open_files=max_open_files,
-    )
+        stats.rows = n_probes
+        stats.bytes = probes_filepath.stat().st_size if n_probes else 0
+    return n_probes
 
 
 def instantiate_flow_mappers(
@@ -162,3 +160,82 @@ def instantiate_flow_mappers(
         **{"prefix_size": prefix_size_v6, **flow_mapper_kwargs}
     )
     return flow_mapper_v4, flow_mapper_v6
+
+
+def iter_prefixes(
+    client: ClickHouseClient, measurement_id: str, query: GetSlidingPrefixes
+) -> Iterator[int]:
+    """
+    Stream the destination prefixes returned by the query, as integers.
+    The prefixes are fetched in the RowBinary format, 16 bytes per prefix,
+    to avoid parsing a JSON row and an IP address string for each of them.
+    """
+    statement = (
+        f"SELECT probe_dst_prefix FROM ({query.statement(measurement_id)}) "
+        "FORMAT RowBinary"
+    )
+    remainder = b""
+    for chunk in client.iter_bytes(statement):
+        data = remainder + chunk
+        end = len(data) - len(data) % 16
+        remainder = data[end:]
+        for hi, lo in struct.iter_unpack(">QQ", data[:end]):
+            yield hi << 64 | lo
+
+
+def resolve_prefixes(
+    logger: Logger,
+    targets: TargetIndex,
+    networks: Iterable[int],
+    prefix_len_v4: int,
+    prefix_len_v6: int,
+    clamp_ttl_min: int = 0,
+    clamp_ttl_max: int = 255,
+) -> Iterator[tuple[str, str, range, int]]:
+    """
+    Yield the (prefix, protocol, ttls, n_initial_flows) of the targets containing
+    the prefixes returned by `iter_prefixes`.
+    """
+    for network in networks:
+        if network >> 32 == 0xFFFF:
+            length = 96 + prefix_len_v4
+        else:
+            length = prefix_len_v6
+        prefix = format_prefix(network, length)
+        try:
+            for protocol, ttls, n_initial_flows in targets.lookup_network(
+                network, length, clamp_ttl_min, clamp_ttl_max
+            ):
+                yield prefix, protocol, ttls, n_initial_flows
+        except KeyError:
+            logger.error(f"Prefix not in initial target list: {prefix}")
+
+
+def insert_probe_counts_batched(
+    client: ClickHouseClient,
+    measurement_id: str,
+    round_: int,
+    prefixes: Iterable[tuple[str, str, Iterable[int], int]],
+    prefix_len_v4: int,
+    prefix_len_v6: int,
+    batch_size: int,
+) -> int:
+    """
+    Insert the probe counts by batches of `batch_size` prefixes,
+    so that the prefixes are never all in memory.
+
+    :returns: The number of prefixes inserted.
+    """
+    prefixes = iter(prefixes)
+    n_prefixes = 0
+    while batch := list(islice(prefixes, batch_size)):
+        insert_probe_counts(
+            client=client,
+            measurement_id=measurement_id,
+            round_=round_,
+            prefixes=batch,
+            prefix_len_v4=prefix_len_v4,
+            prefix_len_v6=prefix_len_v6,
+        )
+        n_prefixes += len(batch)
+    return n_prefixes
@@ -2,13 +2,16 @@ from logging import Logger
 from pathlib import Path
 
 from diamond_miner.generators import probe_generator_parallel
-from diamond_miner.insert import insert_probe_counts
 from pych_client import ClickHouseClient
 
 from iris.commons.clickhouse import ClickHouse
+from iris.commons.instrumentation import stage
 from iris.commons.models import Round, ToolParameters
-from iris.worker.inner_pipeline.diamond_miner import instantiate_flow_mappers
-from iris.worker.tree import load_targets
+from iris.worker.inner_pipeline.diamond_miner import (
+    insert_probe_counts_batched,
+    instantiate_flow_mappers,
+)
+from iris.worker.tree import TargetIndex
 
 
 async def ping_inner_pipeline(
@@ -29,6 +32,7 @@ async def ping_inner_pipeline(
     previous_round: Round | None,
     next_round: Round,
     max_open_files: int,
+    probe_counts_batch_size: int,
 ) -> int:
     """
     :returns: The number of probes written.
@@ -60,37 +64,41 @@ async def ping_inner_pipeline(
         return 0
 
     logger.info("Load targets")
-    with targets_filepath.open() as f:
-        targets = load_targets(f)
+    with stage("load_targets"):
+        targets = TargetIndex.open(targets_filepath)
+    with targets:
+        logger.info("Compute the prefixes to probe")
+        # In the case of ping, only take the max TTL in the TTL range.
+        prefixes = (
+            (prefix, protocol, (ttls[-1],), n_initial_flows)
+            for prefix, protocol, ttls, n_initial_flows in targets.entries()
+        )
 
-    logger.info("Compute the prefixes to probe")
-    prefixes = []
-    for prefix in targets:
-        for protocol, ttls, n_initial_flows in targets[prefix]:
-            # In the case of ping, only take the max TTL in the TTL range.
-            prefixes.append((prefix, protocol, (ttls[-1],), n_initial_flows))
-
-    logger.info("Insert probe counts")
-    insert_probe_counts(
-        client=client,
-        measurement_id=measurement_id,
-        round_=next_round.number,
-        prefixes=prefixes,
-        prefix_len_v4=tool_parameters.prefix_len_v4,
-        prefix_len_v6=tool_parameters.prefix_len_v6,
-    )
-
-    del prefixes, targets
+        logger.info("Insert probe counts")
+        with stage("insert_probe_counts") as stats:
+            stats.rows = insert_probe_counts_batched(
+                client=client,
+                measurement_id=measurement_id,
+                round_=next_round.number,
+                prefixes=prefixes,
+                prefix_len_v4=tool_parameters.prefix_len_v4,
+                prefix_len_v6=tool_parameters.prefix_len_v6,
+                batch_size=probe_counts_batch_size,
+            )
 
     logger.info("Generate probes file")
-    return probe_generator_parallel(
-        filepath=probes_filepath,
-        client=client,
-        measurement_id=measurement_id,
-        round_=next_round.number,
-        mapper_v4=flow_mapper_v4,
-        mapper_v6=flow_mapper_v6,
-        probe_src_port=tool_parameters.initial_source_port,
-        probe_dst_port=tool_parameters.destination_port,
-        max_open_files=max_open_files,
-    )
+    with stage("generate_probes") as stats:
+        n_probes = probe_generator_parallel(
+            filepath=probes_filepath,
+            client=client,
+            measurement_id=measurement_id,
+            round_=next_round.number,
+            mapper_v4=flow_mapper_v4,
+            mapper_v6=flow_mapper_v6,
+            probe_src_port=tool_parameters.initial_source_port,
+            probe_dst_port=tool_parameters.destination_port,
+            max_open_files=max_open_files,
+        )
+        stats.rows = n_probes
+        stats.bytes = probes_filepath.stat().st_size if n_probes else 0
+    return n_probes
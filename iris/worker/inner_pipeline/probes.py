@@ -26,6 +26,7 @@ async def probes_inner_pipeline(
     previous_round: Round | None,
     next_round: Round,
     max_open_files: int,
+    probe_counts_batch_size: int,
 ) -> int:
     """
     :returns: The number of probes written.
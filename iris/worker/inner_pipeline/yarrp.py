@@ -24,6 +24,7 @@ async def yarrp_inner_pipeline(
     previous_round: Round | None,
     next_round: Round,
     max_open_files: int,
+    probe_counts_batch_size: int,
 ) -> int:
     """
     Given a targets file and an optional results file, write the probes for the next round.
@@ -64,4 +65,5 @@ async def yarrp_inner_pipeline(
         previous_round=previous_round,
         next_round=next_round,
         max_open_files=max_open_files,
+        probe_counts_batch_size=probe_counts_batch_size,
     )
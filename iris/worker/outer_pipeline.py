@@ -1,4 +1,5 @@
 """Measurement pipeline."""
+
 from dataclasses import dataclass
 from logging import LoggerAdapter
 from pathlib import Path
@@ -9,6 +10,12 @@ from iris.commons.redis import Redis
 from iris.commons.storage import Storage, next_round_key
 from iris.commons.utils import unwrap
 from iris.worker.inner_pipeline import inner_pipeline_for_tool
+from iris.worker.tree import target_index_path
+
+# Tools whose first round is probed by sliding TTL windows.
+SLIDING_WINDOW_TOOLS = {Tool.DiamondMiner, Tool.Yarrp}
+# Tools which read the targets through a `TargetIndex`.
+TARGET_INDEX_TOOLS = {Tool.DiamondMiner, Tool.Ping, Tool.Yarrp}
 
 
 @dataclass(frozen=True)
@@ -35,33 +42,62 @@ async def outer_pipeline(
     results_key: str | None,
     user_id: str,
     max_open_files: int,
-) -> OuterPipelineResult | None:
+    probe_counts_batch_size: int,
+    round_1_pipelining: bool = False,
+) -> list[OuterPipelineResult] | None:
     """
     Responsible to download/upload from object storage.
+
+    With `round_1_pipelining`, the probes of a round 1 window are sent before
+    the results of the previous window are received: the window after is computed
+    from the results received so far, while the agent is probing.
+    Since the prefixes are selected with one window of lag, this sends more probes
+    than the sequential execution, but never less.
+
+    :returns: The rounds to send to the agent, in order,
+        or None if the measurement is over.
     """
     logger.info("Running outer pipeline with results key %s", results_key)
+    bucket = storage.measurement_agent_bucket(measurement_uuid, agent_uuid)
+    round_1_pipelining = (
+        round_1_pipelining and sliding_window_size > 0 and tool in SLIDING_WINDOW_TOOLS
+    )
 
     logger.info("Retrieve agent information from redis")
     agent_parameters = unwrap(await redis.get_agent_parameters(agent_uuid))
 
-    logger.info("Download target file from object storage")
-    targets_filepath = await storage.download_file_to(
-        storage.targets_bucket(user_id), targets_key, working_directory
-    )
+    targets_filepath = working_directory / targets_key
+    if tool in TARGET_INDEX_TOOLS and target_index_path(targets_filepath).exists():
+        # NOTE: The index is compiled by the first round, and kept in the working
+        # directory until the end of the measurement.
+        logger.info("Use compiled target index")
+    else:
+        logger.info("Download target file from object storage")
+        targets_filepath = await storage.download_file_to(
+            storage.targets_bucket(user_id), targets_key, working_directory
+        )
 
     if results_key:
         logger.info("Download results file from object storage")
         results_filepath = await storage.download_file_to(
-            storage.measurement_agent_bucket(measurement_uuid, agent_uuid),
-            results_key,
-            working_directory,
+            bucket, results_key, working_directory
         )
     else:
         results_filepath = None
 
+    sent_ahead = None
     if results_key:
         previous_round = Round.decode(results_key)
         next_round = previous_round.next_round(tool_parameters.global_max_ttl)
+        if (
+            round_1_pipelining
+            and next_round.number == 1
+            # NOTE: The window is sent once its request is queued, not when its
+            # probes are uploaded, in case the worker restarted in between.
+            and await redis.is_round_sent(measurement_uuid, agent_uuid, next_round)
+        ):
+            sent_ahead = next_round
+            next_round = next_round.next_round(tool_parameters.global_max_ttl)
     else:
         previous_round = None
         next_round = Round(number=1, limit=sliding_window_size, offset=0)
@@ -71,7 +107,7 @@ async def outer_pipeline(
             agent_parameters.min_ttl, tool_parameters.global_min_ttl
         ):
             next_round = next_round.next_round(tool_parameters.global_max_ttl)
-    logger.info("%s => %s", previous_round, next_round)
+    logger.info("%s => %s (sent ahead: %s)", previous_round, next_round, sent_ahead)
 
     probes_filepath = working_directory / next_round_key(next_round)
     inner_pipeline_kwargs = dict(
@@ -88,25 +124,33 @@ async def outer_pipeline(
         previous_round=previous_round,
         next_round=next_round,
         max_open_files=max_open_files,
+        probe_counts_batch_size=probe_counts_batch_size,
     )
-    n_probes_to_send = await inner_pipeline_for_tool[tool](**inner_pipeline_kwargs)
+    if sent_ahead and next_round.number > 1:
+        # NOTE: Round 2 requires the results of every window of round 1,
+        # we only insert the results until those of the last window are received.
+        assert results_filepath
+        await clickhouse.insert_csv(measurement_uuid, agent_uuid, results_filepath)
+        n_probes_to_send = 0
+    else:
+        n_probes_to_send = await inner_pipeline_for_tool[tool](**inner_pipeline_kwargs)
 
     if results_key:
         # NOTE: We delete after the inner pipeline, so that if the pipeline fails,
         # the file will still be present on the object storage and the worker will
         # restart the outer pipeline.
         logger.info("Delete results file from object storage")
-        await storage.delete_file_no_check(
-            storage.measurement_agent_bucket(measurement_uuid, agent_uuid), results_key
-        )
+        await storage.delete_file_no_check(bucket, results_key)
 
-    if next_round.number > tool_parameters.max_round:
+    # NOTE: If a window was sent ahead, we wait for its results before moving
+    # to the next round or stopping the measurement.
+    if next_round.number > tool_parameters.max_round and not sent_ahead:
         # NOTE: We stop if we reached the maximum number of rounds.
         # Here we could do refactor to stop before computing the next round.
         logger.info("Maximum number of rounds reached")
         return None
 
-    if next_round.number == 1 and n_probes_to_send == 0:
+    if next_round.number == 1 and n_probes_to_send == 0 and not sent_ahead:
         logger.info("No remaining prefixes to probe at round 1. Going to round 2.")
         next_round = Round(number=2, limit=0, offset=0)
         probes_filepath = working_directory / next_round_key(next_round)
@@ -117,18 +161,42 @@ async def outer_pipeline(
         n_probes_to_send = await inner_pipeline_for_tool[tool](**inner_pipeline_kwargs)
 
     logger.info("Probes to send: %s", n_probes_to_send)
-    result = None
+    results = []
 
     if n_probes_to_send > 0:
         logger.info("Upload probes file to object storage")
-        await storage.upload_file(
-            storage.measurement_agent_bucket(measurement_uuid, agent_uuid),
-            probes_filepath.name,
-            probes_filepath,
+        await storage.upload_file(bucket, probes_filepath.name, probes_filepath)
+        results.append(
+            OuterPipelineResult(next_round=next_round, probes_key=probes_filepath.name)
         )
-        result = OuterPipelineResult(
-            next_round=next_round, probes_key=probes_filepath.name
+        probes_filepath.unlink(missing_ok=True)
+
+    ahead_round = next_round.next_round(tool_parameters.global_max_ttl)
+    if (
+        round_1_pipelining
+        and not previous_round
+        and next_round.number == 1
+        and ahead_round.number == 1
+    ):
+        # NOTE: There are no results yet to select the prefixes of the second window:
+        # send it ahead to all the targets.
+        logger.info("Compute %s ahead of the results of %s", ahead_round, next_round)
+        probes_filepath = working_directory / next_round_key(ahead_round)
+        n_probes_to_send = await inner_pipeline_for_tool[tool](
+            **{
+                **inner_pipeline_kwargs,
+                "probes_filepath": probes_filepath,
+                "next_round": ahead_round,
+            }
         )
+        logger.info("Probes to send ahead: %s", n_probes_to_send)
+        if n_probes_to_send > 0:
+            await storage.upload_file(bucket, probes_filepath.name, probes_filepath)
+            results.append(
+                OuterPipelineResult(
+                    next_round=ahead_round, probes_key=probes_filepath.name
+                )
+            )
 
     if targets_filepath:
         logger.info("Remove local targets file")
@@ -140,4 +208,6 @@ async def outer_pipeline(
         logger.info("Remove local probes file")
         probes_filepath.unlink(missing_ok=True)
 
-    return result
+    if not results and not sent_ahead:
+        return None
+    return results
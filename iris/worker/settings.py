@@ -16,10 +16,23 @@ class WorkerSettings(CommonSettings):
     WORKER_SANITY_CHECK_RETRIES: int = 300
     WORKER_SANITY_CHECK_INTERVAL: float = 1  # seconds
     WORKER_WATCH_INTERVAL: float = 2  # seconds
+    # the agent notifies the worker of new results through redis,
+    # object storage is only listed at this interval in case a notification is lost
+    WORKER_RESULTS_POLL_INTERVAL: float = 60  # seconds
 
     WORKER_ROUND_1_SLIDING_WINDOW: int = 10  # put to 0 to deactivate sliding window
     WORKER_ROUND_1_STOPPING: int = (
         3  # stops probing a prefix if more than this number of *
     )
+    # send each window of round 1 before receiving the results of the previous one,
+    # at the expense of probing prefixes for one more window before stopping
+    WORKER_ROUND_1_PIPELINING: bool = False
 
     WORKER_MAX_OPEN_FILES: int = 8192
+    # prefixes inserted at a time in the probes table, this bounds the memory used
+    # to insert the probe counts, whatever the size of the target list
+    WORKER_PROBE_COUNTS_BATCH_SIZE: int = 100_000
+
+    # weight of the users in the agent queues (user id -> weight, default 1),
+    # a user of weight 2 gets twice as many rounds as a user of weight 1
+    WORKER_USER_WEIGHTS: dict[str, float] = {}
@@ -1,7 +1,28 @@
-from collections.abc import Iterable
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from ipaddress import IPv6Address
+from mmap import ACCESS_READ, mmap
+from pathlib import Path
+from socket import AF_INET, AF_INET6, inet_ntop, inet_pton
 
 from pytricia import PyTricia
 
+INDEX_MAGIC = b"IRISTIDX"
+INDEX_HEADER = len(INDEX_MAGIC) + 4
+INDEX_COLUMNS = (
+    ("fold", "Q"),
+    ("hi", "Q"),
+    ("lo", "Q"),
+    ("length", "B"),
+    ("protocol", "B"),
+    ("min_ttl", "B"),
+    ("max_ttl", "B"),
+    ("n_initial_flows", "I"),
+)
+
 
 def load_targets(
     target_list: Iterable[str], clamp_ttl_min=0, clamp_ttl_max=255
@@ -35,3 +56,282 @@ def load_targets(
         else:
             tree[prefix] = [(protocol, ttls, int(n_initial_flows))]
     return tree
+
+
+@dataclass
+class TargetIndex:
+    """
+    Compiled, memory-mapped, target list.
+    The targets are stored in columns sorted by prefix, so that the index is
+    compiled once per measurement and then opened without parsing.
+    Columns: network (as two 64-bit halves of the IPv6, or IPv4-mapped, address),
+    prefix length (in IPv6 bits), protocol code, min/max TTLs and number of flows.
+    The targets are sorted by `fold_network` first, a column that can be searched
+    with `bisect` directly.
+
+    >>> import tempfile
+    >>> path = Path(tempfile.mkdtemp()) / "targets.csv"
+    >>> _ = path.write_text("8.8.8.0/24,icmp,11,12,6\\n8.8.8.0/24,icmp,14,20,6\\n")
+    >>> with TargetIndex.open(path) as targets:
+    ...     targets.lookup("8.8.8.1", clamp_ttl_min=11, clamp_ttl_max=16)
+    [('icmp', range(11, 13), 6), ('icmp', range(14, 17), 6)]
+    >>> with TargetIndex.open(path) as targets:
+    ...     targets.lookup("8.8.4.0")
+    Traceback (most recent call last):
+        ...
+    KeyError: 'Prefix not found.'
+    """
+
+    header: dict
+    buffer: mmap | None = None
+    columns: dict[str, memoryview] = field(default_factory=dict)
+    # Prefix lengths of the targets, and their masks, longest first.
+    masks: list[tuple[int, int]] = field(default_factory=list)
+
+    @classmethod
+    def open(cls, targets_filepath: Path) -> "TargetIndex":
+        """Open the index of the target list, compiling it if needed."""
+        index_filepath = target_index_path(targets_filepath)
+        if not index_filepath.exists():
+            with targets_filepath.open() as f:
+                compile_targets(f, index_filepath)
+        with index_filepath.open("rb") as f:
+            buffer = mmap(f.fileno(), 0, access=ACCESS_READ)
+        header_size = int.from_bytes(buffer[len(INDEX_MAGIC) : INDEX_HEADER], "little")
+        header = json.loads(bytes(buffer[INDEX_HEADER : INDEX_HEADER + header_size]))
+        index = cls(
+            header,
+            buffer,
+            masks=[(length, prefix_mask(length)) for length in header["lengths"]],
+        )
+        offset = INDEX_HEADER + header_size
+        view = memoryview(buffer)
+        for name, typecode in INDEX_COLUMNS:
+            offset += -offset % 8
+            size = array(typecode).itemsize * header["count"]
+            index.columns[name] = view[offset : offset + size].cast(typecode)
+            offset += size
+        view.release()
+        return index
+
+    def close(self) -> None:
+        for column in self.columns.values():
+            column.release()
+        self.columns.clear()
+        if self.buffer:
+            self.buffer.close()
+            self.buffer = None
+
+    def __enter__(self) -> "TargetIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    def entries(
+        self, clamp_ttl_min: int = 0, clamp_ttl_max: int = 255
+    ) -> Iterator[tuple[str, str, range, int]]:
+        """Yield the (prefix, protocol, ttls, n_initial_flows) of every target."""
+        c = self.columns
+        protocols = self.header["protocols"]
+        for hi, lo, length, protocol, min_ttl, max_ttl, n_initial_flows in zip(
+            c["hi"],
+            c["lo"],
+            c["length"],
+            c["protocol"],
+            c["min_ttl"],
+            c["max_ttl"],
+            c["n_initial_flows"],
+        ):
+            yield (
+                format_prefix(hi << 64 | lo, length),
+                protocols[protocol],
+                range(max(clamp_ttl_min, min_ttl), min(clamp_ttl_max, max_ttl) + 1),
+                n_initial_flows,
+            )
+
+    def lookup(
+        self, prefix: str, clamp_ttl_min: int = 0, clamp_ttl_max: int = 255
+    ) -> list[tuple[str, range, int]]:
+        """
+        Return the (protocol, ttls, n_initial_flows) of the longest target prefix
+        containing `prefix`, as `load_targets(...)[prefix]`.
+        """
+        return self.lookup_network(
+            *parse_prefix(prefix),
+            clamp_ttl_min=clamp_ttl_min,
+            clamp_ttl_max=clamp_ttl_max,
+        )
+
+    def lookup_network(
+        self,
+        network: int,
+        length: int,
+        clamp_ttl_min: int = 0,
+        clamp_ttl_max: int = 255,
+    ) -> list[tuple[str, range, int]]:
+        """Same as `lookup`, for a prefix returned by `parse_prefix`."""
+        c = self.columns
+        folds = c["fold"]
+        for target_length, mask in self.masks:
+            if target_length > length:
+                continue
+            target = network & mask
+            key = (target >> 64, target & (2**64 - 1), target_length)
+            fold = key[0] if key[0] else key[1]
+            i = bisect_left(folds, fold)
+            if i < len(folds) and folds[i] == fold and self.key(i) < key:
+                # Search the targets with the same fold, usually a few, by full key.
+                i = bisect_left(
+                    range(len(folds)),
+                    key,
+                    lo=i,
+                    hi=bisect_right(folds, fold, lo=i),
+                    key=self.key,
+                )
+            targets = []
+            while i < len(folds) and folds[i] == fold and self.key(i) == key:
+                targets.append(self.target(i, clamp_ttl_min, clamp_ttl_max))
+                i += 1
+            if targets:
+                return targets
+        raise KeyError("Prefix not found.")
+
+    def key(self, i: int) -> tuple[int, int, int]:
+        c = self.columns
+        return c["hi"][i], c["lo"][i], c["length"][i]
+
+    def target(
+        self, i: int, clamp_ttl_min: int, clamp_ttl_max: int
+    ) -> tuple[str, range, int]:
+        c = self.columns
+        return (
+            self.header["protocols"][c["protocol"][i]],
+            range(
+                max(clamp_ttl_min, c["min_ttl"][i]),
+                min(clamp_ttl_max, c["max_ttl"][i]) + 1,
+            ),
+            c["n_initial_flows"][i],
+        )
+
+
+def target_index_path(targets_filepath: Path) -> Path:
+    return targets_filepath.with_name(f"{targets_filepath.name}.index")
+
+
+def compile_targets(target_list: Iterable[str], index_filepath: Path) -> int:
+    """
+    Compile a target list, in the format of `load_targets`, into an index file.
+    The targets are parsed directly into the columns, about 40 bytes per target,
+    and only sorted if the target list is not already sorted.
+
+    :returns: The number of targets.
+    """
+    protocols: dict[str, int] = {}
+    lengths: set[int] = set()
+    columns = {name: array(typecode) for name, typecode in INDEX_COLUMNS}
+    last_key = (0, 0, 0)
+    is_sorted = True
+    for line in target_list:
+        if not line.strip():
+            continue
+        prefix, protocol, min_ttl, max_ttl, n_initial_flows = line.split(",")
+        network, length = parse_prefix(prefix)
+        key = (fold_network(network), network, length)
+        is_sorted = is_sorted and key >= last_key
+        last_key = key
+        lengths.add(length)
+        for name, value in zip(
+            columns,
+            (
+                key[0],
+                network >> 64,
+                network & (2**64 - 1),
+                length,
+                protocols.setdefault(protocol, len(protocols)),
+                int(min_ttl),
+                int(max_ttl),
+                int(n_initial_flows),
+            ),
+        ):
+            columns[name].append(value)
+    count = len(columns["fold"])
+    if not is_sorted:
+        # Keep the order of the lines for the targets of a same prefix.
+        def sort_key(i: int) -> int:
+            # A single integer takes less memory than a tuple.
+            return (
+                columns["fold"][i] << 136
+                | columns["hi"][i] << 72
+                | columns["lo"][i] << 8
+                | columns["length"][i]
+            )
+
+        order = sorted(range(count), key=sort_key)
+        for name, typecode in INDEX_COLUMNS:
+            columns[name] = array(typecode, (columns[name][i] for i in order))
+        del order
+    header = json.dumps(
+        dict(
+            count=count,
+            protocols=list(protocols),
+            # Longest prefixes first, for the longest prefix match.
+            lengths=sorted(lengths, reverse=True),
+        )
+    ).encode()
+    # Write to a temporary file first, so that a partial index is never opened.
+    partial_filepath = index_filepath.with_name(f"{index_filepath.name}.partial")
+    with partial_filepath.open("wb") as f:
+        f.write(INDEX_MAGIC + len(header).to_bytes(4, "little") + header)
+        for column in columns.values():
+            f.write(b"\0" * (-f.tell() % 8))
+            column.tofile(f)
+    partial_filepath.rename(index_filepath)
+    return count
+
+
+def parse_prefix(prefix: str) -> tuple[int, int]:
+    """
+    Return the network and the length, in IPv6 bits, of a prefix or an address.
+    >>> parse_prefix("8.8.8.1/24")
+    (281470816487424, 120)
+    >>> parse_prefix("2001:db8::1")
+    (42540766411282592856903984951653826561, 128)
+    """
+    addr, _, length = prefix.partition("/")
+    if ":" in addr:
+        network = int.from_bytes(inet_pton(AF_INET6, addr), "big")
+        length_ = int(length) if length else 128
+    else:
+        network = 0xFFFF << 32 | int.from_bytes(inet_pton(AF_INET, addr), "big")
+        length_ = 96 + int(length) if length else 128
+    return network & prefix_mask(length_), length_
+
+
+def format_prefix(network: int, length: int) -> str:
+    """
+    >>> format_prefix(*parse_prefix("8.8.8.0/24"))
+    '8.8.8.0/24'
+    >>> format_prefix(*parse_prefix("2001:db8::/32"))
+    '2001:db8::/32'
+    """
+    if network >> 32 == 0xFFFF and length >= 96:
+        addr = inet_ntop(AF_INET, (network & 0xFFFFFFFF).to_bytes(4, "big"))
+        return f"{addr}/{length - 96}"
+    return f"{IPv6Address(network)}/{length}"
+
+
+def fold_network(network: int) -> int:
+    """
+    The most significant 64 bits which vary between prefixes:
+    the low bits if the high bits are zero, as for IPv4-mapped addresses,
+    the high bits otherwise.
+    """
+    return network >> 64 or network & (2**64 - 1)
+
+
+def prefix_mask(length: int) -> int:
+    return (2**128 - 1) ^ (2 ** (128 - length) - 1)
@@ -1,6 +1,7 @@
 import asyncio
 import shutil
 from datetime import datetime
+from time import monotonic
 
 import dramatiq
 from sqlmodel import Session
@@ -11,11 +12,13 @@ from iris.commons.dependencies import (
     get_redis_context,
     get_session_context,
 )
+from iris.commons.instrumentation import record_stages
 from iris.commons.logger import Adapter, base_logger
 from iris.commons.models import (
     MeasurementAgent,
     MeasurementAgentState,
     MeasurementRoundRequest,
+    Round,
 )
 from iris.commons.redis import Redis
 from iris.commons.storage import Storage
@@ -45,20 +48,20 @@ async def watch_measurement_agent_(
         ),
     )
     clickhouse = ClickHouse(settings, logger)
-    storage = Storage(settings, logger)
-    async with get_redis_context(settings, logger) as redis:
-        with get_engine_context(settings) as engine:
-            with get_session_context(engine) as session:
-                await watch_measurement_agent_with_deps(
-                    measurement_uuid,
-                    agent_uuid,
-                    clickhouse,
-                    logger,
-                    redis,
-                    settings,
-                    session,
-                    storage,
-                )
+    async with Storage.open(settings, logger) as storage:
+        async with get_redis_context(settings, logger) as redis:
+            with get_engine_context(settings) as engine:
+                with get_session_context(engine) as session:
+                    await watch_measurement_agent_with_deps(
+                        measurement_uuid,
+                        agent_uuid,
+                        clickhouse,
+                        logger,
+                        redis,
+                        settings,
+                        session,
+                        storage,
+                    )
 
 
 async def watch_measurement_agent_with_deps(
@@ -88,6 +91,7 @@ async def watch_measurement_agent_with_deps(
         storage.measurement_agent_bucket(measurement_uuid, agent_uuid)
     )
 
+    last_poll = 0.0
     while True:
         # 1. Ensure that the MeasurementAgent instance is up-to-date.
         session.refresh(ma)
@@ -119,12 +123,21 @@ async def watch_measurement_agent_with_deps(
         if ma.state == MeasurementAgentState.Created:
             ma.set_state(session, MeasurementAgentState.Ongoing)
             ma.set_start_time(session, datetime.utcnow())
-        # 4.b. Otherwise, check if a results file is available on S3.
+        # 4.b. Otherwise, wait for the agent to notify that a results file is
+        # available on S3, and check it periodically in case a notification is lost.
         elif ma.state == MeasurementAgentState.Ongoing:
-            results_filename = await find_results(storage, measurement_uuid, agent_uuid)
+            notified = await redis.wait_results(
+                measurement_uuid, agent_uuid, settings.WORKER_WATCH_INTERVAL
+            )
+            if notified or (
+                monotonic() - last_poll >= settings.WORKER_RESULTS_POLL_INTERVAL
+            ):
+                last_poll = monotonic()
+                results_filename = await find_results(
+                    storage, measurement_uuid, agent_uuid
+                )
             if not results_filename:
                 # 4.b.1. If the results file is not present, try again later.
-                await asyncio.sleep(settings.WORKER_WATCH_INTERVAL)
                 continue
 
         if probing_statistics := await redis.get_measurement_stats(
@@ -135,36 +148,80 @@ async def watch_measurement_agent_with_deps(
 
         # TODO: Create a null tool that does nothing that would allow to test the full pipeline.
         # This tool would generate 3 dummy rounds.
-        result = await outer_pipeline(
-            clickhouse=clickhouse,
-            storage=storage,
-            redis=redis,
-            logger=logger,
-            measurement_uuid=measurement_uuid,
-            agent_uuid=agent_uuid,
-            measurement_tags=ma.measurement.tags,
-            sliding_window_size=settings.WORKER_ROUND_1_SLIDING_WINDOW,
-            sliding_window_stopping_condition=settings.WORKER_ROUND_1_STOPPING,
-            tool=ma.measurement.tool,
-            tool_parameters=ma.tool_parameters,
-            working_directory=working_directory,
-            targets_key=ma.target_file,
-            results_key=results_filename,
-            user_id=ma.measurement.user_id,
-            max_open_files=settings.WORKER_MAX_OPEN_FILES,
+        with record_stages() as stages:
+            results = await outer_pipeline(
+                clickhouse=clickhouse,
+                storage=storage,
+                redis=redis,
+                logger=logger,
+                measurement_uuid=measurement_uuid,
+                agent_uuid=agent_uuid,
+                measurement_tags=ma.measurement.tags,
+                sliding_window_size=settings.WORKER_ROUND_1_SLIDING_WINDOW,
+                sliding_window_stopping_condition=settings.WORKER_ROUND_1_STOPPING,
+                tool=ma.measurement.tool,
+                tool_parameters=ma.tool_parameters,
+                working_directory=working_directory,
+                targets_key=ma.target_file,
+                results_key=results_filename,
+                user_id=ma.measurement.user_id,
+                max_open_files=settings.WORKER_MAX_OPEN_FILES,
+                round_1_pipelining=settings.WORKER_ROUND_1_PIPELINING,
+                probe_counts_batch_size=settings.WORKER_PROBE_COUNTS_BATCH_SIZE,
+            )
+        ma.append_worker_statistics(
+            session,
+            Round.decode(results_filename) if results_filename else None,
+            stages,
         )
 
-        if not result:
+        if results is None:
             ma.set_state(session, MeasurementAgentState.Finished)
             break
 
-        agent_queue_ok = await is_agent_queue_clear(
-            redis=redis,
-            measurement_uuid=measurement_uuid,
-            agent_uuid=agent_uuid,
-            trials=settings.WORKER_SANITY_CHECK_RETRIES,
-            interval=settings.WORKER_SANITY_CHECK_INTERVAL,
-        )
+        agent_queue_ok = True
+        for result in results:
+            if settings.WORKER_ROUND_1_PIPELINING:
+                # The agent may still be probing the window sent ahead.
+                agent_queue_ok = await wait_agent_queue_clear(
+                    redis=redis,
+                    measurement_uuid=measurement_uuid,
+                    agent_uuid=agent_uuid,
+                    trials=settings.WORKER_SANITY_CHECK_RETRIES,
+                    interval=settings.WORKER_SANITY_CHECK_INTERVAL,
+                )
+            else:
+                agent_queue_ok = await is_agent_queue_clear(
+                    redis=redis,
+                    measurement_uuid=measurement_uuid,
+                    agent_uuid=agent_uuid,
+                    trials=settings.WORKER_SANITY_CHECK_RETRIES,
+                    interval=settings.WORKER_SANITY_CHECK_INTERVAL,
+                )
+            if not agent_queue_ok:
+                break
+
+            # The measurement may have been canceled while waiting for the agent.
+            session.refresh(ma)
+            if ma.state != MeasurementAgentState.Ongoing:
+                break
+
+            await redis.set_request(
+                agent_uuid,
+                MeasurementRoundRequest(
+                    measurement_uuid=ma.measurement_uuid,
+                    probe_filename=result.probes_key,
+                    probing_rate=ma.probing_rate,
+                    batch_size=ma.batch_size,
+                    round=result.next_round,
+                    user_id=ma.measurement.user_id,
+                    priority=ma.measurement.priority,
+                    weight=settings.WORKER_USER_WEIGHTS.get(
+                        ma.measurement.user_id, 1.0
+                    ),
+                    enqueue_time=datetime.utcnow(),
+                ),
+            )
 
         if not agent_queue_ok:
             ma.set_state(session, MeasurementAgentState.AgentFailure)
@@ -172,22 +229,13 @@ async def watch_measurement_agent_with_deps(
             await clean_agent_queue(redis, measurement_uuid, agent_uuid)
             break
 
-        await redis.set_request(
-            agent_uuid,
-            MeasurementRoundRequest(
-                measurement_uuid=ma.measurement_uuid,
-                probe_filename=result.probes_key,
-                probing_rate=ma.probing_rate,
-                batch_size=ma.batch_size,
-                round=result.next_round,
-            ),
-        )
-
     logger.info("Done watching measurement agent in state %s, cleaning...", ma.state)
 
     if not ma.end_time:
         ma.set_end_time(session, datetime.utcnow())
 
+    await redis.delete_results_notifications(measurement_uuid, agent_uuid)
+    await redis.delete_sent_rounds(measurement_uuid, agent_uuid)
     await storage.delete_bucket_with_files(
         storage.measurement_agent_bucket(measurement_uuid, agent_uuid)
     )
@@ -205,7 +253,8 @@ async def check_agent(
         return False
 
 
-async def clean_agent_queue(redis: Redis, measurement_uuid: str, agent_uuid: str
+async def clean_agent_queue(
+    redis: Redis, measurement_uuid: str, agent_uuid: str
 ) -> None:
     round_requests = await redis.get_requests(agent_uuid)
     if measurement_uuid in round_requests:
@@ -216,10 +265,8 @@ async def find_results(
     storage: Storage, measurement_uuid: str, agent_uuid: str
 ) -> str | None:
     bucket = storage.measurement_agent_bucket(measurement_uuid, agent_uuid)
-    files = await storage.get_all_files(bucket)
-    for file in files:
-        if file["key"].startswith("results_"):
-            return str(file["key"])
+    if keys := await storage.get_keys(bucket, prefix="results_"):
+        return keys[0]
     return None
 
 
@@ -232,3 +279,14 @@ async def is_agent_queue_clear(
             return True
         await asyncio.sleep(interval)
     return False
+
+
+async def wait_agent_queue_clear(
+    redis: Redis, measurement_uuid: str, agent_uuid: str, trials: int, interval: float
+) -> bool:
+    """Wait for the agent to consume the measurement request, as long as it is alive."""
+    while measurement_uuid in await redis.get_requests(agent_uuid):
+        if not await check_agent(redis, agent_uuid, trials, interval):
+            return False
+        await asyncio.sleep(interval)
+    return True
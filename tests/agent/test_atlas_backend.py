@@ -1,13 +1,23 @@
+import asyncio
+import json
+import re
+from collections import defaultdict
+from io import BytesIO
+
 import pytest
-from httpx import AsyncClient
+from httpx import AsyncClient, MockTransport, Request, Response
 
 from iris.agent.backend.atlas import (
     ATLAS_BASE_URL,
+    create_measurement_groups,
+    fetch_measurements_results,
     get_measurement_group_members,
     get_measurement_group_results,
     get_measurement_group_status,
     get_measurement_results,
     get_measurement_status,
+    make_definition,
+    watch_measurements,
 )
 
 MEASUREMENT_ID = 41808650
@@ -51,3 +61,86 @@ async def test_get_measurement_status(atlas_client):
 async def test_get_measurement_group_status(atlas_client):
     status = await get_measurement_group_status(atlas_client, MEASUREMENT_ID)
     assert status == ["Stopped", "Stopped", "Stopped", "Stopped", "Stopped", "Stopped"]
+
+
+class FakeAtlas:
+    """Stand-in of the RIPE Atlas API, rate-limiting the first request of a URL."""
+
+    def __init__(self):
+        self.measurements = {}
+        self.polls = defaultdict(int)
+        self.requests = set()
+        self.creations = []
+
+    def handle(self, request: Request) -> Response:
+        path = request.url.path.removeprefix("/api/v2")
+        if (request.method, path) not in self.requests:
+            self.requests.add((request.method, path))
+            return Response(429, headers={"Retry-After": "0"})
+        if request.method == "POST" and path == "/measurements":
+            definitions = json.loads(request.content)["definitions"]
+            self.creations.append(len(definitions))
+            ids = [len(self.measurements) + i for i in range(len(definitions))]
+            self.measurements |= {id_: definitions[i] for i, id_ in enumerate(ids)}
+            return Response(201, json=dict(measurements=ids))
+        if match := re.fullmatch(r"/measurements/(\d+)", path):
+            id_ = int(match[1])
+            self.polls[id_] += 1
+            status = "Stopped" if self.polls[id_] > 1 else "Ongoing"
+            return Response(200, json=dict(status=dict(name=status)))
+        if match := re.fullmatch(r"/measurements/(\d+)/results", path):
+            definition = self.measurements[int(match[1])]
+            result = dict(
+                msm_id=int(match[1]),
+                timestamp=0,
+                proto=definition["protocol"],
+                src_addr="192.0.2.254",
+                dst_addr=definition["target"],
+                paris_id=1,
+                result=[
+                    dict(
+                        hop=1,
+                        result=[
+                            dict(ttl=64, size=28, rtt=1.0, **{"from": "192.0.2.253"})
+                        ],
+                    )
+                ],
+            )
+            return Response(200, text=json.dumps(result) + "\n")
+        return Response(404)
+
+
+async def test_atlas_stand_in(logger):
+    atlas = FakeAtlas()
+    definitions = [
+        make_definition("uuid", f"192.0.2.{i}", "icmp", 1, 32, 1) for i in range(250)
+    ]
+    async with AsyncClient(
+        base_url=ATLAS_BASE_URL, transport=MockTransport(atlas.handle)
+    ) as client:
+        groups = await create_measurement_groups(
+            client, definitions, chunk_size=100, concurrency=4
+        )
+        assert sorted(atlas.creations) == [50, 100, 100]
+        assert sorted(x for group in groups for x in group) == list(range(250))
+
+        stopped = await watch_measurements(
+            client,
+            logger,
+            None,
+            "uuid",
+            "agent",
+            groups,
+            refresh_interval=0,
+            concurrency=4,
+            cancelled=asyncio.Event(),
+        )
+        assert not stopped
+        # The stopped measurements are not polled again.
+        assert set(atlas.polls.values()) == {2}
+
+        writer = BytesIO()
+        await fetch_measurements_results(
+            client, list(range(250)), 1, writer, concurrency=4
+        )
+        assert len(writer.getvalue().splitlines()) == 250
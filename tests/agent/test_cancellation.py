@@ -0,0 +1,55 @@
+import asyncio
+from uuid import uuid4
+
+from iris.agent.cancellation import CancellationListener
+from iris.commons.models import MeasurementRoundRequest, Round
+from iris.commons.redis import agent_queue_key
+
+
+def make_request():
+    return MeasurementRoundRequest(
+        measurement_uuid=str(uuid4()),
+        probe_filename="request",
+        round=Round(number=1, limit=10, offset=0),
+    )
+
+
+async def test_cancellation_listener(redis, logger):
+    agent_uuid = str(uuid4())
+    request_1, request_2 = make_request(), make_request()
+    await redis.set_request(agent_uuid, request_1)
+    await redis.set_request(agent_uuid, request_2)
+
+    listener = CancellationListener(redis, logger, agent_uuid, check_interval=60)
+    task = asyncio.create_task(listener.run())
+    await asyncio.sleep(0.1)  # Wait for the subscription.
+    try:
+        async with listener.watch(request_1.measurement_uuid) as cancelled_1:
+            async with listener.watch(request_2.measurement_uuid) as cancelled_2:
+                await redis.delete_request(request_1.measurement_uuid, agent_uuid)
+                await asyncio.wait_for(cancelled_1.wait(), 1)
+                assert not cancelled_2.is_set()
+    finally:
+        task.cancel()
+
+
+async def test_cancellation_listener_deleted(redis, logger):
+    agent_uuid = str(uuid4())
+    listener = CancellationListener(redis, logger, agent_uuid)
+    async with listener.watch(str(uuid4())) as cancelled:
+        assert cancelled.is_set()
+
+
+async def test_cancellation_listener_check(redis, logger):
+    agent_uuid = str(uuid4())
+    request = make_request()
+    await redis.set_request(agent_uuid, request)
+    listener = CancellationListener(redis, logger, agent_uuid, check_interval=0.1)
+    task = asyncio.create_task(listener.check())
+    try:
+        async with listener.watch(request.measurement_uuid) as cancelled:
+            # Delete the request without notifying the agent.
+            await redis.hdel(agent_queue_key(agent_uuid), request.measurement_uuid)
+            await asyncio.wait_for(cancelled.wait(), 1)
+    finally:
+        task.cancel()
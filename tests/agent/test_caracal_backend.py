@@ -1,7 +1,81 @@
-from iris.agent.backend.caracal import probe
+import asyncio
+import os
+import time
+from asyncio.subprocess import PIPE, create_subprocess_exec
+
+import zstandard
+
+from iris.agent.backend.caracal import (
+    probe,
+    probe_sharded,
+    publish_statistics,
+    read_lines,
+    read_statistics,
+    write_sharded,
+    write_throttled,
+)
 from tests.helpers import superuser
 
 
+async def test_read_statistics(logger):
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"[info] probes_read=2 packets_sent=1 (50.00%)\n")
+    reader.feed_data(b"[info] starting sniffer\n")
+    reader.feed_data(b"[info] packets_received=1 pcap_dropped=0\n")
+    reader.feed_eof()
+    statistics = {"probes_read": 0, "packets_sent": 0, "packets_received": 0}
+    await read_statistics(reader, logger, statistics)
+    assert statistics == {
+        "probes_read": 2,
+        "packets_sent": 1,
+        "packets_received": 1,
+        "pcap_dropped": 0,
+    }
+
+
+async def test_publish_statistics(logger):
+    published = []
+
+    async def on_progress(statistics, elapsed):
+        published.append((statistics, elapsed))
+
+    statistics = {"packets_sent": 1}
+    task = asyncio.create_task(publish_statistics(logger, statistics, on_progress, 0.1))
+    await asyncio.sleep(0.35)
+    task.cancel()
+    assert len(published) == 3
+    assert all(s == statistics and e > 0 for s, e in published)
+
+
+async def test_write_throttled():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"".join(b"%d\n" % i for i in range(40)))
+    reader.feed_eof()
+    process = await create_subprocess_exec("cat", stdin=PIPE, stdout=PIPE)
+    start = time.monotonic()
+    await write_throttled(reader, process.stdin, lambda: 100, interval=0.05)
+    stdout, _ = await process.communicate()
+    assert stdout.splitlines() == [b"%d" % i for i in range(40)]
+    assert time.monotonic() - start >= 0.3
+
+
+async def test_read_lines_throttled():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"".join(b"%d\n" % i for i in range(1000)) + b"last")
+    reader.feed_eof()
+    # The lines are read by chunks, not one by one.
+    reader.readline = None
+    batches = [
+        lines async for lines in read_lines(reader, lambda: 10_000, 0.01, chunk_size=64)
+    ]
+    assert (
+        b"".join(line for lines in batches for line in lines)
+        == b"".join(b"%d\n" % i for i in range(1000)) + b"last"
+    )
+    # At most two intervals worth of lines per batch.
+    assert max(len(lines) for lines in batches) <= 200
+
+
 @superuser
 async def test_probe(agent_settings, logger, tmp_path):
     excluded_filepath = tmp_path / "excluded.csv"
@@ -25,3 +99,89 @@ async def test_probe(agent_settings, logger, tmp_path):
     assert "packets_sent" in prober_statistics
     # assert prober_statistics["packets_sent"] == 1
     # assert prober_statistics["filtered_prefix_excl"] == 1
+
+
+@superuser
+async def test_probe_stream(agent_settings, logger, tmp_path):
+    probes = zstandard.compress(b"8.8.8.8,24000,33434,32,icmp\n")
+    results = []
+
+    async def probes_stream():
+        yield probes
+
+    async def results_stream(chunks):
+        async for chunk in chunks:
+            results.append(chunk)
+
+    prober_statistics = await probe(
+        agent_settings,
+        logger,
+        tmp_path / "probes.csv.zst",
+        tmp_path / "results.csv.zst",
+        1,
+        None,
+        100,
+        probes_stream=probes_stream(),
+        results_stream=results_stream,
+    )
+    assert "packets_sent" in prober_statistics
+    assert not (tmp_path / "results.csv.zst").exists()
+
+
+async def test_write_sharded():
+    reader = asyncio.StreamReader()
+    reader.feed_data(
+        b"".join(b"10.0.0.%d,24000,33434,%d,icmp\n" % (i, i) for i in range(64))
+    )
+    reader.feed_eof()
+    processes = [
+        await create_subprocess_exec("cat", stdin=PIPE, stdout=PIPE) for _ in range(3)
+    ]
+    await write_sharded(reader, [p.stdin for p in processes])
+    shards = [(await p.communicate())[0].splitlines() for p in processes]
+    assert sorted(line for shard in shards for line in shard) == sorted(
+        b"10.0.0.%d,24000,33434,%d,icmp" % (i, i) for i in range(64)
+    )
+    # The probes towards a destination are in a single shard.
+    destinations = [{line.split(b",")[0] for line in shard} for shard in shards]
+    assert sum(len(d) for d in destinations) == len(set().union(*destinations))
+
+
+async def test_probe_sharded(agent_settings, logger, tmp_path, monkeypatch):
+    # Replace caracal by a script which echoes the probes after a header,
+    # and reports the number of probes read, and its arguments.
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    (bin_path / "caracal").write_text(
+        "#!/bin/sh\n"
+        'echo "$@" >> "$(dirname "$0")/args"\n'
+        "echo capture_timestamp,probe_dst_addr\n"
+        "n=0\n"
+        'while read -r line; do echo "$line"; n=$((n+1)); done\n'
+        'echo "[info] probes_read=$n packets_sent=$n" >&2\n'
+    )
+    (bin_path / "caracal").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_path}:{os.environ['PATH']}")
+
+    probes = [f"10.0.{i}.1,24000,33434,{i % 32 + 1},icmp" for i in range(100)]
+    probes_filepath = tmp_path / "probes.csv"
+    probes_filepath.write_text("\n".join(probes) + "\n")
+    results_filepath = tmp_path / "results.csv"
+    agent_settings.AGENT_CARACAL_SHARDS = 3
+    agent_settings.AGENT_CARACAL_SHARD_INTERFACES = ["eth0", "eth1"]
+
+    statistics = await probe_sharded(
+        agent_settings, logger, probes_filepath, results_filepath, 1, None, 300
+    )
+    assert statistics["probes_read"] == 100
+    assert statistics["packets_sent"] == 100
+
+    lines = results_filepath.read_text().splitlines()
+    assert lines[0] == "capture_timestamp,probe_dst_addr"
+    assert sorted(lines[1:]) == sorted(probes)
+
+    args = sorted((bin_path / "args").read_text().splitlines())
+    assert len(args) == 3
+    assert all("--probing-rate 100" in a for a in args)
+    assert sum("--interface eth0" in a for a in args) == 2
+    assert sum("--interface eth1" in a for a in args) == 1
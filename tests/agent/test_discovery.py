@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+from ipaddress import IPv4Address, IPv6Address
+
+from iris.agent.discovery import Discovery, DiscoveryCache
+
+
+async def test_discovery_cache(agent_settings, logger, tmp_path, monkeypatch):
+    agent_settings.AGENT_DISCOVERY_CACHE_PATH = tmp_path / "discovery.json"
+    discoveries = DiscoveryCache(agent_settings, logger, find_exit_ttl=True)
+    discovered = []
+
+    async def discover():
+        discovered.append(True)
+        return Discovery(
+            external_ipv4_address=IPv4Address("192.0.2.1"),
+            external_ipv6_address=(
+                IPv6Address("2001:db8::1") if len(discovered) < 2 else None
+            ),
+            min_ttl=len(discovered) + 1 if len(discovered) < 2 else None,
+            min_ttl_target=agent_settings.AGENT_MIN_TTL_FIND_TARGET,
+            update_time=datetime.utcnow(),
+        )
+
+    monkeypatch.setattr(discoveries, "discover", discover)
+
+    # Nothing is cached: discover now.
+    discovery = await discoveries.get()
+    assert discovery.min_ttl == 2
+    assert len(discovered) == 1
+    assert 0 < discoveries.expires_in(discovery)
+
+    # The cached discovery is used, even if expired.
+    discovery.update_time -= timedelta(days=365)
+    discoveries.save(discovery)
+    assert await discoveries.get() == discovery
+    assert len(discovered) == 1
+    assert discoveries.expires_in(discovery) < 0
+
+    # The previous address and exit TTL are kept if they cannot be found.
+    discovery = await discoveries.refresh(discovery)
+    assert discovery.external_ipv6_address == IPv6Address("2001:db8::1")
+    assert discovery.min_ttl == 2
+    assert discoveries.load() == discovery
+
+    # The cache is not used if the exit TTL target changed.
+    agent_settings.AGENT_MIN_TTL_FIND_TARGET = "example.net"
+    await discoveries.get()
+    assert len(discovered) == 3
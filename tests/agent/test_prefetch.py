@@ -0,0 +1,55 @@
+from uuid import uuid4
+
+from iris.agent.prefetch import Prefetcher
+from iris.commons.models import MeasurementRoundRequest, Round
+from tests.helpers import upload_file
+
+
+async def make_request(storage, agent_settings, make_tmp_file):
+    request = MeasurementRoundRequest(
+        measurement_uuid=str(uuid4()),
+        probe_filename="probes.csv.zst",
+        round=Round(number=1, limit=10, offset=0),
+    )
+    bucket = storage.measurement_agent_bucket(
+        request.measurement_uuid, agent_settings.AGENT_UUID
+    )
+    await storage.create_bucket(bucket)
+    await upload_file(storage, bucket, make_tmp_file(request.probe_filename))
+    return request
+
+
+async def test_prefetch(agent_settings, logger, redis, storage, make_tmp_file):
+    request = await make_request(storage, agent_settings, make_tmp_file)
+    await redis.set_request(agent_settings.AGENT_UUID, request)
+    path = (
+        agent_settings.AGENT_TARGETS_DIR_PATH
+        / request.measurement_uuid
+        / request.probe_filename
+    )
+
+    prefetcher = Prefetcher(agent_settings, logger, redis, storage)
+    await prefetcher.prefetch()
+    assert path.exists()
+    assert request.measurement_uuid in prefetcher.prefetched
+
+    # The files of the deleted requests are removed.
+    await redis.delete_request(request.measurement_uuid, agent_settings.AGENT_UUID)
+    await prefetcher.prefetch()
+    assert not path.exists()
+    assert not prefetcher.prefetched
+
+
+async def test_prefetch_max_size(agent_settings, logger, redis, storage, make_tmp_file):
+    agent_settings.AGENT_PREFETCH_MAX_SIZE = 1
+    request = await make_request(storage, agent_settings, make_tmp_file)
+    await redis.set_request(agent_settings.AGENT_UUID, request)
+
+    prefetcher = Prefetcher(agent_settings, logger, redis, storage)
+    await prefetcher.prefetch()
+    assert not prefetcher.prefetched
+    assert not (
+        agent_settings.AGENT_TARGETS_DIR_PATH
+        / request.measurement_uuid
+        / request.probe_filename
+    ).exists()
@@ -0,0 +1,70 @@
+import errno
+import os
+from datetime import datetime
+from pathlib import Path
+
+from iris.agent.spool import ResultsSpool
+from iris.commons.models import MeasurementRoundRequest, ProbingStatistics, Round
+from iris.commons.storage import results_key
+
+
+def make_round():
+    request = MeasurementRoundRequest(
+        measurement_uuid="uuid",
+        probe_filename="probes.csv.zst",
+        round=Round(number=1, limit=10, offset=0),
+    )
+    statistics = ProbingStatistics(
+        round=request.round,
+        start_time=datetime(2022, 1, 1),
+        end_time=datetime(2022, 1, 2),
+        **{
+            key: 0
+            for key in ProbingStatistics.model_fields
+            if key not in ("round", "start_time", "end_time")
+        },
+    )
+    return request, statistics
+
+
+def test_results_spool(tmp_path):
+    request, statistics = make_round()
+    results_filepath = tmp_path / results_key(request.round)
+    results_filepath.write_text("results")
+
+    spool = ResultsSpool(tmp_path / "spool")
+    entry = spool.add(request, statistics, results_filepath)
+    assert not results_filepath.exists()
+    assert spool.results_filepath(entry).read_text() == "results"
+
+    entry.upload["upload_id"] = "upload"
+    spool.save(entry)
+    assert spool.entries() == [entry]
+
+    # Incomplete entries, without manifest, are removed.
+    (tmp_path / "spool" / "incomplete").mkdir()
+    assert spool.entries() == [entry]
+    assert not (tmp_path / "spool" / "incomplete").exists()
+
+    spool.remove(entry)
+    assert spool.entries() == []
+
+
+def test_results_spool_other_filesystem(tmp_path, monkeypatch):
+    os_rename = os.rename
+
+    def rename(src, dst, **kwargs):
+        # The spool is on another filesystem than the results directory.
+        if Path(src).parent != Path(dst).parent:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        os_rename(src, dst, **kwargs)
+
+    monkeypatch.setattr(os, "rename", rename)
+    request, statistics = make_round()
+    results_filepath = tmp_path / results_key(request.round)
+    results_filepath.write_text("results")
+
+    spool = ResultsSpool(tmp_path / "spool")
+    entry = spool.add(request, statistics, results_filepath)
+    assert not results_filepath.exists()
+    assert spool.results_filepath(entry).read_text() == "results"
@@ -1,5 +1,6 @@
 from uuid import uuid4
 
+from iris.commons.models import AgentQueue
 from iris.commons.models.agent import Agent, AgentState
 from iris.commons.models.pagination import Paginated
 from tests.assertions import assert_response, assert_status_code
@@ -77,3 +78,16 @@ async def test_get_agent(make_client, make_user, make_agent_parameters, redis):
     )
     await register_agent(redis, agent.uuid, agent.parameters, agent.state)
     assert_response(client.get(f"/agents/{agent.uuid}"), agent)
+
+
+async def test_get_agent_queue(make_client, make_user, make_agent_parameters, redis):
+    client = make_client(make_user(probing_enabled=True))
+    agent_uuid = str(uuid4())
+    await register_agent(redis, agent_uuid, make_agent_parameters(), AgentState.Idle)
+    response = client.get(f"/agents/{agent_uuid}/queue")
+    assert_response(response, AgentQueue(depth=0, running=[], queued=[]))
+
+
+async def test_get_agent_queue_not_found(make_client, make_user):
+    client = make_client(make_user(probing_enabled=True))
+    assert_status_code(client.get(f"/agents/{uuid4()}/queue"), 404)
@@ -0,0 +1,213 @@
+import subprocess
+import sys
+from itertools import count
+from threading import Lock
+from time import sleep
+
+import pytest
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.multiprocess import MultiProcessCollector
+from pych_client.exceptions import ClickHouseException
+
+from iris.commons.adaptive import (
+    MEMORY_LIMIT_EXCEEDED,
+    AdaptiveController,
+    adaptive_controller,
+    cgroup_cpu_quota,
+    execute_adaptive,
+)
+
+clock = count()
+
+
+def run_window(controller, throughput, latency=1.0):
+    """Complete a window of requests, one second long, at the given throughput."""
+    controller.start(now=next(clock))
+    now = next(clock)
+    for _ in range(controller.concurrency):
+        controller.record(throughput // controller.concurrency, latency, now=now)
+
+
+def test_controller_climbs_to_the_best_throughput():
+    controller = AdaptiveController(
+        "test_controller_climbs", concurrency=1, max_concurrency=8
+    )
+    # The throughput increases up to 4 concurrent requests, then decreases.
+    throughputs = {1: 100, 2: 200, 3: 300, 4: 400, 5: 300, 6: 200}
+    for _ in range(10):
+        run_window(controller, throughputs[controller.concurrency])
+    assert 3 <= controller.concurrency <= 5
+    labels = {"operation": "test_controller_climbs"}
+    assert REGISTRY.get_sample_value("iris_adaptive_concurrency", labels) in (3, 4, 5)
+    assert REGISTRY.get_sample_value(
+        "iris_adaptive_decisions_total", {**labels, "decision": "reverse"}
+    )
+
+
+def test_controller_latency_target():
+    controller = AdaptiveController(
+        "test_controller_latency", concurrency=4, max_concurrency=8, latency_target=10
+    )
+    run_window(controller, 400, latency=20)
+    assert controller.concurrency == 3
+
+
+def test_controller_backoff_and_ramp_up():
+    controller = AdaptiveController(
+        "test_controller_backoff",
+        concurrency=4,
+        max_concurrency=8,
+        chunk_size=64,
+        max_chunk_size=64,
+        min_chunk_size=16,
+    )
+    controller.backoff()
+    controller.backoff()
+    controller.backoff()
+    assert (controller.concurrency, controller.chunk_size) == (1, 16)
+    assert (
+        REGISTRY.get_sample_value(
+            "iris_adaptive_chunk_size", {"operation": "test_controller_backoff"}
+        )
+        == 16
+    )
+    run_window(controller, 100)
+    run_window(controller, 200)
+    run_window(controller, 300)
+    assert controller.chunk_size == 64
+
+
+def test_controller_no_ramp_up_over_latency_target():
+    controller = AdaptiveController(
+        "test_controller_no_ramp_up",
+        concurrency=4,
+        max_concurrency=8,
+        chunk_size=64,
+        max_chunk_size=64,
+        min_chunk_size=16,
+        latency_target=10,
+    )
+    controller.backoff()
+    assert controller.chunk_size == 32
+    # ClickHouse is still slow after the memory error.
+    run_window(controller, 100, latency=20)
+    assert (controller.concurrency, controller.chunk_size) == (1, 32)
+    run_window(controller, 200)
+    assert controller.chunk_size == 64
+
+
+def test_adaptive_controller_shared():
+    controller = adaptive_controller(
+        "test_adaptive_controller_shared", concurrency=1, max_concurrency=2
+    )
+    assert (
+        adaptive_controller(
+            "test_adaptive_controller_shared", concurrency=2, max_concurrency=4
+        )
+        is controller
+    )
+
+
+def test_execute_adaptive_concurrency():
+    controller = AdaptiveController(
+        "test_execute_adaptive_concurrency", concurrency=2, max_concurrency=4
+    )
+    lock = Lock()
+    in_flight = [0]
+    max_in_flight = [0]
+    concurrencies = []
+
+    def func(item):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            concurrencies.append(controller.concurrency)
+        sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+
+    assert execute_adaptive(controller, func, iter(range(20))) == 20
+    assert max_in_flight[0] <= max(concurrencies)
+    assert max(concurrencies) > 2
+
+
+def test_execute_adaptive_memory_limit_exceeded():
+    controller = AdaptiveController(
+        "test_execute_adaptive_memory",
+        concurrency=4,
+        max_concurrency=4,
+        chunk_size=64,
+        max_chunk_size=64,
+        min_chunk_size=16,
+    )
+    failed = set()
+    done = []
+
+    def func(item):
+        if item % 2 and item not in failed:
+            failed.add(item)
+            raise ClickHouseException(MEMORY_LIMIT_EXCEEDED, "", "")
+        done.append(item)
+
+    assert execute_adaptive(controller, func, range(8)) == 8
+    assert sorted(done) == list(range(8))
+    assert (
+        REGISTRY.get_sample_value(
+            "iris_adaptive_decisions_total",
+            {"operation": "test_execute_adaptive_memory", "decision": "backoff"},
+        )
+        == 4
+    )
+
+
+def test_execute_adaptive_error():
+    controller = AdaptiveController(
+        "test_execute_adaptive_error", concurrency=1, max_concurrency=1
+    )
+
+    def func(item):
+        raise ClickHouseException(MEMORY_LIMIT_EXCEEDED, "", "")
+
+    with pytest.raises(ClickHouseException):
+        execute_adaptive(controller, func, range(8), retries=2)
+
+
+def test_cgroup_cpu_quota(tmp_path):
+    assert cgroup_cpu_quota(tmp_path) is None
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert cgroup_cpu_quota(tmp_path) is None
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    assert cgroup_cpu_quota(tmp_path) == 1.5
+
+
+def test_cgroup_v1_cpu_quota(tmp_path):
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("-1\n")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert cgroup_cpu_quota(tmp_path) is None
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("200000\n")
+    assert cgroup_cpu_quota(tmp_path) == 2
+
+
+def test_controller_metrics_multiprocess(tmp_path):
+    # As in a dramatiq worker: the actors are imported before the Prometheus
+    # middleware sets the multi-process directory in `after_process_boot`.
+    code = f"""
+import os
+import iris.worker.watch
+from iris.commons.adaptive import AdaptiveController
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = {str(tmp_path)!r}
+AdaptiveController("test_multiprocess", concurrency=2, max_concurrency=4).backoff()
+"""
+    subprocess.run([sys.executable, "-c", code], check=True)
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry, path=str(tmp_path))
+    labels = {"operation": "test_multiprocess"}
+    assert registry.get_sample_value(
+        "iris_adaptive_decisions_total", {**labels, "decision": "backoff"}
+    )
+    assert any(
+        sample.name == "iris_adaptive_concurrency" and sample.value == 1
+        for metric in registry.collect()
+        for sample in metric.samples
+    )
@@ -1,8 +1,10 @@
 from uuid import uuid4
 
 import pytest
+from diamond_miner.queries import links_table, prefixes_table, results_table
 from pych_client.exceptions import ClickHouseException
 
+from iris.commons.clickhouse import measurement_id
 from iris.commons.test import compress_file
 
 
@@ -16,7 +18,9 @@ async def test_call_error(clickhouse):
         await clickhouse.call("SELECT invalid")
 
 
-async def test_insert_results(clickhouse, tmp_path):
+@pytest.mark.parametrize("mode", ["compressed", "split", "stream"])
+async def test_insert_results(clickhouse, tmp_path, mode):
+    clickhouse.settings.CLICKHOUSE_INSERT_CSV_MODE = mode
     measurement_uuid = str(uuid4())
     agent_uuid = str(uuid4())
 
@@ -39,9 +43,16 @@ async def test_insert_results(clickhouse, tmp_path):
     )
     assert await clickhouse.insert_prefixes(measurement_uuid, agent_uuid) is None
     assert await clickhouse.insert_links(measurement_uuid, agent_uuid) is None
+    rows = await clickhouse.call(
+        "SELECT count() AS count FROM {table:Identifier}",
+        params={"table": results_table(measurement_id(measurement_uuid, agent_uuid))},
+    )
+    assert rows == [{"count": 3}]
 
 
-async def test_insert_results_invalid(clickhouse, tmp_path):
+@pytest.mark.parametrize("mode", ["compressed", "split", "stream"])
+async def test_insert_results_invalid(clickhouse, tmp_path, mode):
+    clickhouse.settings.CLICKHOUSE_INSERT_CSV_MODE = mode
     measurement_uuid = str(uuid4())
     agent_uuid = str(uuid4())
 
@@ -55,3 +66,42 @@ async def test_insert_results_invalid(clickhouse, tmp_path):
     )
     with pytest.raises(ClickHouseException):
         await clickhouse.insert_csv(measurement_uuid, agent_uuid, results_file)
+
+
+async def test_insert_derived_tables_incremental(clickhouse, tmp_path):
+    header = "capture_timestamp,probe_protocol,probe_src_addr,probe_dst_addr,probe_src_port,probe_dst_port,probe_ttl,quoted_ttl,reply_src_addr,reply_protocol,reply_icmp_type,reply_icmp_code,reply_ttl,reply_size,reply_mpls_labels,rtt,round"
+    rounds = [
+        """1640006077,1,::ffff:172.17.0.2,::ffff:1.0.0.1,24000,0,1,1,::ffff:10.0.0.1,1,11,0,64,59,"[]",1,1
+1640006077,1,::ffff:172.17.0.2,::ffff:1.0.0.1,24000,0,3,1,::ffff:10.0.0.3,1,11,0,64,59,"[]",1,1
+1640006077,1,::ffff:172.17.0.2,::ffff:2.0.0.1,24000,0,1,1,::ffff:10.0.0.1,1,11,0,64,59,"[]",1,1
+1640006077,1,::ffff:172.17.0.2,::ffff:2.0.0.1,24000,0,2,1,::ffff:10.0.0.2,1,11,0,64,59,"[]",1,1
+""",
+        # The reply at TTL 2 completes the links of 1.0.0.0/24 seen at the first round.
+        """1640006077,1,::ffff:172.17.0.2,::ffff:1.0.0.1,24000,0,2,1,::ffff:10.0.0.2,1,11,0,64,59,"[]",1,2
+""",
+    ]
+
+    async def derived_tables(incremental):
+        clickhouse.settings.CLICKHOUSE_INCREMENTAL_DERIVED_TABLES = incremental
+        measurement_uuid = str(uuid4())
+        agent_uuid = str(uuid4())
+        await clickhouse.create_tables(measurement_uuid, agent_uuid, 24, 64, drop=True)
+        for i, results in enumerate(rounds):
+            results_file = tmp_path / f"results_{incremental}_{i}.csv"
+            results_file.write_text(f"{header}\n{results}")
+            results_file = compress_file(results_file)
+            await clickhouse.insert_csv(measurement_uuid, agent_uuid, results_file)
+            await clickhouse.insert_prefixes(measurement_uuid, agent_uuid)
+            await clickhouse.insert_links(measurement_uuid, agent_uuid)
+        measurement_id_ = measurement_id(measurement_uuid, agent_uuid)
+        tables = {}
+        for table in [links_table(measurement_id_), prefixes_table(measurement_id_)]:
+            rows = await clickhouse.call(
+                "SELECT * FROM {table:Identifier}", params={"table": table}
+            )
+            tables[table.partition("__")[0]] = sorted(rows, key=str)
+        return tables
+
+    tables = await derived_tables(incremental=True)
+    assert len(tables["links"]) == 3
+    assert tables == await derived_tables(incremental=False)
@@ -1,8 +1,11 @@
 import secrets
 from uuid import uuid4
 
-from iris.commons.filesplit import split_compressed_file
+from zstandard import ZstdCompressor
+
+from iris.commons.filesplit import split_compressed_file, split_lines, zstd_frames
 from iris.commons.test import compress_file
+from iris.commons.utils import zstd_stream_reader
 
 
 def test_split_compressed_file(tmp_path):
@@ -31,3 +34,78 @@ def test_split_compressed_file_skip_lines(tmp_path):
     for file in sorted(tmp_path.glob("split_*")):
         actual += file.read_text()
     assert actual == expected[(256 + 1) * 10 :]
+
+
+def test_split_lines(tmp_path):
+    file = tmp_path / str(uuid4())
+    compressed_file = file.with_suffix(".csv.zst")
+    expected = "\n".join(secrets.token_hex(128) for _ in range(1000))
+    file.write_text(expected)
+    compress_file(file, compressed_file)
+    with zstd_stream_reader(compressed_file) as f:
+        chunks = list(split_lines(f, 100 * 257, read_size=1000, skip_lines=10))
+    assert len(chunks) == 10
+    assert all(chunk.endswith(b"\n") for chunk in chunks[:-1])
+    assert b"".join(chunks).decode() == expected[(256 + 1) * 10 :]
+
+
+def compress_frames(lines, lines_per_frame, output_file):
+    ctx = ZstdCompressor()
+    with open(output_file, "wb") as f:
+        for i in range(0, len(lines), lines_per_frame):
+            f.write(ctx.compress("".join(lines[i : i + lines_per_frame]).encode()))
+
+
+def read_splits(prefix):
+    files = sorted(
+        prefix.parent.glob(f"{prefix.name}*"),
+        key=lambda x: [
+            int(i) for i in x.name.removeprefix(prefix.name).strip("_").split("_")
+        ],
+    )
+    return [file.read_text() for file in files]
+
+
+def test_split_compressed_file_exact_lines(tmp_path):
+    file = tmp_path / str(uuid4())
+    compressed_file = file.with_suffix(".csv.zst")
+    lines = [secrets.token_hex(secrets.randbelow(64) + 1) + "\n" for _ in range(1000)]
+    file.write_text("".join(lines))
+    compress_file(file, compressed_file)
+    split_compressed_file(compressed_file, tmp_path / "split_", lines_per_file=300)
+    splits = read_splits(tmp_path / "split_")
+    assert [split.count("\n") for split in splits] == [300, 300, 300, 100]
+    assert "".join(splits) == "".join(lines)
+
+
+def test_split_compressed_file_multi_frames(tmp_path):
+    compressed_file = tmp_path / "multi.csv.zst"
+    lines = [secrets.token_hex(16) + "\n" for _ in range(1000)]
+    compress_frames(lines, 100, compressed_file)
+    with compressed_file.open("rb") as f:
+        assert len(zstd_frames(f)) == 10
+    split_compressed_file(
+        compressed_file,
+        tmp_path / "split_",
+        lines_per_file=30,
+        skip_lines=1,
+        processes=4,
+    )
+    splits = read_splits(tmp_path / "split_")
+    assert all(split.count("\n") <= 30 for split in splits)
+    assert "".join(splits) == "".join(lines[1:])
+
+
+def test_split_compressed_file_multi_frames_unaligned(tmp_path):
+    compressed_file = tmp_path / "multi.csv.zst"
+    content = "".join(secrets.token_hex(16) + "\n" for _ in range(1000))
+    ctx = ZstdCompressor()
+    with compressed_file.open("wb") as f:
+        for i in range(0, len(content), 1001):
+            f.write(ctx.compress(content[i : i + 1001].encode()))
+    split_compressed_file(
+        compressed_file, tmp_path / "split_", lines_per_file=100, processes=4
+    )
+    splits = read_splits(tmp_path / "split_")
+    assert len(splits) == 10
+    assert "".join(splits) == content
@@ -0,0 +1,67 @@
+import subprocess
+import sys
+
+import pytest
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from iris.commons.instrumentation import record_stages, stage
+
+
+def test_stage_no_recorder():
+    with stage("test_stage_no_recorder") as stats:
+        stats.rows = 1
+    assert stats.duration > 0
+    assert (
+        REGISTRY.get_sample_value(
+            "iris_stage_duration_seconds_sum", {"stage": "test_stage_no_recorder"}
+        )
+        > 0
+    )
+
+
+def test_stage_multiprocess(tmp_path):
+    # As in a dramatiq worker: the actors are imported before the Prometheus
+    # middleware sets the multi-process directory in `after_process_boot`.
+    code = f"""
+import os
+import iris.worker.watch
+from iris.commons.instrumentation import stage
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = {str(tmp_path)!r}
+with stage("test_stage_multiprocess") as stats:
+    stats.bytes = 1024
+"""
+    subprocess.run([sys.executable, "-c", code], check=True)
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry, path=str(tmp_path))
+    labels = {"stage": "test_stage_multiprocess"}
+    assert registry.get_sample_value("iris_stage_duration_seconds_count", labels) == 1
+    assert registry.get_sample_value("iris_stage_bytes_sum", labels) == 1024
+
+
+def test_record_stages():
+    with record_stages() as stages:
+        with stage("download_file", key="results.csv.zst") as stats:
+            stats.bytes = 1024
+        with pytest.raises(RuntimeError):
+            with stage("insert_csv"):
+                raise RuntimeError
+    with stage("not_recorded"):
+        pass
+    assert [(s.name, s.key, s.bytes) for s in stages] == [
+        ("download_file", "results.csv.zst", 1024),
+        ("insert_csv", None, None),
+    ]
+
+
+def test_record_stages_nested():
+    with record_stages() as outer:
+        with stage("a"):
+            pass
+        with record_stages() as inner:
+            with stage("b"):
+                pass
+        with stage("c"):
+            pass
+    assert [s.name for s in outer] == ["a", "c"]
+    assert [s.name for s in inner] == ["b"]
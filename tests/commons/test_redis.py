@@ -1,8 +1,10 @@
 import asyncio
+from datetime import datetime
 from uuid import uuid4
 
 import pytest
 
+from iris.commons.models import ProbingProgress
 from iris.commons.models.agent import Agent, AgentState
 from iris.commons.models.measurement_round_request import MeasurementRoundRequest
 from iris.commons.models.round import Round
@@ -122,35 +124,146 @@ async def test_set_measurement_stats(redis, make_probing_statistics):
     assert await redis.get_measurement_stats(measurement_uuid, agent_uuid) is None
 
 
-async def test_get_random_request_empty(redis):
+async def test_set_measurement_progress(redis):
+    agent_uuid = str(uuid4())
+    measurement_uuid = str(uuid4())
+    progress = ProbingProgress(
+        round=Round(number=1, limit=10, offset=0),
+        start_time=datetime.utcnow(),
+        update_time=datetime.utcnow(),
+        probing_rate=100,
+        effective_rate=99.5,
+        probes_read=10,
+        packets_sent=10,
+    )
+
+    await redis.set_measurement_progress(
+        measurement_uuid, agent_uuid, progress, ttl_seconds=60
+    )
+    assert (
+        await redis.get_measurement_progress(measurement_uuid, agent_uuid) == progress
+    )
+
+    await redis.delete_measurement_progress(measurement_uuid, agent_uuid)
+    assert await redis.get_measurement_progress(measurement_uuid, agent_uuid) is None
+
+
+async def test_get_next_request_empty(redis):
     with pytest.raises(asyncio.TimeoutError):
-        await asyncio.wait_for(
-            redis.get_random_request(str(uuid4()), interval=0.1), 0.5
-        )
+        await asyncio.wait_for(redis.get_next_request(str(uuid4()), interval=0.1), 0.5)
 
 
-async def test_get_random_request(redis):
+async def test_get_next_request(redis):
     agent_uuid = str(uuid4())
     request_1 = MeasurementRoundRequest(
         measurement_uuid=str(uuid4()),
         probe_filename="request_1",
         probing_rate=100,
         round=Round(number=1, limit=10, offset=0),
+        user_id="user",
     )
     request_2 = MeasurementRoundRequest(
         measurement_uuid=str(uuid4()),
-        probe_filename="request_1",
+        probe_filename="request_2",
         probing_rate=100,
         round=Round(number=1, limit=10, offset=0),
+        user_id="user",
+        priority=1,
     )
 
     await redis.set_request(agent_uuid, request_1)
     await redis.set_request(agent_uuid, request_2)
-    assert await redis.get_random_request(agent_uuid) in (request_1, request_2)
+    # The running requests are not returned again.
+    assert await redis.get_next_request(agent_uuid) == request_2
+    assert await redis.get_next_request(agent_uuid) == request_1
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(redis.get_next_request(agent_uuid, interval=0.1), 0.5)
 
     await redis.delete_request(request_1.measurement_uuid, agent_uuid)
-    assert await redis.get_random_request(agent_uuid) == request_2
+    await redis.delete_running_requests(agent_uuid)
+    assert await redis.get_next_request(agent_uuid) == request_2
 
     await redis.delete_request(request_2.measurement_uuid, agent_uuid)
     with pytest.raises(asyncio.TimeoutError):
-        await asyncio.wait_for(redis.get_random_request(agent_uuid, interval=0.1), 0.5)
+        await asyncio.wait_for(redis.get_next_request(agent_uuid, interval=0.1), 0.5)
+
+
+async def test_get_next_request_wakeup(redis):
+    agent_uuid = str(uuid4())
+    request = MeasurementRoundRequest(
+        measurement_uuid=str(uuid4()),
+        probe_filename="request",
+        round=Round(number=1, limit=10, offset=0),
+    )
+    task = asyncio.create_task(redis.get_next_request(agent_uuid, interval=60))
+    await asyncio.sleep(0.1)
+    await redis.set_request(agent_uuid, request)
+    assert await asyncio.wait_for(task, 1) == request
+
+
+async def test_get_agent_queue(redis, make_agent_parameters):
+    agent_uuid = str(uuid4())
+    requests = [
+        MeasurementRoundRequest(
+            measurement_uuid=str(uuid4()),
+            probe_filename=f"request_{i}",
+            round=Round(number=1, limit=10, offset=0),
+            user_id=f"user_{i}",
+        )
+        for i in range(3)
+    ]
+    await redis.set_agent_parameters(
+        agent_uuid, make_agent_parameters(max_concurrent_rounds=1)
+    )
+    for request in requests:
+        await redis.set_request(agent_uuid, request)
+    running = await redis.get_next_request(agent_uuid)
+    await redis.record_round_duration(agent_uuid, 10)
+
+    queue = await redis.get_agent_queue(agent_uuid)
+    assert queue.depth == 2
+    assert queue.running == [running]
+    assert queue.round_duration == 10
+    assert [x.position for x in queue.queued] == [0, 1]
+    assert [x.expected_wait for x in queue.queued] == [10, 20]
+
+
+async def test_results_notifications(redis):
+    measurement_uuid = str(uuid4())
+    agent_uuid = str(uuid4())
+    assert not await redis.wait_results(measurement_uuid, agent_uuid, 0.1)
+
+    await redis.notify_results(measurement_uuid, agent_uuid, "results_1:10:0")
+    await redis.notify_results(measurement_uuid, agent_uuid, "results_1:10:1")
+    assert (
+        await redis.wait_results(measurement_uuid, agent_uuid, 0.1) == "results_1:10:0"
+    )
+
+    await redis.delete_results_notifications(measurement_uuid, agent_uuid)
+    assert not await redis.wait_results(measurement_uuid, agent_uuid, 0.1)
+
+
+async def test_sent_rounds(redis):
+    agent_uuid = str(uuid4())
+    request = MeasurementRoundRequest(
+        measurement_uuid=str(uuid4()),
+        probe_filename="request",
+        probing_rate=100,
+        round=Round(number=1, limit=10, offset=1),
+    )
+    assert not await redis.is_round_sent(
+        request.measurement_uuid, agent_uuid, request.round
+    )
+
+    await redis.set_request(agent_uuid, request)
+    assert await redis.is_round_sent(
+        request.measurement_uuid, agent_uuid, request.round
+    )
+    assert not await redis.is_round_sent(
+        request.measurement_uuid, agent_uuid, Round(number=1, limit=10, offset=2)
+    )
+
+    await redis.delete_sent_rounds(request.measurement_uuid, agent_uuid)
+    assert not await redis.is_round_sent(
+        request.measurement_uuid, agent_uuid, request.round
+    )
@@ -1,4 +1,5 @@
 import logging
+import os
 from uuid import uuid4
 
 import pytest
@@ -28,6 +29,85 @@ async def test_delete_bucket(storage, make_bucket):
     assert bucket not in await storage.get_measurement_buckets()
 
 
+async def test_pooled_client(settings, logger, make_bucket, make_tmp_file, tmp_path):
+    bucket = make_bucket()
+    tmp_file = make_tmp_file()
+    async with Storage.open(settings, logger) as storage:
+        assert storage.s3_client
+        await storage.create_bucket(bucket)
+        await upload_file(storage, bucket, tmp_file)
+        await storage.download_file(bucket, tmp_file["name"], tmp_path / "download")
+        await storage.delete_bucket_with_files(bucket)
+    assert (tmp_path / "download").read_text() == tmp_file["content"]
+
+
+async def test_upload_download_multipart(storage, make_bucket, tmp_path):
+    storage.settings.S3_MULTIPART_THRESHOLD = 5 * 2**20
+    storage.settings.S3_MULTIPART_CHUNK_SIZE = 5 * 2**20
+    bucket = make_bucket()
+    content = os.urandom(12 * 2**20 + 1)
+    (tmp_path / "upload").write_bytes(content)
+
+    await storage.create_bucket(bucket)
+    await storage.upload_file(bucket, "file", tmp_path / "upload")
+    await storage.download_file(bucket, "file", tmp_path / "download")
+    assert (tmp_path / "download").read_bytes() == content
+
+
+async def test_upload_file_resumable(storage, make_bucket, tmp_path):
+    storage.settings.S3_MULTIPART_THRESHOLD = 5 * 2**20
+    storage.settings.S3_MULTIPART_CHUNK_SIZE = 5 * 2**20
+    bucket = make_bucket()
+    content = os.urandom(12 * 2**20 + 1)
+    (tmp_path / "upload").write_bytes(content)
+    await storage.create_bucket(bucket)
+
+    # Upload the first part, as if the upload had been interrupted.
+    async with storage.client() as s3:
+        response = await s3.create_multipart_upload(Bucket=bucket, Key="file")
+        await s3.upload_part(
+            Bucket=bucket,
+            Key="file",
+            UploadId=response["UploadId"],
+            PartNumber=1,
+            Body=content[: 5 * 2**20],
+        )
+
+    upload = {"upload_id": response["UploadId"]}
+    await storage.upload_file_resumable(bucket, "file", tmp_path / "upload", upload)
+    await storage.download_file(bucket, "file", tmp_path / "download")
+    assert (tmp_path / "download").read_bytes() == content
+
+    # Unknown uploads are started again.
+    checkpoints = []
+    upload = {"upload_id": "unknown"}
+    await storage.upload_file_resumable(
+        bucket, "file", tmp_path / "upload", upload, checkpoint=checkpoints.append
+    )
+    assert upload["upload_id"] != "unknown"
+    assert checkpoints == [upload]
+
+
+async def test_upload_iter_chunks(storage, make_bucket):
+    storage.settings.S3_MULTIPART_CHUNK_SIZE = 5 * 2**20
+    bucket = make_bucket()
+    content = os.urandom(12 * 2**20 + 1)
+
+    async def chunks(data, size):
+        for i in range(0, len(data), size):
+            yield data[i : i + size]
+
+    await storage.create_bucket(bucket)
+    # Small streams are uploaded in a single request.
+    assert await storage.upload_chunks(bucket, "small", chunks(b"abc", 1)) == 3
+    assert b"".join([c async for c in storage.iter_file(bucket, "small")]) == b"abc"
+    # Large streams are uploaded in multiple parts.
+    assert await storage.upload_chunks(
+        bucket, "large", chunks(content, 2**20)
+    ) == len(content)
+    assert b"".join([c async for c in storage.iter_file(bucket, "large")]) == content
+
+
 async def test_upload_file(storage, make_bucket, make_tmp_file):
     bucket = make_bucket()
     tmp_file = make_tmp_file()
@@ -98,6 +178,29 @@ async def test_get_all_files(storage, make_bucket, make_tmp_file):
         assert file["size"] == len(tmp_file["content"])
 
 
+async def test_get_keys(storage, make_bucket, make_tmp_file):
+    bucket = make_bucket()
+    await storage.create_bucket(bucket)
+
+    tmp_files = [make_tmp_file("results_1"), make_tmp_file("next_round_1")]
+    for tmp_file in tmp_files:
+        await upload_file(storage, bucket, tmp_file)
+
+    assert sorted(await storage.get_keys(bucket)) == ["next_round_1", "results_1"]
+    assert await storage.get_keys(bucket, prefix="results_") == ["results_1"]
+    assert await storage.get_keys(bucket, prefix="targets_") == []
+
+
+async def test_get_file_size(storage, make_bucket, make_tmp_file):
+    bucket = make_bucket()
+    tmp_file = make_tmp_file()
+    await storage.create_bucket(bucket)
+    await upload_file(storage, bucket, tmp_file)
+    assert await storage.get_file_size(bucket, tmp_file["name"]) == len(
+        tmp_file["content"]
+    )
+
+
 async def test_delete_file_check(storage, make_bucket, make_tmp_file):
     bucket = make_bucket()
     tmp_file = make_tmp_file()
@@ -159,3 +262,63 @@ async def test_generate_credentials(settings, storage, make_tmp_file):
     assert file["metadata"] == tmp_file["metadata"]
     assert file["key"] == tmp_file["name"]
     assert file["size"] == len(tmp_file["content"])
+
+
+class FlakyS3:
+    """Fake S3 client whose `upload_part` fails for the given part numbers."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.parts = {}
+        self.aborted = False
+
+    async def create_multipart_upload(self, **kwargs):
+        return {"UploadId": "upload"}
+
+    async def upload_part(self, PartNumber, Body, **kwargs):
+        if self.failures.get(PartNumber, 0) > 0:
+            self.failures[PartNumber] -= 1
+            raise ConnectionError
+        self.parts[PartNumber] = Body
+        return {"ETag": str(PartNumber)}
+
+    async def complete_multipart_upload(self, **kwargs):
+        pass
+
+    async def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+
+
+async def test_upload_chunks_retry_part(settings, logger):
+    settings.S3_MULTIPART_CHUNK_SIZE = 5 * 2**20
+    settings.RETRY_TIMEOUT = 60
+    settings.RETRY_TIMEOUT_RANDOM_MAX = 0
+    s3 = FlakyS3({2: 1})
+    storage = Storage(settings, logger, s3_client=s3)
+
+    async def chunks():
+        for _ in range(3):
+            yield b"x" * 5 * 2**20
+
+    assert await storage.upload_chunks("bucket", "file", chunks()) == 15 * 2**20
+    assert sorted(s3.parts) == [1, 2, 3]
+
+
+async def test_upload_chunks_failed_part(settings, logger):
+    settings.S3_MULTIPART_CHUNK_SIZE = 5 * 2**20
+    settings.S3_MULTIPART_CONCURRENCY = 1
+    s3 = FlakyS3({1: 1})
+    storage = Storage(settings, logger, s3_client=s3)
+    n_chunks = 0
+
+    async def chunks():
+        nonlocal n_chunks
+        for _ in range(10):
+            n_chunks += 1
+            yield b"x" * 5 * 2**20
+
+    with pytest.raises(ConnectionError):
+        await storage.upload_chunks("bucket", "file", chunks())
+    # The failure is raised before reading the rest of the stream.
+    assert n_chunks == 2
+    assert s3.aborted
@@ -4,6 +4,7 @@ from ipaddress import IPv4Address, IPv6Address
 from iris.commons.utils import (
     get_internal_ipv4_address,
     get_internal_ipv6_address,
+    get_ip_from_endpoints,
     zstd_stream_reader,
     zstd_stream_reader_text,
     zstd_stream_writer,
@@ -68,6 +69,18 @@ def test_get_ipv6_address_error(monkeypatch):
     assert not get_internal_ipv6_address()
 
 
+async def test_get_ip_from_endpoints(tmp_path):
+    (tmp_path / "invalid").write_text("invalid\n")
+    (tmp_path / "valid").write_text("192.0.2.1\n")
+    endpoints = [
+        (tmp_path / "missing").as_uri(),
+        (tmp_path / "invalid").as_uri(),
+        (tmp_path / "valid").as_uri(),
+    ]
+    assert await get_ip_from_endpoints(endpoints, "ipv4") == IPv4Address("192.0.2.1")
+    assert await get_ip_from_endpoints(endpoints, "ipv6") is None
+
+
 def test_zstd_stream(tmp_path):
     file = tmp_path / "test.zst"
     with zstd_stream_writer(file) as f:
@@ -69,8 +69,10 @@ def api_settings(settings):
 def agent_settings(settings, tmp_path):
     return AgentSettings(
         **settings.dict(),
+        AGENT_DISCOVERY_CACHE_PATH=tmp_path / "agent_discovery.json",
         AGENT_MIN_TTL=0,
         AGENT_RESULTS_DIR_PATH=tmp_path / "agent_results",
+        AGENT_SPOOL_DIR_PATH=tmp_path / "agent_spool",
         AGENT_TARGETS_DIR_PATH=tmp_path / "agent_targets",
     )
 
@@ -1,9 +1,15 @@
+import tracemalloc
 from uuid import uuid4
 
 from iris.commons.models.diamond_miner import ToolParameters
 from iris.commons.models.round import Round
 from iris.commons.test import compress_file, decompress_file
-from iris.worker.inner_pipeline import diamond_miner_inner_pipeline
+from iris.worker.inner_pipeline import diamond_miner, diamond_miner_inner_pipeline
+from iris.worker.inner_pipeline.diamond_miner import (
+    insert_probe_counts_batched,
+    resolve_prefixes,
+)
+from iris.worker.tree import TargetIndex, parse_prefix
 
 targets_content = "1.0.0.0/23,icmp,0,32,6\n2001::/63,icmp6,0,32,6"
 
@@ -31,6 +37,7 @@ async def test_default_inner_pipeline_round_1_0(clickhouse, logger, tmp_path):
         previous_round=None,
         next_round=Round(number=1, limit=10, offset=0),
         max_open_files=128,
+        probe_counts_batch_size=100_000,
     )
 
     probes_filepath = decompress_file(probes_filepath)
@@ -66,6 +73,7 @@ async def test_default_inner_pipeline_round_1_1_no_results(
         previous_round=Round(number=1, limit=10, offset=0),
         next_round=Round(number=1, limit=10, offset=1),
         max_open_files=128,
+        probe_counts_batch_size=100_000,
     )
     assert n_probes == 0
     assert not probes_filepath.exists()
@@ -105,6 +113,7 @@ async def test_default_inner_pipeline_round_1_1_results(clickhouse, logger, tmp_
         previous_round=Round(number=1, limit=10, offset=0),
         next_round=Round(number=1, limit=10, offset=1),
         max_open_files=128,
+        probe_counts_batch_size=100_000,
     )
 
     decompress_file(probes_filepath, probes_filepath.with_suffix(".csv"))
@@ -143,7 +152,83 @@ async def test_default_inner_pipeline_round_2(clickhouse, logger, tmp_path):
         previous_round=Round(number=1, limit=10, offset=1),
         next_round=Round(number=2, limit=0, offset=0),
         max_open_files=128,
+        probe_counts_batch_size=100_000,
     )
     # No load-balancing, so Diamond-Miner should stop here.
     assert n_probes == 0
     assert not probes_filepath.exists()
+
+
+def test_resolve_prefixes(logger, tmp_path):
+    targets_filepath = tmp_path / "targets.csv"
+    targets_filepath.write_text(targets_content)
+    networks = [
+        parse_prefix(prefix)[0]
+        for prefix in ["1.0.1.0", "2001:0:0:1::", "8.8.8.0", "2001:0:0:2::"]
+    ]
+    with TargetIndex.open(targets_filepath) as targets:
+        prefixes = list(
+            resolve_prefixes(logger, targets, networks, 24, 64, clamp_ttl_min=5)
+        )
+    assert prefixes == [
+        ("1.0.1.0/24", "icmp", range(5, 33), 6),
+        ("2001:0:0:1::/64", "icmp6", range(5, 33), 6),
+    ]
+
+
+def write_targets(targets_filepath, n_prefixes):
+    with targets_filepath.open("w") as f:
+        for i in range(n_prefixes):
+            f.write(f"{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}.0/24,icmp,2,2,6\n")
+
+
+def test_insert_probe_counts_batched(monkeypatch, tmp_path):
+    n_prefixes = 12_000
+    targets_filepath = tmp_path / "targets.csv"
+    write_targets(targets_filepath, n_prefixes)
+
+    n_read = 0
+    held = []
+
+    def read(prefixes):
+        nonlocal n_read
+        for prefix in prefixes:
+            n_read += 1
+            yield prefix
+
+    def insert_probe_counts(*, prefixes, **kwargs):
+        # The prefixes read but not inserted by the previous calls.
+        held.append(n_read - sum(held))
+        assert len(prefixes) == held[-1]
+
+    monkeypatch.setattr(diamond_miner, "insert_probe_counts", insert_probe_counts)
+    with TargetIndex.open(targets_filepath) as targets:
+        n_inserted = insert_probe_counts_batched(
+            None, "test", 1, read(targets.entries()), 24, 64, batch_size=5_000
+        )
+    assert n_inserted == n_read == n_prefixes
+    assert held == [5_000, 5_000, 2_000]
+
+
+def test_insert_probe_counts_batched_memory(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        diamond_miner, "insert_probe_counts", lambda *, prefixes, **kwargs: None
+    )
+
+    def peak_memory(n_prefixes):
+        targets_filepath = tmp_path / f"targets_{n_prefixes}.csv"
+        write_targets(targets_filepath, n_prefixes)
+        with TargetIndex.open(targets_filepath) as targets:
+            tracemalloc.start()
+            try:
+                insert_probe_counts_batched(
+                    None, "test", 1, targets.entries(), 24, 64, batch_size=5_000
+                )
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    small = peak_memory(10_000)
+    large = peak_memory(100_000)
+    # A list of the prefixes would take more than 15 MB for 90k more prefixes.
+    assert large - small < 2**20
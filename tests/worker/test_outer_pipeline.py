@@ -0,0 +1,150 @@
+from uuid import uuid4
+
+from iris.commons.models.diamond_miner import Tool, ToolParameters
+from iris.commons.models.round import Round
+from iris.commons.storage import Storage, next_round_key, results_key
+from iris.worker import outer_pipeline as outer_pipeline_module
+from iris.worker.outer_pipeline import outer_pipeline
+
+
+class MemoryStorage(Storage):
+    """Keep the keys of the uploaded files in memory."""
+
+    def __init__(self, settings, logger):
+        super().__init__(settings, logger)
+        self.keys: dict[str, set[str]] = {}
+
+    async def download_file_to(self, bucket, filename, output_dir):
+        output_path = output_dir / filename
+        output_path.write_text("")
+        return output_path
+
+    async def upload_file(self, bucket, filename, filepath, metadata=None):
+        self.keys.setdefault(bucket, set()).add(filename)
+
+    async def delete_file_no_check(self, bucket, filename):
+        self.keys.get(bucket, set()).discard(filename)
+        return True
+
+
+class MemoryRedis:
+    def __init__(self, agent_parameters):
+        self.agent_parameters = agent_parameters
+        self.sent_rounds = set()
+
+    async def get_agent_parameters(self, uuid):
+        return self.agent_parameters
+
+    async def is_round_sent(self, measurement_uuid, agent_uuid, round_):
+        return round_.encode() in self.sent_rounds
+
+
+class MemoryClickHouse:
+    def __init__(self):
+        self.inserted = []
+
+    async def insert_csv(self, measurement_uuid, agent_uuid, results_filepath):
+        self.inserted.append(results_filepath.name)
+
+
+def make_outer_pipeline(logger, agent_parameters, monkeypatch, settings, tmp_path):
+    """
+    Return a function that runs the outer pipeline on the results of a round,
+    the windows computed by the inner pipeline, and the results inserted.
+    """
+    computed = []
+
+    async def inner_pipeline(*, probes_filepath, next_round, **kwargs):
+        computed.append(next_round)
+        probes_filepath.write_text("")
+        return 1
+
+    monkeypatch.setitem(
+        outer_pipeline_module.inner_pipeline_for_tool,
+        Tool.DiamondMiner,
+        inner_pipeline,
+    )
+    clickhouse = MemoryClickHouse()
+    redis = MemoryRedis(agent_parameters)
+    storage = MemoryStorage(settings, logger)
+    measurement_uuid, agent_uuid, user_id = str(uuid4()), str(uuid4()), str(uuid4())
+
+    async def run(results_round, queued=None):
+        results = await outer_pipeline(
+            clickhouse=clickhouse,
+            storage=storage,
+            redis=redis,
+            logger=logger,
+            measurement_uuid=measurement_uuid,
+            agent_uuid=agent_uuid,
+            measurement_tags=[],
+            sliding_window_size=10,
+            sliding_window_stopping_condition=3,
+            tool=Tool.DiamondMiner,
+            tool_parameters=ToolParameters(global_max_ttl=30, max_round=2),
+            working_directory=tmp_path,
+            targets_key="targets.csv",
+            results_key=results_key(results_round) if results_round else None,
+            user_id=user_id,
+            max_open_files=128,
+            probe_counts_batch_size=100_000,
+            round_1_pipelining=True,
+        )
+        for result in results or []:
+            assert result.probes_key == next_round_key(result.next_round)
+            # Queue the requests, as `watch_measurement_agent_`.
+            if queued is None or result.next_round in queued:
+                redis.sent_rounds.add(result.next_round.encode())
+        return None if results is None else [r.next_round for r in results]
+
+    return run, computed, clickhouse.inserted
+
+
+round_1_0 = Round(number=1, limit=10, offset=0)
+round_1_1 = Round(number=1, limit=10, offset=1)
+round_1_2 = Round(number=1, limit=10, offset=2)
+round_2 = Round(number=2, limit=0, offset=0)
+
+
+async def test_outer_pipeline_round_1_pipelining(
+    logger, make_agent_parameters, monkeypatch, settings, tmp_path
+):
+    run, computed, inserted = make_outer_pipeline(
+        logger, make_agent_parameters(), monkeypatch, settings, tmp_path
+    )
+
+    # The second window is sent ahead of the results of the first one.
+    assert await run(None) == [round_1_0, round_1_1]
+
+    # The second window was sent ahead: the results of the first one
+    # are used to compute the third window.
+    assert await run(round_1_0) == [round_1_2]
+
+    # The third window was sent ahead and is the last one: the results
+    # of the second window are only inserted, and we wait for the third one.
+    assert await run(round_1_1) == []
+    assert inserted == [results_key(round_1_1)]
+
+    assert await run(round_1_2) == [round_2]
+    # No window is computed twice.
+    assert computed == [round_1_0, round_1_1, round_1_2, round_2]
+
+    assert await run(round_2) is None
+
+
+async def test_outer_pipeline_round_1_pipelining_not_queued(
+    logger, make_agent_parameters, monkeypatch, settings, tmp_path
+):
+    run, computed, inserted = make_outer_pipeline(
+        logger, make_agent_parameters(), monkeypatch, settings, tmp_path
+    )
+
+    # The worker restarts after the upload of the window sent ahead,
+    # before queueing it.
+    assert await run(None, queued=[round_1_0]) == [round_1_0, round_1_1]
+
+    # The window sent ahead was not queued: it is sent again, instead of waiting
+    # for its results.
+    assert await run(round_1_0) == [round_1_1]
+    assert await run(round_1_1) == [round_1_2]
+    assert computed == [round_1_0, round_1_1, round_1_1, round_1_2]
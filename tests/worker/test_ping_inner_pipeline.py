@@ -29,6 +29,7 @@ async def test_ping_inner_pipeline(clickhouse, logger, tmp_path):
         previous_round=None,
         next_round=Round(number=1, limit=10, offset=0),
         max_open_files=128,
+        probe_counts_batch_size=100_000,
     )
 
     probes_filepath = decompress_file(probes_filepath)
@@ -67,6 +68,7 @@ async def test_ping_inner_pipeline_results(clickhouse, logger, tmp_path):
         previous_round=Round(number=1, limit=10, offset=0),
         next_round=Round(number=2, limit=0, offset=0),
         max_open_files=128,
+        probe_counts_batch_size=100_000,
     )
 
     assert n_probes == 0
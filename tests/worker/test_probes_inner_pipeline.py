@@ -28,6 +28,7 @@ async def test_probes_inner_pipeline(clickhouse, logger, tmp_path):
         previous_round=None,
         next_round=Round(number=1, limit=10, offset=0),
         max_open_files=8192,
+        probe_counts_batch_size=100_000,
     )
     assert n_probes == 2
     probes_filepath = decompress_file(probes_filepath)
@@ -64,6 +65,7 @@ async def test_probes_inner_pipeline_results(clickhouse, logger, tmp_path):
         previous_round=Round(number=1, limit=10, offset=0),
         next_round=Round(number=2, limit=0, offset=0),
         max_open_files=8192,
+        probe_counts_batch_size=100_000,
     )
 
     assert n_probes == 0
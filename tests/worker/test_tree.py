@@ -0,0 +1,72 @@
+import random
+
+from iris.worker.tree import TargetIndex, load_targets, target_index_path
+
+
+def test_target_index(tmp_path):
+    # NOTE: `load_targets` merges the targets of a prefix into the targets
+    # of a larger prefix inserted before, so the prefixes do not overlap here.
+    random.seed(42)
+    lines = []
+    for _ in range(500):
+        min_ttl = random.randint(1, 20)
+        lines.append(
+            ",".join(
+                [
+                    random.choice(
+                        [
+                            f"10.{random.randint(0, 3)}.{random.randint(0, 255)}.0/24",
+                            f"11.{random.randint(0, 3)}.0.0/16",
+                            f"12.0.0.{random.randint(0, 255)}",
+                            f"2001:db8:{random.randint(0, 255):x}::/48",
+                        ]
+                    ),
+                    random.choice(["icmp", "udp"]),
+                    str(min_ttl),
+                    str(min_ttl + random.randint(0, 20)),
+                    str(random.randint(1, 6)),
+                ]
+            )
+        )
+    targets_filepath = tmp_path / "targets.csv"
+    targets_filepath.write_text("\n".join(lines) + "\n")
+
+    tree = load_targets(lines, clamp_ttl_min=5, clamp_ttl_max=15)
+    with TargetIndex.open(targets_filepath) as index:
+        assert target_index_path(targets_filepath).exists()
+        assert len(index) == len(lines)
+        assert sorted(
+            ((prefix, *target) for prefix in tree for target in tree[prefix]), key=str
+        ) == sorted(index.entries(clamp_ttl_min=5, clamp_ttl_max=15), key=str)
+        queries = [
+            *(f"{10 + i % 2}.{i % 4}.{i}.0/24" for i in range(256)),
+            *(f"2001:db8:{i:x}::/48" for i in range(256)),
+            "12.0.0.1",
+            "192.0.2.0/24",
+        ]
+        for query in queries:
+            try:
+                expected = tree[query]
+            except KeyError:
+                expected = None
+            try:
+                actual = index.lookup(query, clamp_ttl_min=5, clamp_ttl_max=15)
+            except KeyError:
+                actual = None
+            assert actual == expected, query
+
+    # The index is opened without the target list.
+    targets_filepath.unlink()
+    with TargetIndex.open(targets_filepath) as index:
+        assert len(index) == len(lines)
+
+
+def test_target_index_sorted(tmp_path):
+    lines = [f"10.0.{i}.0/24,icmp,2,{i % 32 + 2},6" for i in range(256)]
+    targets_filepath = tmp_path / "targets.csv"
+    targets_filepath.write_text("\n".join(lines) + "\n")
+    with TargetIndex.open(targets_filepath) as index:
+        assert [
+            f"{prefix},{protocol},{ttls.start},{ttls.stop - 1},{n_initial_flows}"
+            for prefix, protocol, ttls, n_initial_flows in index.entries()
+        ] == lines
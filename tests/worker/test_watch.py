@@ -1,9 +1,16 @@
+import asyncio
 from uuid import uuid4
 
+from iris.commons.models import MeasurementRoundRequest
 from iris.commons.models.agent import AgentState
 from iris.commons.models.round import Round
 from iris.commons.storage import results_key
-from iris.worker.watch import check_agent, find_results, watch_measurement_agent_
+from iris.worker.watch import (
+    check_agent,
+    find_results,
+    wait_agent_queue_clear,
+    watch_measurement_agent_,
+)
 from tests.helpers import register_agent, upload_file
 
 
@@ -47,6 +54,42 @@ async def test_find_results_not_found(storage, make_tmp_file):
     assert not filename
 
 
+async def test_wait_agent_queue_clear(redis, make_agent_parameters):
+    agent_uuid = str(uuid4())
+    request = MeasurementRoundRequest(
+        measurement_uuid=str(uuid4()),
+        probe_filename="request",
+        probing_rate=100,
+        round=Round(number=1, limit=10, offset=1),
+    )
+    await register_agent(redis, agent_uuid, make_agent_parameters(), AgentState.Working)
+    await redis.set_request(agent_uuid, request)
+
+    async def consume():
+        await asyncio.sleep(0.5)
+        await redis.delete_request(request.measurement_uuid, agent_uuid)
+
+    task = asyncio.create_task(consume())
+    assert await wait_agent_queue_clear(
+        redis, request.measurement_uuid, agent_uuid, trials=3, interval=0.1
+    )
+    assert task.done()
+
+
+async def test_wait_agent_queue_clear_offline(redis):
+    agent_uuid = str(uuid4())
+    request = MeasurementRoundRequest(
+        measurement_uuid=str(uuid4()),
+        probe_filename="request",
+        probing_rate=100,
+        round=Round(number=1, limit=10, offset=1),
+    )
+    await redis.set_request(agent_uuid, request)
+    assert not await wait_agent_queue_clear(
+        redis, request.measurement_uuid, agent_uuid, trials=3, interval=0.1
+    )
+
+
 async def test_watch_measurement_not_found(caplog, engine, worker_settings):
     await watch_measurement_agent_(str(uuid4()), str(uuid4()), worker_settings)
     assert "Measurement not found" in caplog.text